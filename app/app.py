@@ -1,11 +1,7 @@
 from flask import Flask, render_template, request, redirect, session, url_for, flash, Response
 from .user_utils import (
     init_user_if_missing,
-    get_user_failed_prompts_path,
     get_user_log_key,
-    get_user_settings_path,
-    get_user_prompts_path,
-    get_user_images_dir,
 )
 from .user_utils import list_user_image_urls
 import requests
@@ -14,8 +10,9 @@ import time
 import subprocess
 import json
 import secrets
+import hashlib
+import uuid
 from threading import Thread
-import heapq
 from flask import send_from_directory
 from flask import send_file
 import zipfile
@@ -24,14 +21,63 @@ from multiprocessing import Lock
 from subprocess import Popen
 from dotenv import load_dotenv
 load_dotenv()
+from itsdangerous import URLSafeTimedSerializer, BadSignature
 from redis import Redis
 from rq import Queue
 from io import BytesIO
 from app.tigris_utils import (
+    DOWNLOAD_CHUNK_SIZE,
     upload_file_obj,
     download_file_obj,
     generate_presigned_url,
-    delete_file,
+    get_object_stream,
+    object_exists,
+)
+from app.license_cache import (
+    LICENSE_CACHE_TTL,
+    get_license_info,
+    peek_license_info,
+    run_in_background,
+    schedule_refresh,
+)
+from app.quota_ledger import (
+    reserve_quota,
+    release_quota,
+    get_quota_used,
+    run_quota_flusher,
+)
+from app.eta_engine import (
+    estimate_job_seconds,
+    forget_job_work,
+    record_job_work,
+)
+from app.queue_snapshot import (
+    QUEUE_UPDATE_CHANNEL,
+    QUEUE_SNAPSHOT_MAX_JOBS,
+    get_queue_job_info,
+    publish_queue_event,
+    run_snapshot_refresher,
+)
+from app.job_cleanup import begin_download, hold_download_lease, request_cancel, schedule_cleanup
+from app.job_chunks import (
+    RUNNING_JOBS_HASH,
+    cancel_parent,
+    clear_job_id,
+    count_running_lanes,
+    current_chunk_ids,
+    get_job_channels,
+    get_finalizing_job,
+    get_parent_id,
+    get_parent_progress,
+    resolve_job_id,
+    start_job,
+)
+from app.result_archive import load_manifest, select_images, stream_zip
+from app.sse_hub import SSEHub
+from app.settings_store import (
+    load_user_settings,
+    save_user_settings,
+    missing_required_settings,
 )
 import pandas as pd
 from rq import Worker
@@ -39,7 +85,6 @@ from rq import Worker
 
 
 # from app.tasks import midjourney_all
-from app.tasks import run_mode
 
 from rq.job import Job
 from rq.exceptions import NoSuchJobError
@@ -57,12 +102,9 @@ process_lock = Lock()
 redis_conn = Redis.from_url(os.getenv("REDIS_URL", "redis://redis:6379/0"))
 # default_queue = Queue(connection=redis_conn)
 
-# Cache license lookups for a short time to avoid repeated network calls
-LICENSE_CACHE_TTL = int(os.getenv("LICENSE_CACHE_TTL", "30"))  # seconds
-
 
 def get_cached_license_info(email: str, license_key: str, force_refresh: bool = False) -> dict:
-    """Fetch license info, using a short-lived Redis cache when possible.
+    """Fetch license info through the shared Redis license cache.
 
     Parameters
     ----------
@@ -72,38 +114,19 @@ def get_cached_license_info(email: str, license_key: str, force_refresh: bool =
         The license key associated with the user.
     force_refresh: bool, optional
         When ``True``, bypasses any cached entry and always performs a fresh
-        ``check_license_and_quota`` call. The result will still be cached if
-        successful.
-    """
-    cache_key = f"license_cache:{email}:{license_key}"
-    old_key = f"license_cache:{email}"
-
-    try:
-        redis_conn.delete(old_key)
-    except Exception:
-        pass
+        ``check_license_and_quota`` call (shared with any lookup for the same
+        key already in flight). The result will still be cached.
 
-    if not force_refresh:
-        cached = redis_conn.get(cache_key)
-        if cached:
-            try:
-                return json.loads(cached)
-            except Exception:
-                pass
-
-    info = check_license_and_quota(email, license_key)
-
-    if info.get("success"):
-        try:
-            redis_conn.setex(cache_key, LICENSE_CACHE_TTL, json.dumps(info))
-        except Exception as e:
-            print(f"Failed to cache license info: {e}")
-
-    return info
+    See ``app.license_cache.get_license_info`` for the stale-while-revalidate
+    and negative caching rules.
+    """
+    return get_license_info(
+        redis_conn, email, license_key, check_license_and_quota, force_refresh=force_refresh
+    )
 
 
 def trigger_license_validation(email: str, license_key: str) -> None:
-    """Kick off license validation in a background thread.
+    """Kick off license validation on the background refresh pool.
 
     A placeholder status is stored immediately so the client can poll for
     updates without waiting for the network request to complete.
@@ -121,119 +144,109 @@ def trigger_license_validation(email: str, license_key: str) -> None:
         except Exception:
             pass
 
-    Thread(target=_task, daemon=True).start()
+    run_in_background(_task)
 
 
-def get_user_queue(email: str) -> Queue:
-    """Return the proper RQ Queue object for this user’s tier."""
-    key  = session.get("saved_key") or session.get("key")
-    info = get_cached_license_info(email, key)
+def get_user_queue(email: str, info: dict | None = None) -> Queue:
+    """Return the proper RQ Queue object for this user’s tier.
+
+    ``info`` is the license info (or claim) already validated for the
+    request; when omitted the session's license claim is used.
+    """
+    if info is None:
+        info = ensure_valid_license()
     tier = (info or {}).get("tier", "default")
     name = tier if tier in {"Tier1", "Tier2", "Tier3"} else "default"
     return Queue(name=name, connection=redis_conn)
 
 
-def ensure_valid_license() -> dict | None:
-    """Return cached license info when valid, otherwise ``None``.
-
-    This relies on the short-lived cache from ``get_cached_license_info``.
-    If the cache is missing or expired a fresh check is triggered.  When the
-    resulting license data indicates failure the caller should treat the
-    action as unauthorized.
-    """
-    email = session.get("email")
-    key = session.get("saved_key") or session.get("key")
-    if not email or not key:
-        return None
-    info = get_cached_license_info(email, key)
-    if not info.get("success"):
-        return None
-    return info
-
+# Signed license claim kept in the session so polling endpoints can
+# authorize requests without touching Redis or the license service.
+LICENSE_CLAIM_TTL = int(os.getenv("LICENSE_CLAIM_TTL", "300"))  # seconds
+LICENSE_CLAIM_REFRESH_AFTER = int(
+    os.getenv("LICENSE_CLAIM_REFRESH_AFTER", str(LICENSE_CLAIM_TTL // 2))
+)
+LICENSE_CLAIM_FIELDS = ("tier", "dailyQuota", "jobQuota", "promptsToday", "expiry")
+license_claim_serializer = URLSafeTimedSerializer(app.secret_key, salt="license-claim")
 
-# Rough per-prompt runtimes (seconds) for each mode
-MODE_RUNTIME = {
-    "U1": 42,
-    "U2": 42,
-    "U3": 42,
-    "U4": 42,
-    "All": 58,
-}
 
-# Average runtime of a queued job in seconds (for ETA of queue start)
-TYPICAL_JOB_RUNTIME = 300
+def _license_key_digest(license_key: str) -> str:
+    return hashlib.sha256(license_key.encode("utf-8")).hexdigest()[:16]
 
-# Redis hash used for tracking running jobs
-RUNNING_JOBS_HASH = "running_jobs"
 
-# Keys for cached queue information
-QUEUE_SNAPSHOT_KEY = "queue_snapshot"
-QUEUE_UPDATE_CHANNEL = "queue_updates"
+def issue_license_claim(email: str, license_key: str, info: dict) -> dict:
+    """Sign the relevant fields of ``info`` and store them in the session."""
+    claim = {k: info[k] for k in LICENSE_CLAIM_FIELDS if k in info}
+    claim["email"] = email
+    claim["key"] = _license_key_digest(license_key)
+    session["license_claim"] = license_claim_serializer.dumps(claim)
+    return {"success": True, **claim}
 
 
-def refresh_queue_snapshot(interval: int = 5) -> None:
-    """Periodically cache worker counts and job snapshots in Redis.
+def read_license_claim(email: str, license_key: str) -> tuple[dict | None, float]:
+    """Return ``(claim, age_seconds)`` from the session, or ``(None, 0)``.
 
-    A background thread calls this function to avoid expensive scans on
-    every request.  After updating the cache a small pubsub notification is
-    published so that SSE clients can react to the change.
+    Verification is purely local: signature, age and ownership are checked
+    without any network or Redis access.
     """
-    while True:
-        try:
-            snapshot: dict[str, dict] = {}
-            for name in ["default", "Tier1", "Tier2", "Tier3"]:
-                queue = Queue(name=name, connection=redis_conn)
-
-                worker_count = sum(
-                    name in w.queue_names() for w in Worker.all(connection=redis_conn)
-                )
-
-                running_ids = queue.started_job_registry.get_job_ids()
-                queued_jobs = queue.jobs
-
-                # Simulate worker availability using a min-heap so we can
-                # pre-compute ETA for each job quickly.
-                worker_slots = [0] * max(worker_count, 1)
-                heapq.heapify(worker_slots)
-
-                job_info: dict[str, dict] = {}
-                now = time.time()
-
-                # First account for running jobs with remaining time
-                for jid in running_ids:
-                    remaining = TYPICAL_JOB_RUNTIME
-                    try:
-                        job = Job.fetch(jid, connection=redis_conn)
-                        if job.started_at:
-                            elapsed = now - job.started_at.timestamp()
-                            remaining = max(TYPICAL_JOB_RUNTIME - elapsed, 0)
-                    except Exception:
-                        pass
-
-                    start_in = heapq.heappop(worker_slots)
-                    heapq.heappush(worker_slots, start_in + remaining)
-                    job_info[jid] = {"position": 0, "eta_seconds": start_in}
-
-                # Then queued jobs
-                pos = len(job_info)
-                for job in queued_jobs:
-                    start_in = heapq.heappop(worker_slots)
-                    heapq.heappush(worker_slots, start_in + TYPICAL_JOB_RUNTIME)
-                    job_info[job.id] = {"position": pos, "eta_seconds": start_in}
-                    pos += 1
+    token = session.get("license_claim")
+    if not token:
+        return None, 0
+    try:
+        claim, issued_at = license_claim_serializer.loads(
+            token, max_age=LICENSE_CLAIM_TTL, return_timestamp=True
+        )
+    except BadSignature:
+        return None, 0
+    if claim.get("email") != email or claim.get("key") != _license_key_digest(license_key):
+        return None, 0
+    age = time.time() - issued_at.timestamp()
+    return {"success": True, **claim}, age
+
+
+def ensure_valid_license(force_refresh: bool = False) -> dict | None:
+    """Return license info when valid, otherwise ``None``.
+
+    A fresh signed claim in the session is accepted without any I/O.  Once
+    the claim is past ``LICENSE_CLAIM_REFRESH_AFTER`` it is re-issued from
+    the Redis cache when available, and a background refresh is started
+    otherwise.  Expired or missing claims fall back to
+    ``get_cached_license_info``.  State-changing actions pass
+    ``force_refresh=True`` to always revalidate with the license service.
+    When the resulting license data indicates failure the caller should
+    treat the action as unauthorized.
+    """
+    email = session.get("email")
+    key = session.get("saved_key") or session.get("key")
+    if not email or not key:
+        return None
 
-                snapshot[name] = {"workers": worker_count, "jobs": job_info}
+    if not force_refresh:
+        claim, age = read_license_claim(email, key)
+        if claim and age < LICENSE_CLAIM_REFRESH_AFTER:
+            return claim
+        if claim:
+            cached = peek_license_info(redis_conn, email, key)
+            if cached and cached.get("success"):
+                return issue_license_claim(email, key, cached)
+            schedule_refresh(redis_conn, email, key, check_license_and_quota)
+            return claim
+
+    info = get_cached_license_info(email, key, force_refresh=force_refresh)
+    if not info.get("success"):
+        session.pop("license_claim", None)
+        return None
+    return issue_license_claim(email, key, info)
 
-            redis_conn.set(QUEUE_SNAPSHOT_KEY, json.dumps(snapshot))
-            redis_conn.publish(QUEUE_UPDATE_CHANNEL, "updated")
-        except Exception as exc:
-            # Do not crash the thread if something goes wrong; just log.
-            print(f"queue snapshot refresh failed: {exc}")
-        time.sleep(interval)
 
+# The snapshot refresher runs in every web worker but only the lease holder
+# does any work.  Set QUEUE_SNAPSHOT_IN_WEB=0 when running it standalone
+# with ``python -m app.queue_snapshot``.
+if os.getenv("QUEUE_SNAPSHOT_IN_WEB", "1") == "1":
+    Thread(target=run_snapshot_refresher, args=(redis_conn,), daemon=True).start()
 
-# Launch background thread to maintain the cache
-Thread(target=refresh_queue_snapshot, daemon=True).start()
+# Retries usage reports the license service did not take, even when idle
+Thread(target=run_quota_flusher, args=(redis_conn,), daemon=True).start()
 
 
 def set_job_id(email: str, job_id: str) -> None:
@@ -247,100 +260,20 @@ def get_job_id(email: str) -> str | None:
     return jid.decode() if jid else None
 
 
+def get_current_job_id(email: str) -> str | None:
+    """Return the RQ job id of the chunk currently running/queued for a user."""
+    return resolve_job_id(redis_conn, get_job_id(email))
+
+
 def remove_job_id(email: str) -> None:
     """Remove a stored job ID for a user from Redis."""
     redis_conn.hdel(RUNNING_JOBS_HASH, email)
 
-# Callback for RQ jobs to clear job ID when they finish
+# Callback of jobs enqueued before chunking (see ``app.job_chunks``)
 def clear_job_id_on_success(job, connection, result):
     email = job.meta.get("user_email")
     if email:
-        remove_job_id(email)
-
-
-def get_cached_queue_info(queue_name: str) -> dict:
-    """Return cached snapshot for a queue."""
-    raw = redis_conn.get(QUEUE_SNAPSHOT_KEY)
-    if not raw:
-        return {}
-    try:
-        data = json.loads(raw)
-        return data.get(queue_name, {}) if isinstance(data, dict) else {}
-    except Exception:
-        return {}
-
-def estimate_queue_eta_parallel(email, queue, redis_conn, num_workers=1):
-    """
-    Returns (position_in_queue, eta_minutes)
-    - position_in_queue: 0 = running, 1 = next, 2 = after, etc
-    - eta_minutes: estimated wait time in minutes until user's job starts
-    """
-    jobs = queue.jobs  # queued jobs, oldest first
-    running_job_ids = queue.started_job_registry.get_job_ids()
-    job_list = []
-
-    # Add currently running jobs first (oldest first)
-    for job_id in running_job_ids:
-        try:
-            job = Job.fetch(job_id, connection=redis_conn)
-            job_list.append(job)
-        except Exception:
-            pass
-
-    # Add queued jobs
-    for job in jobs:
-        job_list.append(job)
-
-    # Estimate remaining time for each running job
-    worker_available_at = [0] * num_workers
-    idx = 0
-    user_position = None
-    eta_seconds = 0
-
-    for job in job_list:
-        meta = getattr(job, 'meta', {})
-        mode = meta.get("mode")
-        prompts = meta.get("total_prompts")
-        job_email = meta.get("user_email")
-        completed = meta.get("completed_prompts", 0)
-
-        # fallback for old jobs
-        if not prompts and hasattr(job, 'args') and len(job.args) >= 2:
-            prompts = job.args[2]
-        if not mode and hasattr(job, 'args') and len(job.args) >= 1:
-            mode = job.args[0]
-
-        per_prompt = MODE_RUNTIME.get(mode, 60)
-
-        # Calculate remaining time
-        if idx < num_workers:
-            # For running jobs, use remaining only
-            remaining = (prompts or 0) - (completed or 0)
-            if remaining < 0:
-                remaining = 0
-            job_time = remaining * per_prompt
-            worker_available_at[idx] = job_time
-        else:
-            # For queued jobs: assign to soonest available worker
-            soonest_worker = min(range(num_workers), key=lambda i: worker_available_at[i])
-            start_time = worker_available_at[soonest_worker]
-            job_time = (prompts or 0) * per_prompt
-            worker_available_at[soonest_worker] += job_time
-
-            if job_email == email and user_position is None:
-                user_position = idx
-                eta_seconds = start_time
-
-        if job_email == email and user_position is None:
-            # If user's job is running now
-            user_position = idx
-            eta_seconds = 0
-
-        idx += 1
-
-    eta_minutes = int(eta_seconds / 60)
-    return user_position, eta_minutes
-
+        clear_job_id(connection, email, get_parent_id(job))
 
 
 def get_active_worker_count(redis_conn, queue_name="default"):
@@ -383,14 +316,81 @@ def list_machines_api(app_name: str) -> list[dict]:
     r = fly_request("GET", f"/apps/{app_name}/machines")
     return r.json() or []
 
-def ensure_worker_for_queue(queue_name: str, timeout: int = 30, poll: int = 3) -> bool:
+# Background watchdog that reports worker availability for a freshly queued job
+WORKER_WAIT_TIMEOUT = int(os.getenv("WORKER_WAIT_TIMEOUT", "30"))  # seconds
+WORKER_WAIT_POLL = int(os.getenv("WORKER_WAIT_POLL", "3"))  # seconds
+WORKER_STATUS_TTL = 3600  # seconds
+
+
+def get_worker_status_key(email: str) -> str:
+    return f"worker_status:{email}"
+
+
+def set_worker_status(email: str, job_id: str, queue_name: str, status: str) -> None:
+    """Store the worker availability status for a user's job and notify SSE clients."""
+    payload = {"job_id": job_id, "queue": queue_name, "status": status}
+    try:
+        redis_conn.setex(get_worker_status_key(email), WORKER_STATUS_TTL, json.dumps(payload))
+        redis_conn.publish(QUEUE_UPDATE_CHANNEL, "worker_status")
+    except Exception as e:
+        print(f"Failed to store worker status: {e}")
+
+
+def get_worker_status(email: str, job_id: str | None) -> str | None:
+    """Return the watchdog status (``waiting``/``ready``/``no_workers``) for ``job_id``."""
+    if not job_id:
+        return None
+    raw = redis_conn.get(get_worker_status_key(email))
+    if not raw:
+        return None
+    try:
+        data = json.loads(raw)
+    except Exception:
+        return None
+    if data.get("job_id") != job_id:
+        return None
+    return data.get("status")
+
+
+def watch_worker_availability(
+    email: str,
+    job_id: str,
+    queue_name: str,
+    timeout: int = WORKER_WAIT_TIMEOUT,
+    poll: int = WORKER_WAIT_POLL,
+) -> None:
+    """Poll for a worker on ``queue_name`` and record the outcome for ``email``.
+
+    Runs outside the request so job submission returns immediately.  The
+    status moves from ``waiting`` to ``ready`` once a worker is listening, or
+    to ``no_workers`` if none shows up within ``timeout`` seconds.  Polling
+    stops early when the job leaves the queue (started, canceled, ...).
+    """
     start = time.time()
     while time.time() - start < timeout:
-        if get_active_worker_count(redis_conn, queue_name=queue_name) > 0:
-            return True
-        app.logger.info(f"[ensure_worker] Waiting for worker on '{queue_name}'...")
+        try:
+            if get_active_worker_count(redis_conn, queue_name=queue_name) > 0:
+                set_worker_status(email, job_id, queue_name, "ready")
+                return
+            if Job.fetch(job_id, connection=redis_conn).get_status() != "queued":
+                return
+        except NoSuchJobError:
+            return
+        except Exception as e:
+            print(f"[worker-watchdog] check failed for '{queue_name}': {e}")
         time.sleep(poll)
-    return False
+    app.logger.warning(f"[worker-watchdog] No active workers on '{queue_name}' after {timeout}s.")
+    set_worker_status(email, job_id, queue_name, "no_workers")
+
+
+def start_worker_watchdog(email: str, job_id: str, queue_name: str) -> None:
+    """Mark the job as waiting for a worker and start the watchdog thread."""
+    set_worker_status(email, job_id, queue_name, "waiting")
+    Thread(
+        target=watch_worker_availability,
+        args=(email, job_id, queue_name),
+        daemon=True,
+    ).start()
 
 
 @app.route('/queue_eta')
@@ -398,22 +398,23 @@ def queue_eta():
     if "email" not in session:
         return {"error": "Unauthorized"}, 401
 
-    if not ensure_valid_license():
+    license_info = ensure_valid_license()
+    if not license_info:
         return {"error": "License expired or invalid"}, 403
 
     email = session["email"]
-    q = get_user_queue(email)
-    info = get_cached_queue_info(q.name)
-    num = info.get("workers", 0)
+    q = get_user_queue(email, license_info)
+    parent_id = get_job_id(email)
+    job_id = resolve_job_id(redis_conn, parent_id)
+    header, data = get_queue_job_info(redis_conn, q.name, job_id)
+    num = header.get("workers", 0)
+    worker_status = get_worker_status(email, parent_id)
     if num <= 0:
-        return {"num_workers": 0, "position": None, "eta_minutes": None}
+        return {"num_workers": 0, "position": None, "eta_minutes": None, "worker_status": worker_status}
 
-    job_id = get_job_id(email)
     pos = None
     eta = None
-    jobs = info.get("jobs", {}) if isinstance(info, dict) else {}
-    if job_id and job_id in jobs:
-        data = jobs[job_id]
+    if data:
         pos = data.get("position")
         eta = int(data.get("eta_seconds", 0) / 60)
 
@@ -423,10 +424,37 @@ def queue_eta():
             job = Job.fetch(job_id, connection=redis_conn)
             if job.get_status() == "started":
                 pos = 0
+            elif job.get_status() == "queued" and header.get("count", 0) > QUEUE_SNAPSHOT_MAX_JOBS:
+                # Very long queues are only partially snapshotted
+                idx = redis_conn.lpos(q.key, job_id)
+                if idx is not None:
+                    pos = idx + header.get("running", 0)
         except NoSuchJobError:
             pass
 
-    return {"num_workers": num, "position": pos, "eta_minutes": eta}
+    return {"num_workers": num, "position": pos, "eta_minutes": eta, "worker_status": worker_status}
+
+
+def build_queue_update(key: tuple[str, str, str | None]) -> str:
+    """Return the ``/queue_updates`` payload for a user's job."""
+    queue_name, email, job_id = key
+    header, data = get_queue_job_info(redis_conn, queue_name, resolve_job_id(redis_conn, job_id))
+    pos = None
+    eta = None
+    if data:
+        pos = data.get("position")
+        eta = int(data.get("eta_seconds", 0) / 60)
+    return json.dumps({
+        "num_workers": header.get("workers", 0),
+        "position": pos,
+        "eta_minutes": eta,
+        "job_id": job_id,
+        "worker_status": get_worker_status(email, job_id),
+    })
+
+
+# One Redis subscription per web process, shared by every open dashboard
+queue_update_hub = SSEHub(redis_conn, QUEUE_UPDATE_CHANNEL, build_queue_update)
 
 
 @app.route('/queue_updates')
@@ -434,37 +462,18 @@ def queue_updates():
     if "email" not in session:
         return {"error": "Unauthorized"}, 401
 
-    if not ensure_valid_license():
+    license_info = ensure_valid_license()
+    if not license_info:
         return {"error": "License expired or invalid"}, 403
 
     email = session["email"]
-    queue_name = get_user_queue(email).name
-    job_id = get_job_id(email)
-
-    def build_update() -> str:
-        info = get_cached_queue_info(queue_name)
-        num = info.get("workers", 0)
-        pos = None
-        eta = None
-        jobs = info.get("jobs", {}) if isinstance(info, dict) else {}
-        if job_id and job_id in jobs:
-            data = jobs[job_id]
-            pos = data.get("position")
-            eta = int(data.get("eta_seconds", 0) / 60)
-        payload = json.dumps({"num_workers": num, "position": pos, "eta_minutes": eta})
-        return f"data: {payload}\n\n"
-
-    def event_stream():
-        pubsub = redis_conn.pubsub()
-        pubsub.subscribe(QUEUE_UPDATE_CHANNEL)
-        # send initial snapshot
-        yield build_update()
-        for message in pubsub.listen():
-            if message.get("type") != "message":
-                continue
-            yield build_update()
-
-    return Response(event_stream(), mimetype="text/event-stream")
+    queue_name = get_user_queue(email, license_info).name
+    stream = queue_update_hub.stream((queue_name, email, get_job_id(email)))
+    return Response(
+        stream,
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.route('/job_progress')
@@ -476,7 +485,7 @@ def job_progress():
         return {"error": "License expired or invalid"}, 403
 
     email = session["email"]
-    job_id = get_job_id(email)
+    job_id = get_current_job_id(email)
     if not job_id:
         return {"status": "none"}
     try:
@@ -485,14 +494,28 @@ def job_progress():
         remove_job_id(email)
         return {"status": "none"}
 
+    if job.meta.get("finalize") and job.get_status() in ("queued", "started"):
+        # Every prompt is done; only the workbook is still being built
+        total = job.meta.get("total_prompts", 0)
+        return {
+            "status": "running",
+            "completed_prompts": total,
+            "total_prompts": total,
+            "remaining_seconds": 0,
+        }
     if job.get_status() == "started":
         meta = job.meta
-        completed = meta.get("completed_prompts", 0)
+        parent_id = get_parent_id(job)
+        # Progress of every lane is summed on the parent
+        completed = get_parent_progress(redis_conn, parent_id)
+        if completed is None:
+            completed = meta.get("completed_prompts", 0)
         total = meta.get("total_prompts", 0)
-        mode = meta.get("mode")
-        per_prompt = MODE_RUNTIME.get(mode, 60)
-        remaining = max(0, total - completed)
-        remaining_seconds = remaining * per_prompt
+        # Queued lanes are not working through the prompts yet
+        lanes = max(count_running_lanes(redis_conn, parent_id), 1)
+        remaining_seconds = estimate_job_seconds(
+            redis_conn, meta.get("mode"), total - completed, tier=job.origin, account=email
+        ) // lanes
         return {
             "status": "running",
             "completed_prompts": completed,
@@ -502,9 +525,9 @@ def job_progress():
     elif job.get_status() == "queued":
         meta = job.meta
         total = meta.get("total_prompts", 0)
-        mode = meta.get("mode")
-        per_prompt = MODE_RUNTIME.get(mode, 60)
-        duration_estimate = total * per_prompt
+        duration_estimate = estimate_job_seconds(
+            redis_conn, meta.get("mode"), total, tier=job.origin, account=email
+        )
         return {
             "status": "queued",
             "total_prompts": total,
@@ -526,6 +549,7 @@ def login():
         if data.get("success"):
             session["email"] = email
             session["key"] = key
+            issue_license_claim(email, key, data)
             if remember:
                 session["saved_email"] = email
                 session["saved_key"] = key
@@ -551,7 +575,8 @@ def dashboard():
     if "email" not in session:
         return redirect(url_for("login"))
 
-    if not ensure_valid_license():
+    license_info = ensure_valid_license()
+    if not license_info:
         flash("❌ License expired or invalid. Please log in again.", "error")
         return redirect(url_for("login"))
 
@@ -567,13 +592,10 @@ def dashboard():
         queued_total_prompts = queued_info.get('total_prompts')
         queued_duration = queued_info.get('duration_estimate')
 
-        q = get_user_queue(email)
-
-        num_workers = get_active_worker_count(redis_conn, queue_name=q.name)
-        if not num_workers:
-            num_workers = 1
-
-        position, eta_minutes = estimate_queue_eta_parallel(email, q, redis_conn, num_workers=num_workers)
+        q = get_user_queue(email, license_info)
+        _, job_eta = get_queue_job_info(redis_conn, q.name, get_current_job_id(email))
+        position = job_eta.get("position") if job_eta else None
+        eta_minutes = int(job_eta.get("eta_seconds", 0) / 60) if job_eta else 0
 
         print("🖥️ Rendering dashboard with queued_info:", queued_info, flush=True)
 
@@ -603,8 +625,8 @@ def dashboard():
 
 
     if request.method == "POST":
-        # 🔐 License revalidation before proceeding
-        license_info = ensure_valid_license()
+        # 🔐 License revalidation before proceeding (always a fresh check)
+        license_info = ensure_valid_license(force_refresh=True)
         tier = license_info.get("tier", "default") if license_info else "default"
         if not license_info:
             flash("❌ License check/validation failed. Please try again.", "error")
@@ -621,7 +643,7 @@ def dashboard():
         existing_job_id = get_job_id(email)
         if existing_job_id:
             try:
-                existing_job = Job.fetch(existing_job_id, connection=redis_conn)
+                existing_job = Job.fetch(resolve_job_id(redis_conn, existing_job_id), connection=redis_conn)
                 if existing_job.get_status() in ("queued", "started"):
                     flash(
                         "⚠️ A job is already running for this account. Please cancel it before queuing another.",
@@ -692,20 +714,6 @@ def dashboard():
                     queue_position=None,
                     queue_eta_minutes=None,
                 )
-            if prompts_today + row_count > daily_quota:
-                flash(f"❌ Daily quota exceeded! You have used {prompts_today}/{daily_quota} prompts today.", "error")
-                return render_template(
-                    "dashboard.html",
-                    filename=None,
-                    selected_mode=mode,
-                    row_count=row_count,
-                    duration_estimate=None,
-                    queue_eta=None,
-                    start_failed=True,
-                    queue_position=None,
-                    queue_eta_minutes=None,
-                )
-                
 
 
             # 🚚 Generate a temporary download URL for the worker
@@ -732,8 +740,8 @@ def dashboard():
 
 
             try:
-                settings_stream = download_file_obj(f"Users/{email}/settings.json")
-                if not settings_stream:
+                settings, settings_version = load_user_settings(redis_conn, email)
+                if not settings:
                     flash("❌ Make sure all of your settings fields are populated, correct and saved.", "error")
                     return render_template(
                         "dashboard.html",
@@ -746,12 +754,7 @@ def dashboard():
                         queue_position=None,
                         queue_eta_minutes=None,
                     )
-                settings = json.load(settings_stream)
-                required = [
-                    "USER TOKEN", "CHANNEL ID", "GUILD ID",
-                    "MIDJOURNEY APP ID", "MIDJOURNEY COMMAND ID", "COMMAND VERSION",
-                ]
-                if any(not settings.get(k) for k in required):
+                if missing_required_settings(settings):
                     flash("❌ Make sure all of your settings fields are populated and correct.", "error")
                     return render_template(
                         "dashboard.html",
@@ -782,12 +785,12 @@ def dashboard():
                 )
 
             # Estimate duration and queue start
-            per_prompt = MODE_RUNTIME.get(mode, 60)
-            duration_estimate = int((row_count * per_prompt) / 60)
-            # queued_ahead = int(tier_queue.count)
-            q = get_user_queue(email) 
-            queued_ahead = int(q.count)
-            queue_eta = int((queued_ahead * TYPICAL_JOB_RUNTIME) / 60)
+            q = get_user_queue(email, license_info)
+            duration_estimate = int(
+                estimate_job_seconds(redis_conn, mode, row_count, tier=q.name, account=email) / 60
+            )
+            queue_header, _ = get_queue_job_info(redis_conn, q.name, None)
+            queue_eta = int(queue_header.get("tail_eta", 0) / 60)
 
 
             if mode in ["U1", "U2", "U3", "U4", "All"]:
@@ -795,46 +798,61 @@ def dashboard():
                 print("🔎 ENQUEUE: key =", key)
 
 
-                q = get_user_queue(email)
-
-
-                
-                job = q.enqueue(
-                    run_mode,
-                    mode,
-                    email,
-                    presigned_url,
-                    key,
-                    job_timeout=7200,
-                    result_ttl=0,
-                    on_success=clear_job_id_on_success,
-                    meta={
-                        "user_email": email,
-                        "mode": mode,
-                        "total_prompts": row_count,   # row_count is number of prompts for this job
-                        "completed_prompts": 0,       # Optional; update from worker as the job progresses
-                    },
+                q = get_user_queue(email, license_info)
+
+                # Reserve the daily quota atomically so concurrent submits can't overshoot
+                job_id = str(uuid.uuid4())
+                reserved, used_today, quota_day = reserve_quota(
+                    redis_conn, email, job_id, row_count, daily_quota, prompts_today
                 )
-                set_job_id(email, job.id)
-                if not ensure_worker_for_queue(q.name, timeout=30, poll=3):
-                    app.logger.warning("[worker-start] No active workers after waiting.")
-                    flash("❌ No active workers available. Please try again later.", "error")
+                if not reserved:
+                    flash(f"❌ Daily quota exceeded! You have used {used_today}/{daily_quota} prompts today.", "error")
                     return render_template(
                         "dashboard.html",
-                        filename=filename,
+                        filename=None,
                         selected_mode=mode,
                         row_count=row_count,
-                        duration_estimate=duration_estimate,
-                        queue_eta=queue_eta,
+                        duration_estimate=None,
+                        queue_eta=None,
                         start_failed=True,
                         queue_position=None,
                         queue_eta_minutes=None,
                     )
 
-                num_workers = get_active_worker_count(redis_conn, queue_name=q.name)
-                position, _ = estimate_queue_eta_parallel(email, q, redis_conn, num_workers=num_workers)
+                try:
+                    # Large files run as chunks that take turns with other users
+                    # and fan out over the user's extra channels
+                    jobs = start_job(
+                        q,
+                        job_id,
+                        email,
+                        mode,
+                        row_count,
+                        presigned_url,
+                        key,
+                        settings_version=settings_version,  # worker refetches if its cache is older
+                        quota_day=quota_day,                # ledger day holding this job's reservation
+                        channels=get_job_channels(settings),
+                    )
+                except Exception:
+                    release_quota(redis_conn, email, job_id, quota_day)
+                    raise
+                job = jobs[0]
+                set_job_id(email, job.id)
+                for lane_job in jobs:
+                    record_job_work(
+                        redis_conn, q.name, lane_job.id, mode,
+                        lane_job.meta["chunk_end"] - lane_job.meta["chunk_start"], account=email,
+                    )
+                    publish_queue_event(redis_conn, "enqueued", q.name, lane_job.id)
+                # Worker availability is reported asynchronously over /queue_updates
+                start_worker_watchdog(email, job.id, q.name)
+
+                # The job sits at the tail, behind everything already running
+                position = queue_header.get("running", 0) + max(q.count - 1, 0)
 
                 session['dashboard_counters'] = {
+                    'job_id': job.id,
                     'mode': mode,
                     'queue_position': position,
                     'total_prompts': row_count,
@@ -882,9 +900,10 @@ def queue_length():
     """Return current number of queued jobs."""
     email = session.get("email")
     if email:
-        if not ensure_valid_license():
+        license_info = ensure_valid_license()
+        if not license_info:
             return {"error": "License expired or invalid"}, 403
-        q = get_user_queue(email)
+        q = get_user_queue(email, license_info)
     else:
         q = Queue(connection=redis_conn)
     return {"count": int(q.count)}
@@ -910,18 +929,13 @@ def settings():
         return redirect(url_for("login"))
 
     email = session["email"]
-    settings_path = get_user_settings_path(email)
 
     try:
-        remote_stream = download_file_obj(f"Users/{email}/settings.json")
-        if remote_stream:
-            remote_settings = json.load(remote_stream)
-            os.makedirs(os.path.dirname(settings_path), exist_ok=True)
-            with open(settings_path, "w") as f:
-                json.dump(remote_settings, f, indent=4)
-        else:
+        current_settings, _ = load_user_settings(redis_conn, email)
+        if current_settings is None:
             flash("⚠️ No settings found in cloud storage", "error")
     except Exception as e:
+        current_settings = None
         flash(f"⚠️ Failed to download settings: {e}", "error")
 
     token_nonce = None
@@ -929,16 +943,15 @@ def settings():
         new_settings = {
             "USER TOKEN": request.form.get("user_token"),
             "CHANNEL ID": request.form.get("channel_id"),
+            # Large jobs run on these channels in parallel
+            "EXTRA CHANNEL IDS": request.form.get("extra_channel_ids", ""),
             "GUILD ID": request.form.get("guild_id"),
             "MIDJOURNEY APP ID": request.form.get("midjourney_app_id"),
             "MIDJOURNEY COMMAND ID": request.form.get("midjourney_command_id"),
             "COMMAND VERSION": request.form.get("command_version")
         }
-        with open(settings_path, "w") as f:
-            json.dump(new_settings, f, indent=4)
-        settings_stream = BytesIO(json.dumps(new_settings).encode("utf-8"))
-        success = upload_file_obj(settings_stream, f"Users/{email}/settings.json")
-        if success:
+        if save_user_settings(redis_conn, email, new_settings) is not None:
+            current_settings = new_settings
             flash("✅ Settings saved!", "success")
         else:
             flash("❌ Failed to upload settings to cloud storage", "error")
@@ -952,13 +965,7 @@ def settings():
             "expires": time.time() + 300,
         }
 
-    try:
-        with open(settings_path) as f:
-            current_settings = json.load(f)
-    except Exception:
-        current_settings = {}
-
-    return render_template("settings.html", settings=current_settings, token_nonce=token_nonce)
+    return render_template("settings.html", settings=current_settings or {}, token_nonce=token_nonce)
 
 
 @app.route("/receive_token")
@@ -988,20 +995,12 @@ def receive_token():
         return redirect(url_for("settings"))
 
     email = session["email"]
-    settings_path = get_user_settings_path(email)
-    os.makedirs(os.path.dirname(settings_path), exist_ok=True)
 
     try:
-        if os.path.exists(settings_path):
-            with open(settings_path) as f:
-                current_settings = json.load(f)
-        else:
-            current_settings = {}
+        current_settings, _ = load_user_settings(redis_conn, email)
+        current_settings = current_settings or {}
         current_settings["USER TOKEN"] = token_value
-        with open(settings_path, "w") as f:
-            json.dump(current_settings, f, indent=4)
-        settings_stream = BytesIO(json.dumps(current_settings).encode("utf-8"))
-        if upload_file_obj(settings_stream, f"Users/{email}/settings.json"):
+        if save_user_settings(redis_conn, email, current_settings) is not None:
             flash("✅ Token saved!", "success")
         else:
             flash("❌ Failed to upload token to cloud storage", "error")
@@ -1026,18 +1025,7 @@ def subscription():
     # Trigger background validation and immediately return placeholder UI
     trigger_license_validation(email, key)
 
-    cache_key = f"license_cache:{email}:{key}"
-    try:
-        redis_conn.delete(f"license_cache:{email}")
-    except Exception:
-        pass
-    cached_raw = redis_conn.get(cache_key)
-    cached = {}
-    if cached_raw:
-        try:
-            cached = json.loads(cached_raw)
-        except Exception:
-            pass
+    cached = peek_license_info(redis_conn, email, key, allow_stale=True) or {}
 
     expiry_pretty = "Loading..."
     tier_val = cached.get("tier")
@@ -1049,12 +1037,17 @@ def subscription():
         date_only = cached["expiry"][:10]
         expiry_pretty = f"{date_only} at 12:00AM CST"
 
+    # Local ledger is ahead of the license service until usage is reconciled
+    prompts_today = "—"
+    if cached:
+        prompts_today = max(int(cached.get("promptsToday", 0) or 0), get_quota_used(redis_conn, email))
+
     details = {
         "tier": tier_val or "Loading...",
         "expiry": expiry_pretty,
         "daily_quota": cached.get("dailyQuota", "—"),
         "job_quota": cached.get("jobQuota", "—"),
-        "prompts_today": cached.get("promptsToday", "—"),
+        "prompts_today": prompts_today,
     }
     return render_template("subscription.html", details=details)
 
@@ -1075,6 +1068,61 @@ def license_status():
     return info
 
 
+# Result downloads are redirected to short-lived presigned URLs so the web
+# process never holds the file.  Set DOWNLOAD_PROXY=1 to stream them through
+# the app instead (e.g. when the bucket is not reachable from browsers).
+DOWNLOAD_URL_TTL = int(os.getenv("DOWNLOAD_URL_TTL", "300"))  # seconds
+DOWNLOAD_PROXY = os.getenv("DOWNLOAD_PROXY", "0") == "1"
+
+
+def send_stored_file(key: str, download_name: str, mimetype: str):
+    """Serve an object from storage without buffering it in memory.
+
+    Returns ``None`` when the object does not exist.  In proxy mode the body
+    is streamed in chunks and ``Range``/``If-None-Match`` are passed through
+    to storage.
+    """
+    if not DOWNLOAD_PROXY:
+        if not object_exists(key):
+            return None
+        url = generate_presigned_url(key, DOWNLOAD_URL_TTL, download_name=download_name)
+        return redirect(url) if url else None
+
+    obj = get_object_stream(key, request.headers.get("Range"), request.headers.get("If-None-Match"))
+    if obj is None:
+        return None
+    if obj.get("NotModified"):
+        return Response(status=304)
+    if obj.get("InvalidRange"):
+        return Response(status=416)
+
+    body = obj["Body"]
+
+    def generate():
+        try:
+            for chunk in body.iter_chunks(DOWNLOAD_CHUNK_SIZE):
+                yield chunk
+        finally:
+            body.close()
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'attachment; filename="{download_name}"',
+        "Content-Length": str(obj["ContentLength"]),
+    }
+    if obj.get("ETag"):
+        headers["ETag"] = obj["ETag"]
+    if obj.get("ContentRange"):
+        headers["Content-Range"] = obj["ContentRange"]
+    return Response(
+        generate(),
+        status=206 if obj.get("ContentRange") else 200,
+        mimetype=mimetype,
+        headers=headers,
+        direct_passthrough=True,
+    )
+
+
 @app.route('/download_zip')
 def download_zip():
     if "email" not in session:
@@ -1084,24 +1132,31 @@ def download_zip():
         return "License expired or invalid", 403
 
     email = session["email"]
-    zip_key = f"Users/{email}/images.zip"
-
-    zip_stream = download_file_obj(zip_key)
-    if not zip_stream:
-        flash("❌ ZIP file not found in cloud storage", "error")
-        return "ZIP file not available", 404
-
-    try:
-        zip_stream.seek(0)
-        return send_file(
-            zip_stream,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name='generated_images.zip'
-        )
-    except Exception as e:
-        flash(f"❌ Failed to send ZIP file: {e}", "error")
-        return "ZIP file not available", 404
+    manifest = load_manifest(email)
+    if manifest is None:
+        # Results from before per-image storage only exist as a built archive
+        response = send_stored_file(f"Users/{email}/images.zip", "generated_images.zip", "application/zip")
+        if response is None:
+            return "ZIP file not available", 404
+        return response
+
+    # Optional filters: ?variants=U1,U3&start=10&end=20&failed_only=1
+    variants = {v.strip() for v in request.args.get("variants", "").split(",") if v.strip()}
+    start = request.args.get("start", type=int)
+    end = request.args.get("end", type=int)
+    failed_only = request.args.get("failed_only") in ("1", "true", "yes")
+
+    entries = select_images(manifest, variants or None, start, end, failed_only)
+    if not entries:
+        return "No images match", 404
+    # Cleanup waits for the stream to finish reading the images
+    token = begin_download(redis_conn, email)
+    return Response(
+        hold_download_lease(redis_conn, email, token, stream_zip(entries)),
+        mimetype="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="generated_images.zip"'},
+        direct_passthrough=True,
+    )
 
 
 @app.route('/download_images_excel')
@@ -1115,22 +1170,14 @@ def download_images_excel():
     email = session["email"]
     excel_key = f"Users/{email}/images.xlsx"
 
-    excel_stream = download_file_obj(excel_key)
-    if not excel_stream:
-        flash("❌ Excel file not found in cloud storage", "error")
-        return "Excel file not available", 404
-
-    try:
-        excel_stream.seek(0)
-        return send_file(
-            excel_stream,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name='images.xlsx'
-        )
-    except Exception as e:
-        flash(f"❌ Failed to send Excel file: {e}", "error")
+    response = send_stored_file(
+        excel_key,
+        "images.xlsx",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    )
+    if response is None:
         return "Excel file not available", 404
+    return response
 
 from openpyxl import Workbook
 from flask import make_response
@@ -1191,35 +1238,8 @@ def cleanup_files():
     if not ensure_valid_license():
         return "License expired or invalid", 403
 
-    email = session["email"]
-    prompts_path = get_user_prompts_path(email)
-    image_dir = get_user_images_dir(email)
-
-    # Delete prompts.xlsx
-    if os.path.exists(prompts_path):
-        os.remove(prompts_path)
-    delete_file(f"Users/{email}/prompts.xlsx")
-
-    # Delete all images
-    if os.path.exists(image_dir):
-        for f in os.listdir(image_dir):
-            fpath = os.path.join(image_dir, f)
-            if os.path.isfile(fpath):
-                os.remove(fpath)
-    delete_file(f"Users/{email}/images.zip")
-
-    images_excel_path = os.path.join(os.path.dirname(image_dir), "images.xlsx")
-    if os.path.exists(images_excel_path):
-        os.remove(images_excel_path)
-    delete_file(f"Users/{email}/images.xlsx")
-
-    # Delete the failed_prompts.json file
-    failed_path = get_user_failed_prompts_path(email)
-    if os.path.exists(failed_path):
-        os.remove(failed_path)
-    delete_file(f"Users/{email}/failed_prompts.json")
-
-    return "✅ Cleaned up files", 200
+    schedule_cleanup(redis_conn, session["email"])
+    return "✅ Cleanup started", 202
 
 
 
@@ -1244,55 +1264,43 @@ def cancel_script():
 
     if not job_id:
         return "⚠️ No running job to cancel", 200
-    try:
-        job = Job.fetch(job_id, connection=redis_conn)
-    except NoSuchJobError:
+    # No further chunks once the current ones stop
+    cancel_parent(redis_conn, job_id)
+    # The current chunk of every lane, and the finalize job once handed over
+    job_ids = current_chunk_ids(redis_conn, job_id)
+    finalizing = get_finalizing_job(redis_conn, job_id)
+    if finalizing:
+        job_ids.append(finalizing)
+    jobs = [job for job in Job.fetch_many(job_ids, connection=redis_conn) if job is not None]
+    if not jobs:
         remove_job_id(email)
         return "⚠️ Job already completed or expired.", 200
 
-    if job.is_finished:
+    active = [job for job in jobs if not (job.is_finished or job.is_canceled)]
+    if not active:
         remove_job_id(email)
+        if any(job.is_canceled for job in jobs):
+            return "⚠️ Job was already canceled.", 200
         return "⚠️ Job already completed. Nothing to cancel.", 200
 
-    if job.is_canceled:
-        remove_job_id(email)
-        return "⚠️ Job was already canceled.", 200
-
-    # ✅ Set manual cancel flag for U1–U4 modes
-    job.meta["cancel_requested"] = True
-    job.save_meta()
-
-    # ✅ Native RQ cancel (for MidjourneyAll)
-    job.cancel()
+    running = []
+    for job in active:
+        if job.get_status() == "started":
+            running.append(job.id)
+        # ✅ Cancel token checked by the worker between steps
+        request_cancel(redis_conn, job.id)
+        # ✅ Native RQ cancel (for MidjourneyAll)
+        job.cancel()
+        forget_job_work(redis_conn, job.origin, job.id)
+        publish_queue_event(redis_conn, "canceled", job.origin, job.id)
 
     remove_job_id(email)
+    release_quota(redis_conn, email, job_id, active[0].meta.get("quota_day"))
 
-    # ✅ Optional: File cleanup logic
-    prompts_path = get_user_prompts_path(email)
-    image_dir = get_user_images_dir(email)
-    failed_path = get_user_failed_prompts_path(email)
-
-    if os.path.exists(prompts_path):
-        os.remove(prompts_path)
-    delete_file(f"Users/{email}/prompts.xlsx")
-
-    if os.path.exists(image_dir):
-        for f in os.listdir(image_dir):
-            fpath = os.path.join(image_dir, f)
-            if os.path.isfile(fpath):
-                os.remove(fpath)
-    delete_file(f"Users/{email}/images.zip")
-
-    images_excel_path = os.path.join(os.path.dirname(image_dir), "images.xlsx")
-    if os.path.exists(images_excel_path):
-        os.remove(images_excel_path)
-    delete_file(f"Users/{email}/images.xlsx")
-
-    if os.path.exists(failed_path):
-        os.remove(failed_path)
-    delete_file(f"Users/{email}/failed_prompts.json")
+    # Files are removed in the background once the workers have stopped
+    schedule_cleanup(redis_conn, email, running)
 
-    return "Job canceled and all files cleaned up.", 200
+    return "Job canceled; files are being cleaned up.", 200
 
 
 if __name__ == "__main__":
@@ -0,0 +1,153 @@
+"""Queue ETA engine shared by the snapshot refresher and the web endpoints.
+
+Each queue has a Redis hash of job id -> outstanding work that is updated
+as jobs move through their lifecycle (enqueue, start, per-batch progress,
+finish/cancel).  The snapshot refresher turns that state into per-job
+positions and ETAs with a worker min-heap, so no endpoint ever walks the
+queue or fetches job metadata to estimate a wait.
+"""
+
+import heapq
+import json
+import time
+
+from app.runtime_stats import get_runtime_percentile
+
+# Per-prompt runtimes (seconds) used until workers have recorded enough
+# samples for a mode (see ``app.runtime_stats``)
+MODE_RUNTIME = {
+    "U1": 42,
+    "U2": 42,
+    "U3": 42,
+    "U4": 42,
+    "All": 58,
+}
+DEFAULT_PROMPT_RUNTIME = 60
+
+# Assumed runtime of a job we know nothing about (seconds), same fallback rule
+TYPICAL_JOB_RUNTIME = 300
+
+QUEUE_WORK_KEY = "queue_work:{}"
+
+
+def get_queue_work_key(queue_name: str) -> str:
+    return QUEUE_WORK_KEY.format(queue_name)
+
+
+def get_prompt_runtime(
+    redis_conn, mode: str | None, tier: str | None = None, account: str | None = None
+) -> float:
+    """Return the expected seconds per prompt for ``mode``."""
+    return get_runtime_percentile(
+        redis_conn, "prompt", MODE_RUNTIME.get(mode, DEFAULT_PROMPT_RUNTIME),
+        mode=mode, tier=tier, account=account,
+    )
+
+
+def get_typical_job_runtime(redis_conn, tier: str | None = None) -> float:
+    """Return the expected runtime of a job whose size is unknown."""
+    return get_runtime_percentile(redis_conn, "job", TYPICAL_JOB_RUNTIME, tier=tier)
+
+
+def estimate_job_seconds(
+    redis_conn, mode: str | None, prompts: int, tier: str | None = None, account: str | None = None
+) -> int:
+    """Return the expected runtime of ``prompts`` prompts in ``mode``."""
+    return int(max(prompts or 0, 0) * get_prompt_runtime(redis_conn, mode, tier, account))
+
+
+def record_job_work(
+    redis_conn,
+    queue_name: str,
+    job_id: str,
+    mode: str | None,
+    total: int,
+    completed: int = 0,
+    account: str | None = None,
+) -> None:
+    """Store a job's outstanding work; call on enqueue, start and progress.
+
+    ``updated_at`` marks when the remaining work was measured, so a
+    running job's estimate keeps shrinking between progress updates.  The
+    per-prompt runtime is re-learned on every update.
+    """
+    entry = {
+        "per_prompt": get_prompt_runtime(redis_conn, mode, tier=queue_name, account=account),
+        "remaining": max(int(total or 0) - int(completed or 0), 0),
+        "updated_at": time.time(),
+    }
+    redis_conn.hset(get_queue_work_key(queue_name), job_id, json.dumps(entry))
+
+
+def forget_job_work(redis_conn, queue_name: str, job_id: str) -> None:
+    """Drop a finished or canceled job from the queue's work hash."""
+    redis_conn.hdel(get_queue_work_key(queue_name), job_id)
+
+
+def parse_queue_work(raw: dict | None) -> dict[str, dict]:
+    """Decode an ``HGETALL`` of a work hash, skipping malformed entries."""
+    work: dict[str, dict] = {}
+    for job_id, value in (raw or {}).items():
+        try:
+            entry = json.loads(value)
+        except Exception:
+            continue
+        if isinstance(entry, dict):
+            job_id = job_id.decode() if isinstance(job_id, bytes) else job_id
+            work[job_id] = entry
+    return work
+
+
+def remaining_seconds(
+    entry: dict | None,
+    running: bool = False,
+    now: float | None = None,
+    typical: float = TYPICAL_JOB_RUNTIME,
+) -> float:
+    """Return the seconds of work left for a work-hash entry.
+
+    Unknown jobs count as ``typical``.  For running jobs the time elapsed
+    since the last progress update is already spent.
+    """
+    if not entry:
+        return typical
+    seconds = float(entry.get("remaining", 0)) * float(entry.get("per_prompt", DEFAULT_PROMPT_RUNTIME))
+    if running:
+        now = time.time() if now is None else now
+        seconds -= max(now - float(entry.get("updated_at", now)), 0)
+    return max(seconds, 0)
+
+
+def simulate_queue(
+    worker_count: int,
+    running: list[tuple[str, float]],
+    queued: list[tuple[str, float]],
+    untracked: int = 0,
+    typical: float = TYPICAL_JOB_RUNTIME,
+) -> tuple[dict[str, dict], float]:
+    """Assign jobs to the earliest free worker using a min-heap.
+
+    ``running`` and ``queued`` are ``(job_id, remaining_seconds)`` pairs in
+    queue order.  ``untracked`` queued jobs beyond the listed ones are
+    counted at ``typical`` seconds each.  Returns the per-job
+    ``position``/``eta_seconds`` and the start ETA of a job appended now.
+    """
+    worker_slots = [0.0] * max(worker_count, 1)
+
+    job_info: dict[str, dict] = {}
+    for jid, seconds in running:
+        start_in = heapq.heappop(worker_slots)
+        heapq.heappush(worker_slots, start_in + seconds)
+        job_info[jid] = {"position": 0, "eta_seconds": start_in}
+
+    pos = len(job_info)
+    for jid, seconds in queued:
+        start_in = heapq.heappop(worker_slots)
+        heapq.heappush(worker_slots, start_in + seconds)
+        job_info[jid] = {"position": pos, "eta_seconds": start_in}
+        pos += 1
+
+    for _ in range(max(untracked, 0)):
+        heapq.heappush(worker_slots, heapq.heappop(worker_slots) + typical)
+
+    return job_info, worker_slots[0]
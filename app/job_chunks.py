@@ -0,0 +1,388 @@
+"""Chunked jobs that take turns on a tier queue, optionally in parallel lanes.
+
+A submission is a parent job whose prompts run as a sequence of chunk jobs
+of ``JOB_CHUNK_PROMPTS`` prompts.  Only one chunk per lane is queued at a
+time: when a chunk finishes, the lane's next one is enqueued at the tail of
+the queue, so active users are served round-robin, chunk by chunk, instead
+of a 1000-prompt job holding a worker for hours.  Chunks are all the same
+size, which makes plain round-robin as fair as deficit round-robin here.
+
+Users with several Discord channels get one lane per channel (up to
+``MAX_JOB_LANES``): chunks are dealt to the lanes in turn and each lane
+runs on its own channel, so idle workers can share a large job.  Whichever
+chunk completes the job last (fan-in) finalizes it.
+
+The first chunk uses the parent id as its RQ job id, so jobs that fit in
+one chunk look exactly like before.  State shared between chunks (current
+chunk per lane, progress, uploaded images, failed prompts) lives in Redis
+because chunks may run on different machines.
+"""
+
+import json
+import os
+
+from rq import Queue
+from rq.job import Callback, Job
+
+from .quota_ledger import release_quota_on_failure
+
+JOB_CHUNK_PROMPTS = int(os.getenv("JOB_CHUNK_PROMPTS", "50"))  # 0 disables chunking
+MAX_JOB_LANES = int(os.getenv("MAX_JOB_LANES", "3"))
+JOB_STATE_TTL = 7 * 24 * 3600  # seconds
+JOB_TIMEOUT = 7200  # seconds per chunk
+
+# Redis hash of user email -> parent job id
+RUNNING_JOBS_HASH = "running_jobs"
+
+RUN_MODE_FUNC = "app.tasks.run_mode"
+ON_SUCCESS_FUNC = "app.job_chunks.finish_chunk_on_success"
+ON_FAILURE_FUNC = "app.job_chunks.fail_chunk_on_failure"
+
+# Delete the user's job id only if it still points at this parent
+_CLEAR_JOB_ID_SCRIPT = """
+if redis.call('HGET', KEYS[1], ARGV[1]) == ARGV[2] then
+    return redis.call('HDEL', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+# Count a finished chunk; the one that completes the job becomes its finalizer
+_COMPLETE_CHUNK_SCRIPT = """
+local done = redis.call('HINCRBY', KEYS[1], 'done', 1)
+if done == tonumber(ARGV[2]) then
+    redis.call('HSET', KEYS[1], 'finalizer', ARGV[1])
+    return 1
+end
+return 0
+"""
+
+_STATUS_RANK = {"started": 0, "queued": 1}
+
+
+def get_parent_key(parent_id: str) -> str:
+    return f"job_parent:{parent_id}"
+
+
+def get_job_images_key(parent_id: str) -> str:
+    return f"job_images:{parent_id}"
+
+
+def get_job_failed_key(parent_id: str) -> str:
+    return f"job_failed:{parent_id}"
+
+
+def get_chunk_job_id(parent_id: str, index: int) -> str:
+    return parent_id if index == 0 else f"{parent_id}-c{index}"
+
+
+def chunk_bounds(total: int, size: int = JOB_CHUNK_PROMPTS) -> list[tuple[int, int]]:
+    """Return ``(start, end)`` prompt offsets of each chunk (end exclusive)."""
+    total = max(int(total or 0), 0)
+    if size <= 0 or total <= size:
+        return [(0, total)]
+    return [(start, min(start + size, total)) for start in range(0, total, size)]
+
+
+def get_job_channels(settings: dict | None) -> list[str]:
+    """Return the user's Discord channels: ``CHANNEL ID`` then any extras."""
+    settings = settings or {}
+    channels = [settings.get("CHANNEL ID") or ""]
+    channels += (settings.get("EXTRA CHANNEL IDS") or "").replace(" ", "").split(",")
+    return list(dict.fromkeys(c for c in channels if c))
+
+
+def get_parent_id(job) -> str:
+    return job.meta.get("parent_id") or job.id
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _enqueue_chunk(queue: Queue, parent: dict, index: int, prompts_file: str):
+    parent_id = parent["parent_id"]
+    bounds = chunk_bounds(parent["total_prompts"])
+    lanes = parent.get("channels") or [None]
+    lane = index % len(lanes)
+    start, end = bounds[index]
+    job = queue.enqueue(
+        RUN_MODE_FUNC,
+        parent["mode"],
+        parent["user_email"],
+        prompts_file,
+        parent["key"],
+        job_id=get_chunk_job_id(parent_id, index),
+        job_timeout=JOB_TIMEOUT,
+        result_ttl=0,
+        on_success=Callback(ON_SUCCESS_FUNC),
+        on_failure=Callback(ON_FAILURE_FUNC),
+        meta={
+            "user_email": parent["user_email"],
+            "mode": parent["mode"],
+            "total_prompts": parent["total_prompts"],  # whole job, for progress display
+            "completed_prompts": start,
+            "settings_version": parent["settings_version"],
+            "quota_day": parent["quota_day"],
+            "parent_id": parent_id,
+            "chunk_index": index,
+            "chunk_count": len(bounds),
+            "chunk_start": start,
+            "chunk_end": end,
+            "lane": lane,
+            "channel_id": lanes[lane],
+        },
+    )
+    queue.connection.hset(get_parent_key(parent_id), f"lane:{lane}", job.id)
+    return job
+
+
+def start_job(
+    queue: Queue,
+    parent_id: str,
+    user_email: str,
+    mode: str,
+    total_prompts: int,
+    prompts_file: str,
+    key: str,
+    settings_version: int = 0,
+    quota_day: str | None = None,
+    channels: list[str] | None = None,
+) -> list:
+    """Record the parent job and enqueue the first chunk of each lane.
+
+    Returns those RQ jobs; the first one's id is ``parent_id``.  Lanes are
+    capped by ``channels``, ``MAX_JOB_LANES`` and the number of chunks.
+    Later chunks read the prompts from ``Users/<email>/prompts.xlsx``
+    because ``prompts_file`` (a presigned URL) may have expired by then.
+    """
+    chunk_count = len(chunk_bounds(total_prompts))
+    lanes = max(min(len(channels or ()), MAX_JOB_LANES, chunk_count), 1)
+    parent = {
+        "parent_id": parent_id,
+        "user_email": user_email,
+        "mode": mode,
+        "total_prompts": int(total_prompts or 0),
+        "key": key,
+        "settings_version": settings_version,
+        "quota_day": quota_day,
+        "queue": queue.name,
+        "prompts_key": f"Users/{user_email}/prompts.xlsx",
+        "channels": list(channels[:lanes]) if channels else None,
+    }
+    redis_conn = queue.connection
+    parent_key = get_parent_key(parent_id)
+    pipe = redis_conn.pipeline()
+    pipe.hset(parent_key, mapping={"data": json.dumps(parent), "chunks": chunk_count})
+    pipe.expire(parent_key, JOB_STATE_TTL)
+    pipe.execute()
+    jobs = []
+    try:
+        for index in range(lanes):
+            jobs.append(_enqueue_chunk(queue, parent, index, prompts_file))
+    except Exception:
+        for job in jobs:
+            job.cancel()
+        redis_conn.delete(parent_key)
+        raise
+    return jobs
+
+
+def load_parent(redis_conn, parent_id: str) -> dict | None:
+    raw = redis_conn.hget(get_parent_key(parent_id), "data")
+    if not raw:
+        return None
+    try:
+        return json.loads(raw)
+    except Exception:
+        return None
+
+
+def current_chunk_ids(redis_conn, job_id: str) -> list[str]:
+    """Return the current chunk of every lane of ``job_id`` (or ``[job_id]``)."""
+    fields = redis_conn.hgetall(get_parent_key(job_id)) or {}
+    lanes = sorted(
+        (int(_decode(k).split(":", 1)[1]), _decode(v))
+        for k, v in fields.items()
+        if _decode(k).startswith("lane:")
+    )
+    return [chunk_id for _, chunk_id in lanes] or [job_id]
+
+
+def resolve_job_id(redis_conn, job_id: str | None) -> str | None:
+    """Return the RQ job id of the chunk currently representing ``job_id``.
+
+    With several lanes a running chunk wins over a queued one; once the
+    job is handed over to a finalize job, that job represents it.
+    """
+    if not job_id:
+        return job_id
+    finalizing = get_finalizing_job(redis_conn, job_id)
+    if finalizing:
+        return finalizing
+    chunk_ids = current_chunk_ids(redis_conn, job_id)
+    if len(chunk_ids) == 1:
+        return chunk_ids[0]
+    statuses = _chunk_statuses(redis_conn, chunk_ids)
+    ranked = sorted(zip(chunk_ids, statuses), key=lambda item: _STATUS_RANK.get(item[1], 2))
+    return ranked[0][0]
+
+
+def _chunk_statuses(redis_conn, chunk_ids: list[str]) -> list[str | None]:
+    pipe = redis_conn.pipeline(transaction=False)
+    for chunk_id in chunk_ids:
+        pipe.hget(Job.key_for(chunk_id), "status")
+    return [_decode(status) for status in pipe.execute()]
+
+
+def count_running_lanes(redis_conn, parent_id: str) -> int:
+    """Return how many lanes of ``parent_id`` have a chunk running right now."""
+    chunk_ids = current_chunk_ids(redis_conn, parent_id)
+    if not chunk_ids:
+        return 0
+    return _chunk_statuses(redis_conn, chunk_ids).count("started")
+
+
+def cancel_parent(redis_conn, parent_id: str) -> None:
+    """Stop further chunks of ``parent_id`` from being enqueued."""
+    parent_key = get_parent_key(parent_id)
+    pipe = redis_conn.pipeline()
+    pipe.hset(parent_key, "canceled", "1")
+    pipe.expire(parent_key, JOB_STATE_TTL)
+    pipe.execute()
+
+
+def is_parent_canceled(redis_conn, parent_id: str) -> bool:
+    return bool(redis_conn.hget(get_parent_key(parent_id), "canceled"))
+
+
+def add_parent_progress(redis_conn, parent_id: str, prompts: int) -> int:
+    """Add finished prompts to the job-wide count (all lanes); returns the total."""
+    parent_key = get_parent_key(parent_id)
+    pipe = redis_conn.pipeline()
+    pipe.hincrby(parent_key, "completed", prompts)
+    pipe.expire(parent_key, JOB_STATE_TTL)
+    return int(pipe.execute()[0])
+
+
+def get_parent_progress(redis_conn, parent_id: str) -> int | None:
+    raw = redis_conn.hget(get_parent_key(parent_id), "completed")
+    return int(raw) if raw is not None else None
+
+
+def complete_chunk(redis_conn, job) -> bool:
+    """Count ``job`` as done; ``True`` if it completes the job and must finalize it."""
+    if not load_parent(redis_conn, get_parent_id(job)):
+        return True
+    script = redis_conn.register_script(_COMPLETE_CHUNK_SCRIPT)
+    return bool(script(
+        keys=[get_parent_key(get_parent_id(job))],
+        args=[job.id, job.meta.get("chunk_count", 1)],
+    ))
+
+
+def is_finalizer(redis_conn, job) -> bool:
+    """Whether ``job`` is the chunk that completed (and finalizes) its job."""
+    if not load_parent(redis_conn, get_parent_id(job)):
+        return True
+    return _decode(redis_conn.hget(get_parent_key(get_parent_id(job)), "finalizer")) == job.id
+
+
+def enqueue_next_chunk(job):
+    """Enqueue the next chunk of ``job``'s lane at the tail of its queue.
+
+    Returns the new RQ job, or ``None`` when the lane is done or the parent
+    was canceled.  The lane's current chunk is updated before the cancel
+    flag is re-checked, so a concurrent ``/cancel`` always reaches one of
+    them.
+    """
+    redis_conn = job.connection
+    parent_id = get_parent_id(job)
+    if is_parent_canceled(redis_conn, parent_id):
+        return None
+    parent = load_parent(redis_conn, parent_id)
+    if not parent:
+        return None
+    index = job.meta.get("chunk_index", 0) + len(parent.get("channels") or [None])
+    if index >= job.meta.get("chunk_count", 1):
+        return None
+    queue = Queue(name=job.origin, connection=redis_conn)
+    next_job = _enqueue_chunk(queue, parent, index, parent["prompts_key"])
+    if is_parent_canceled(redis_conn, parent_id):
+        next_job.cancel()
+        return None
+    return next_job
+
+
+def clear_job_id(redis_conn, email: str, parent_id: str) -> bool:
+    """Forget ``email``'s running job if it is still ``parent_id``."""
+    script = redis_conn.register_script(_CLEAR_JOB_ID_SCRIPT)
+    return bool(script(keys=[RUNNING_JOBS_HASH], args=[email, parent_id]))
+
+
+def mark_finalizing(redis_conn, parent_id: str, finalize_job_id: str) -> None:
+    """Record the finalize job of ``parent_id``; it forgets the user's job when done."""
+    parent_key = get_parent_key(parent_id)
+    pipe = redis_conn.pipeline()
+    pipe.hset(parent_key, "finalize", finalize_job_id)
+    pipe.expire(parent_key, JOB_STATE_TTL)
+    pipe.execute()
+
+
+def get_finalizing_job(redis_conn, parent_id: str) -> str | None:
+    return _decode(redis_conn.hget(get_parent_key(parent_id), "finalize"))
+
+
+def finish_chunk_on_success(job, connection, result):
+    """RQ ``on_success`` callback: forget the user's job once it is finalized.
+
+    A job handed over to a finalize job stays the user's until that is done,
+    so no new job can overwrite its results meanwhile.
+    """
+    email = job.meta.get("user_email")
+    parent_id = get_parent_id(job)
+    if email and is_finalizer(connection, job) and not get_finalizing_job(connection, parent_id):
+        clear_job_id(connection, email, parent_id)
+
+
+def fail_chunk_on_failure(job, connection, type, value, traceback):
+    """RQ ``on_failure`` callback: stop the other lanes and return the quota.
+
+    A failed chunk never completes, so its job could not be finalized anyway.
+    """
+    cancel_parent(connection, get_parent_id(job))
+    release_quota_on_failure(job, connection, type, value, traceback)
+
+
+def add_job_images(redis_conn, parent_id: str, filenames: list[str]) -> None:
+    if not filenames:
+        return
+    key = get_job_images_key(parent_id)
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.sadd(key, *filenames)
+    pipe.expire(key, JOB_STATE_TTL)
+    pipe.execute()
+
+
+def get_job_images(redis_conn, parent_id: str) -> list[str]:
+    names = redis_conn.smembers(get_job_images_key(parent_id)) or ()
+    return sorted(n.decode() if isinstance(n, bytes) else n for n in names)
+
+
+def add_failed_prompts(redis_conn, parent_id: str, failed: list[dict]) -> None:
+    if not failed:
+        return
+    key = get_job_failed_key(parent_id)
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.rpush(key, *(json.dumps(entry) for entry in failed))
+    pipe.expire(key, JOB_STATE_TTL)
+    pipe.execute()
+
+
+def get_failed_prompts(redis_conn, parent_id: str) -> list[dict]:
+    failed = []
+    for raw in redis_conn.lrange(get_job_failed_key(parent_id), 0, -1) or ():
+        try:
+            failed.append(json.loads(raw))
+        except Exception:
+            continue
+    return failed
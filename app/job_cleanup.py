@@ -0,0 +1,166 @@
+"""Cancel tokens and background cleanup of a user's stored job files.
+
+``/cancel`` sets a cancel token for the job; the worker checks it between
+steps and, once it has stopped writing, acknowledges it.  Cleanup runs on
+a small background pool: it waits for that acknowledgement (bounded) so it
+cannot race the worker, then removes everything under the user's storage
+prefix except their settings with bulk deletes.
+
+ZIP downloads are streamed from the stored objects, so each stream holds a
+download lease that it renews as it goes; cleanup is postponed while any
+lease of the user is alive.
+"""
+
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Timer
+
+from .settings_store import get_settings_object_key
+from .tigris_utils import delete_prefix
+
+CANCEL_TOKEN_TTL = 24 * 3600  # seconds
+# How long cleanup waits for a running worker to acknowledge a cancel
+CLEANUP_ACK_TIMEOUT = int(os.getenv("CLEANUP_ACK_TIMEOUT", "60"))  # seconds
+CLEANUP_ACK_POLL = 1  # seconds
+CLEANUP_WORKERS = int(os.getenv("CLEANUP_WORKERS", "2"))
+# A stream that made no progress for this long no longer blocks cleanup
+DOWNLOAD_LEASE_TTL = int(os.getenv("DOWNLOAD_LEASE_TTL", "300"))  # seconds
+# How often a postponed cleanup checks the downloads again
+CLEANUP_RETRY_DELAY = 30  # seconds
+
+_cleanup_pool = ThreadPoolExecutor(max_workers=CLEANUP_WORKERS, thread_name_prefix="cleanup")
+_pending: set[str] = set()
+_pending_lock = Lock()
+
+
+def get_cancel_key(job_id: str) -> str:
+    return f"job_cancel:{job_id}"
+
+
+def get_cancel_ack_key(job_id: str) -> str:
+    return f"job_cancel_ack:{job_id}"
+
+
+def get_user_prefix(email: str) -> str:
+    return f"Users/{email}/"
+
+
+def get_download_lease_key(email: str) -> str:
+    return f"download_leases:{email}"
+
+
+def begin_download(redis_conn, email: str) -> str:
+    """Take a download lease for ``email``; returns its token."""
+    token = uuid.uuid4().hex
+    renew_download(redis_conn, email, token)
+    return token
+
+
+def renew_download(redis_conn, email: str, token: str) -> None:
+    key = get_download_lease_key(email)
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.zadd(key, {token: time.time() + DOWNLOAD_LEASE_TTL})
+    pipe.expire(key, DOWNLOAD_LEASE_TTL)
+    pipe.execute()
+
+
+def end_download(redis_conn, email: str, token: str) -> None:
+    redis_conn.zrem(get_download_lease_key(email), token)
+
+
+def has_active_downloads(redis_conn, email: str) -> bool:
+    return bool(redis_conn.zcount(get_download_lease_key(email), time.time(), "+inf"))
+
+
+def hold_download_lease(redis_conn, email: str, token: str, chunks):
+    """Yield ``chunks`` while renewing the lease ``token``, then release it."""
+    renewed = time.time()
+    try:
+        for chunk in chunks:
+            yield chunk
+            if time.time() - renewed > DOWNLOAD_LEASE_TTL / 3:
+                renew_download(redis_conn, email, token)
+                renewed = time.time()
+    finally:
+        end_download(redis_conn, email, token)
+
+
+def request_cancel(redis_conn, job_id: str) -> None:
+    """Ask the worker running ``job_id`` to stop."""
+    redis_conn.set(get_cancel_key(job_id), "1", ex=CANCEL_TOKEN_TTL)
+
+
+def is_cancel_requested(redis_conn, job_id: str) -> bool:
+    return bool(redis_conn.exists(get_cancel_key(job_id)))
+
+
+def acknowledge_cancel(redis_conn, job_id: str) -> None:
+    """Called by the worker once it no longer writes any job files."""
+    redis_conn.set(get_cancel_ack_key(job_id), "1", ex=CANCEL_TOKEN_TTL)
+
+
+def wait_for_cancel_ack(redis_conn, job_id: str, timeout: float = CLEANUP_ACK_TIMEOUT) -> bool:
+    deadline = time.time() + timeout
+    while not redis_conn.exists(get_cancel_ack_key(job_id)):
+        if time.time() >= deadline:
+            return False
+        time.sleep(CLEANUP_ACK_POLL)
+    return True
+
+
+def cleanup_user_files(
+    redis_conn,
+    email: str,
+    running_job_id: str | list[str] | None = None,
+    requested_at: float | None = None,
+) -> bool:
+    """Delete the user's job files from storage, keeping their settings.
+
+    With ``running_job_id`` (one id, or one per lane of a job) the deletion
+    waits until the workers have acknowledged the cancel (or the timeout
+    passes, e.g. a worker died) and covers everything they wrote until
+    then.  Otherwise files written after ``requested_at`` (a job submitted
+    meanwhile) are kept.
+    """
+    cutoff = requested_at
+    running_ids = [running_job_id] if isinstance(running_job_id, str) else running_job_id or []
+    if running_ids:
+        deadline = time.time() + CLEANUP_ACK_TIMEOUT
+        for job_id in running_ids:
+            if not wait_for_cancel_ack(redis_conn, job_id, max(deadline - time.time(), 0)):
+                print(f"⚠️ No cancel acknowledgement for job {job_id}; cleaning up anyway", flush=True)
+        cutoff = time.time()
+    return delete_prefix(
+        get_user_prefix(email),
+        exclude=(get_settings_object_key(email),),
+        modified_before=cutoff,
+    )
+
+
+def schedule_cleanup(redis_conn, email: str, running_job_id: str | list[str] | None = None) -> None:
+    """Run ``cleanup_user_files`` in the background (once per user at a time).
+
+    While the user still downloads a ZIP the cleanup is retried every
+    ``CLEANUP_RETRY_DELAY`` seconds instead of deleting what the stream
+    reads.
+    """
+    requested_at = time.time()
+    with _pending_lock:
+        if email in _pending:
+            return
+        _pending.add(email)
+
+    def _task():
+        try:
+            if has_active_downloads(redis_conn, email):
+                Timer(CLEANUP_RETRY_DELAY, _cleanup_pool.submit, args=(_task,)).start()
+                return
+            cleanup_user_files(redis_conn, email, running_job_id, requested_at)
+        except Exception as e:
+            print(f"⚠️ Cleanup failed for {email}: {e}", flush=True)
+        with _pending_lock:
+            _pending.discard(email)
+
+    _cleanup_pool.submit(_task)
@@ -0,0 +1,249 @@
+"""Job finalization on its own queue and worker type.
+
+Once the last image of a job is uploaded, the Discord worker that saved it
+enqueues ``finalize_job`` on ``FINALIZE_QUEUE`` and moves on to the next
+user.  A cheaper worker then builds the job-wide files from the job's
+manifest (its image list, snapshotted when it is handed over): it fetches
+the images from storage, writes the images workbook and the failed prompts
+file and uploads them.  Until then the job stays the user's running job,
+so a new submission cannot overwrite its results.  ZIP downloads need none of
+this; they are streamed from the per-image objects (``app.result_archive``).
+"""
+
+import json
+import os
+import tempfile
+import time
+
+import xlsxwriter
+from PIL import Image
+from redis import Redis
+from rq import Queue, get_current_job
+from rq.job import Callback
+
+from .job_chunks import (
+    clear_job_id,
+    get_failed_prompts,
+    get_job_images,
+    mark_finalizing,
+)
+from .queue_snapshot import publish_queue_event
+from .result_archive import get_results_prefix, load_manifest
+from .runtime_stats import record_runtime
+from .tigris_utils import download_files, upload_files
+from .user_utils import get_user_log_key
+
+# Opt-in (needs finalize workers, e.g. "finalize"); empty runs finalization
+# inline on the Discord worker, as before
+FINALIZE_QUEUE = os.getenv("FINALIZE_QUEUE", "")
+FINALIZE_FUNC = "app.job_finalizer.finalize_job"
+ON_FAILURE_FUNC = "app.job_finalizer.finalize_failed"
+FINALIZE_JOB_TIMEOUT = 3600  # seconds
+
+
+def get_finalize_job_id(parent_id: str) -> str:
+    return f"{parent_id}-final"
+
+
+def get_job_manifest_images(redis_conn, user_email: str, parent_id: str) -> list[tuple[str, str]]:
+    """Return ``(key, filename)`` of every image ``parent_id`` uploaded."""
+    prefix = get_results_prefix(user_email)
+    return [(prefix + fname, fname) for fname in get_job_images(redis_conn, parent_id)]
+
+
+def enqueue_finalize(
+    redis_conn,
+    user_email: str,
+    parent_id: str,
+    mode: str | None = None,
+    tier: str | None = None,
+    total_prompts: int = 0,
+):
+    """Queue the finalization of ``parent_id``; returns the RQ job.
+
+    The job's image list is snapshotted into the arguments, and the user's
+    job stays ``parent_id`` (now represented by the finalize job) until the
+    finalization is done.
+    """
+    queue = Queue(FINALIZE_QUEUE, connection=redis_conn)
+    job = queue.enqueue(
+        FINALIZE_FUNC,
+        user_email,
+        parent_id,
+        mode,
+        tier,
+        get_job_manifest_images(redis_conn, user_email, parent_id),
+        job_id=get_finalize_job_id(parent_id),
+        job_timeout=FINALIZE_JOB_TIMEOUT,
+        result_ttl=0,
+        on_failure=Callback(ON_FAILURE_FUNC),
+        meta={
+            "user_email": user_email,
+            "parent_id": parent_id,
+            "mode": mode,
+            "finalize": True,
+            "total_prompts": total_prompts,
+        },
+    )
+    mark_finalizing(redis_conn, parent_id, job.id)
+    # Wakes the autoscaler for the finalize machines
+    publish_queue_event(redis_conn, "enqueued", FINALIZE_QUEUE, job.id)
+    return job
+
+
+def create_images_workbook(output_dir: str, workbook_path: str, log=print):
+    """Create an Excel workbook with images inserted into cells.
+
+    Uses XlsxWriter to insert each image so it resides inside the cell.
+    Row heights and column widths are adjusted to fit the images.
+    """
+    wb = None
+    try:
+        wb = xlsxwriter.Workbook(workbook_path)
+        ws = wb.add_worksheet("Images")
+        ws.write_row(0, 0, ["index", "filename", "image", "title"])
+
+        row = 1
+        max_width = 0
+
+        def _numeric_sort_key(n: str):
+            head = n.split("_", 1)[0]
+            return (0, int(head)) if head.isdigit() else (1, n)
+
+        for fname in sorted(os.listdir(output_dir), key=_numeric_sort_key):
+            fpath = os.path.join(output_dir, fname)
+            if os.path.isfile(fpath):
+                index = fname.split("_", 1)[0]
+                ws.write(row, 0, int(index) if index.isdigit() else index)
+                ws.write(row, 1, fname)
+                ws.insert_image(row, 2, fpath, {"object_position": 3})
+                with Image.open(fpath) as im:
+                    width, height = im.size
+                ws.set_row(row, height * 0.75)
+                max_width = max(max_width, width * 0.14)
+                ws.write(row, 3, "")
+                row += 1
+
+        ws.set_column(2, 2, max_width)
+    except (MemoryError, TimeoutError, Exception) as e:
+        log(f"⚠️ Workbook generation failed: {e}")
+        raise
+    finally:
+        if wb:
+            try:
+                wb.close()
+            except Exception as e:  # pragma: no cover - defensive
+                log(f"⚠️ Failed to close workbook: {e}")
+
+
+def get_finalize_images(redis_conn, user_email: str, parent_id: str) -> list[tuple[str, str]]:
+    """Return ``(key, filename)`` of the job's images.
+
+    The job's own Redis image set is authoritative; the per-user manifest is
+    only used once that has expired.
+    """
+    images = get_job_manifest_images(redis_conn, user_email, parent_id)
+    if images:
+        return images
+    manifest = load_manifest(user_email) or {}
+    return [(entry["key"], entry["file"]) for entry in manifest.get("images", [])]
+
+
+def finalize_job(
+    user_email: str,
+    parent_id: str,
+    mode: str | None = None,
+    tier: str | None = None,
+    images: list | None = None,
+    redis_conn=None,
+) -> bool:
+    """Build and upload the images workbook and failed prompts of a job.
+
+    ``images`` is the ``(key, filename)`` snapshot taken when the job was
+    handed over.  Forgets the user's running job once done.
+    """
+    if redis_conn is None:
+        job = get_current_job()
+        redis_conn = job.connection if job else Redis.from_url(
+            os.getenv("REDIS_URL", "redis://redis:6379/0")
+        )
+    log_key = get_user_log_key(user_email)
+
+    def log(*args):
+        msg = " ".join(str(a) for a in args)
+        print(msg, flush=True)
+        try:
+            redis_conn.rpush(log_key, msg)
+        except Exception as e:  # pragma: no cover - defensive
+            print(f"❌ Failed to write log: {e}", flush=True)
+
+    start = time.time()
+    failed_key = f"Users/{user_email}/failed_prompts.json"
+    workbook_key = f"Users/{user_email}/images.xlsx"
+    with tempfile.TemporaryDirectory(prefix="finalize-") as work_dir:
+        images_dir = os.path.join(work_dir, "images")
+        os.makedirs(images_dir)
+        if images is None:
+            images = get_finalize_images(redis_conn, user_email, parent_id)
+        results = download_files([(key, os.path.join(images_dir, fname)) for key, fname in images])
+        missing = [key for key, ok in results.items() if not ok]
+        if missing:
+            log(f"⚠️ {len(missing)} images could not be fetched; they are missing from images.xlsx.")
+
+        extra = {}
+        failed = get_failed_prompts(redis_conn, parent_id)
+        if failed:
+            failed_path = os.path.join(work_dir, "failed_prompts.json")
+            with open(failed_path, "w") as f:
+                json.dump(failed, f, indent=2)
+            extra[failed_key] = failed_path
+
+        workbook_path = os.path.join(work_dir, "images.xlsx")
+        try:
+            create_images_workbook(images_dir, workbook_path, log)
+            extra[workbook_key] = workbook_path
+        except Exception as e:
+            log(f"⚠️ Failed to create images.xlsx: {e}")
+
+        uploads = upload_files([(path, key) for key, path in extra.items()])
+
+    if failed_key in uploads:
+        if uploads[failed_key]:
+            log(" Failed prompts Excel file has also been downloaded.")
+        else:
+            log("❌ Failed to upload failed_prompts.json.")
+    if workbook_key in uploads:
+        if uploads[workbook_key]:
+            log("✅ Images workbook uploaded.")
+        else:
+            log("❌ Failed to upload images.xlsx.")
+    # Missing images were reported above; the dashboard waits for this line
+    log("✅ Execution completed. Images saved in a ZIP folder under downloads.")
+
+    record_runtime(
+        redis_conn, "finalize", time.time() - start, mode=mode, tier=tier, account=user_email,
+    )
+    clear_job_id(redis_conn, user_email, parent_id)
+    return all(uploads.values())
+
+
+def finalize_failed(job, connection, type, value, traceback):
+    """RQ ``on_failure`` callback: tell the user and free their account.
+
+    The images were all uploaded before finalization, so the run still
+    ends with the completion line the dashboard waits for.
+    """
+    email = job.meta.get("user_email")
+    if not email:
+        return
+    messages = [
+        f"❌ Preparing the images workbook failed: {value}",
+        "✅ Execution completed. Images saved in a ZIP folder under downloads.",
+    ]
+    for msg in messages:
+        print(msg, flush=True)
+    try:
+        connection.rpush(get_user_log_key(email), *messages)
+    except Exception as e:  # pragma: no cover - defensive
+        print(f"❌ Failed to write log: {e}", flush=True)
+    clear_job_id(connection, email, job.meta.get("parent_id") or job.id)
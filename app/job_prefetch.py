@@ -0,0 +1,83 @@
+"""Warm-up of the job a worker is likely to run next.
+
+While a worker runs the last batch of its job it peeks at the head of its
+queues and prepares that job: the user's settings are pulled into the
+Redis cache, the prompts are downloaded and parsed and the Discord token
+is checked.  Optionally the next job's channel is cleared as well, under a
+lock so that two workers never clear the same channel.  Results are kept
+in Redis for a short while, so they help whichever worker picks the job.
+"""
+
+import json
+import os
+
+from rq import Queue, Worker
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+from rq.utils import as_text
+
+PREFETCH_NEXT_JOB = os.getenv("PREFETCH_NEXT_JOB", "1") == "1"
+# Clearing touches the next user's channel before their job starts
+PREFETCH_CLEAR_CHANNEL = os.getenv("PREFETCH_CLEAR_CHANNEL", "0") == "1"
+PREFETCH_TTL = int(os.getenv("PREFETCH_TTL", "900"))  # seconds
+# How long a finishing job waits for its prefetch at most
+PREFETCH_JOIN_TIMEOUT = 60  # seconds
+CHANNEL_LOCK_TTL = 120  # seconds
+
+
+def get_prefetch_key(job_id: str) -> str:
+    return f"job_prefetch:{job_id}"
+
+
+def get_channel_lock_key(channel_id: str) -> str:
+    return f"channel_clear_lock:{channel_id}"
+
+
+def save_prefetch(redis_conn, job_id: str, data: dict) -> None:
+    redis_conn.set(get_prefetch_key(job_id), json.dumps(data), ex=PREFETCH_TTL)
+
+
+def has_prefetch(redis_conn, job_id: str) -> bool:
+    return bool(redis_conn.exists(get_prefetch_key(job_id)))
+
+
+def pop_prefetch(redis_conn, job_id: str) -> dict | None:
+    """Return and forget what was prepared for ``job_id``, if anything."""
+    pipe = redis_conn.pipeline()
+    pipe.get(get_prefetch_key(job_id))
+    pipe.delete(get_prefetch_key(job_id))
+    raw = pipe.execute()[0]
+    if not raw:
+        return None
+    try:
+        data = json.loads(raw)
+    except Exception:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def acquire_channel_lock(redis_conn, channel_id: str) -> bool:
+    return bool(redis_conn.set(get_channel_lock_key(channel_id), "1", nx=True, ex=CHANNEL_LOCK_TTL))
+
+
+def get_worker_queue_names(job) -> list[str]:
+    """Return the queues of the worker running ``job``, in listening order."""
+    worker = None
+    if job.worker_name:
+        worker = Worker.find_by_key(Worker.redis_worker_namespace_prefix + job.worker_name, job.connection)
+    return worker.queue_names() if worker else [job.origin]
+
+
+def peek_next_job(redis_conn, queue_names: list[str]):
+    """Return the job at the head of the first non-empty queue, if any."""
+    pipe = redis_conn.pipeline(transaction=False)
+    for name in queue_names:
+        pipe.lindex(Queue(name, connection=redis_conn).key, 0)
+    for job_id in pipe.execute():
+        if not job_id:
+            continue
+        try:
+            return Job.fetch(as_text(job_id), connection=redis_conn)
+        except NoSuchJobError:
+            continue
+    return None
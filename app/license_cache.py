@@ -0,0 +1,215 @@
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+# A cached license is served without revalidation for this long (seconds)
+LICENSE_CACHE_TTL = int(os.getenv("LICENSE_CACHE_TTL", "30"))
+# After that it is still served while a refresh runs, up to this age
+LICENSE_STALE_TTL = int(os.getenv("LICENSE_STALE_TTL", "300"))
+# Failed lookups are remembered briefly so they are not retried on every hit
+LICENSE_NEGATIVE_TTL = int(os.getenv("LICENSE_NEGATIVE_TTL", "10"))
+# Lock held by the single process fetching a given license
+LICENSE_LOCK_TTL = int(os.getenv("LICENSE_LOCK_TTL", "10"))
+# How long other processes wait for that fetch before giving up
+LICENSE_LOCK_WAIT = float(os.getenv("LICENSE_LOCK_WAIT", "6"))
+LICENSE_LOCK_POLL = 0.1
+LICENSE_REFRESH_WORKERS = int(os.getenv("LICENSE_REFRESH_WORKERS", "2"))
+
+# ``check_license_and_quota`` reports network/service errors with this reason
+TRANSIENT_FAILURE_REASON = "Quota check failed"
+
+_refresh_pool = ThreadPoolExecutor(
+    max_workers=LICENSE_REFRESH_WORKERS, thread_name_prefix="license-refresh"
+)
+_inflight: set[str] = set()
+_inflight_lock = Lock()
+
+
+def get_license_cache_key(email: str, license_key: str) -> str:
+    return f"license_cache:{email}:{license_key}"
+
+
+def get_license_fresh_key(email: str, license_key: str) -> str:
+    return f"license_fresh:{email}:{license_key}"
+
+
+def get_license_negative_key(email: str, license_key: str) -> str:
+    return f"license_negative:{email}:{license_key}"
+
+
+def get_license_lock_key(email: str, license_key: str) -> str:
+    return f"license_lock:{email}:{license_key}"
+
+
+def get_license_fetch_key(email: str, license_key: str) -> str:
+    """Id (the lock token) of the last lookup whose result was stored."""
+    return f"license_fetch:{email}:{license_key}"
+
+
+def _loads(raw) -> dict | None:
+    if not raw:
+        return None
+    try:
+        data = json.loads(raw)
+    except Exception:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _read(redis_conn, email: str, license_key: str) -> tuple[dict | None, bool, dict | None]:
+    """Return ``(cached, is_fresh, negative)`` in a single round trip."""
+    try:
+        cached, fresh, negative = redis_conn.mget([
+            get_license_cache_key(email, license_key),
+            get_license_fresh_key(email, license_key),
+            get_license_negative_key(email, license_key),
+        ])
+    except Exception as e:
+        print(f"License cache read failed: {e}")
+        return None, False, None
+    return _loads(cached), bool(fresh), _loads(negative)
+
+
+def _store(redis_conn, email: str, license_key: str, info: dict, fetch_id: str | None = None) -> None:
+    cache_key = get_license_cache_key(email, license_key)
+    fresh_key = get_license_fresh_key(email, license_key)
+    negative_key = get_license_negative_key(email, license_key)
+    try:
+        if info.get("success"):
+            redis_conn.setex(cache_key, LICENSE_STALE_TTL, json.dumps(info))
+            redis_conn.setex(fresh_key, LICENSE_CACHE_TTL, "1")
+            redis_conn.delete(negative_key)
+        else:
+            redis_conn.setex(negative_key, LICENSE_NEGATIVE_TTL, json.dumps(info))
+            if info.get("reason") != TRANSIENT_FAILURE_REASON:
+                # The service rejected the license; stop serving the old answer
+                redis_conn.delete(cache_key)
+                redis_conn.delete(fresh_key)
+        # Written last: waiters read the result once they see this id
+        if fetch_id:
+            redis_conn.setex(get_license_fetch_key(email, license_key), LICENSE_STALE_TTL, fetch_id)
+    except Exception as e:
+        print(f"Failed to cache license info: {e}")
+
+
+def _fetch_coalesced(redis_conn, email: str, license_key: str, fetch, wait: bool = True) -> dict | None:
+    """Fetch license info, letting only one process call the service at a time.
+
+    The process that wins the Redis lock performs the lookup and stores the
+    result.  Other callers wait for that result when ``wait`` is ``True``
+    and return ``None`` immediately otherwise.  A waiter only accepts what
+    the lookup in progress stored (matched by its lock token), never an
+    entry cached before it, so ``force_refresh`` always sees a new answer.
+    """
+    lock_key = get_license_lock_key(email, license_key)
+    token = uuid.uuid4().hex
+    try:
+        acquired = redis_conn.set(lock_key, token, nx=True, ex=LICENSE_LOCK_TTL)
+    except Exception as e:
+        print(f"License lock failed: {e}")
+        acquired = True
+        token = None
+
+    if acquired:
+        try:
+            info = fetch(email, license_key)
+            _store(redis_conn, email, license_key, info, token)
+            return info
+        finally:
+            if token:
+                try:
+                    if redis_conn.get(lock_key) in (token, token.encode()):
+                        redis_conn.delete(lock_key)
+                except Exception:
+                    pass
+
+    if not wait:
+        return None
+
+    fetch_key = get_license_fetch_key(email, license_key)
+    try:
+        holder = redis_conn.get(lock_key)
+    except Exception:
+        holder = None
+    deadline = time.time() + LICENSE_LOCK_WAIT
+    while holder and time.time() < deadline:
+        time.sleep(LICENSE_LOCK_POLL)
+        try:
+            lock, stored = redis_conn.mget([lock_key, fetch_key])
+        except Exception:
+            break
+        if stored == holder:
+            cached, fresh, negative = _read(redis_conn, email, license_key)
+            if negative:
+                return negative
+            if cached:
+                return cached
+            break
+        if lock != holder:
+            # The lookup gave up without storing a result
+            break
+
+    # The other fetch never finished; do our own lookup
+    info = fetch(email, license_key)
+    _store(redis_conn, email, license_key, info)
+    return info
+
+
+def run_in_background(func, *args) -> None:
+    """Run ``func`` on the bounded license refresh pool."""
+    _refresh_pool.submit(func, *args)
+
+
+def schedule_refresh(redis_conn, email: str, license_key: str, fetch) -> None:
+    """Refresh a license in the background unless a refresh is already running."""
+    cache_key = get_license_cache_key(email, license_key)
+    with _inflight_lock:
+        if cache_key in _inflight:
+            return
+        _inflight.add(cache_key)
+
+    def _task():
+        try:
+            _fetch_coalesced(redis_conn, email, license_key, fetch, wait=False)
+        except Exception as e:
+            print(f"License refresh failed: {e}")
+        finally:
+            with _inflight_lock:
+                _inflight.discard(cache_key)
+
+    _refresh_pool.submit(_task)
+
+
+def peek_license_info(redis_conn, email: str, license_key: str, allow_stale: bool = False) -> dict | None:
+    """Return cached license info without contacting the license service."""
+    cached, fresh, _ = _read(redis_conn, email, license_key)
+    if cached and (fresh or allow_stale):
+        return cached
+    return None
+
+
+def get_license_info(redis_conn, email: str, license_key: str, fetch, force_refresh: bool = False) -> dict:
+    """Return license info for ``email``/``license_key``.
+
+    Fresh entries are returned directly.  Stale entries are returned while a
+    refresh runs on the background pool.  Recent failures are answered from
+    the negative cache.  Only a complete miss (or ``force_refresh``) waits
+    on the license service, and concurrent misses across processes share a
+    single lookup.
+    """
+    if not force_refresh:
+        cached, fresh, negative = _read(redis_conn, email, license_key)
+        if cached and fresh:
+            return cached
+        if negative:
+            # Keep serving the last good answer through transient outages
+            return cached or negative
+        if cached:
+            schedule_refresh(redis_conn, email, license_key, fetch)
+            return cached
+
+    info = _fetch_coalesced(redis_conn, email, license_key, fetch)
+    return info or {"success": False, "reason": TRANSIENT_FAILURE_REASON}
@@ -1,51 +1,61 @@
 import os
-import json
 import time
 import uuid
 import difflib
-import zipfile
-from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from threading import Thread
 from urllib.parse import urlparse
 
 import pandas as pd
 import requests
 from redis import Redis
 from rq import get_current_job
-import xlsxwriter
-from PIL import Image
 
 from .cancel_job_error import CancelJobError
-from .tigris_utils import download_file_obj, upload_file_path
+from .eta_engine import record_job_work
+from .job_chunks import (
+    RUN_MODE_FUNC,
+    add_failed_prompts,
+    add_job_images,
+    add_parent_progress,
+    cancel_parent,
+    complete_chunk,
+    get_failed_prompts,
+    get_job_images,
+    get_parent_id,
+    is_finalizer,
+)
+from .job_cleanup import acknowledge_cancel, is_cancel_requested
+from .job_finalizer import FINALIZE_QUEUE, enqueue_finalize, finalize_job
+from .job_prefetch import (
+    PREFETCH_CLEAR_CHANNEL,
+    PREFETCH_JOIN_TIMEOUT,
+    PREFETCH_NEXT_JOB,
+    acquire_channel_lock,
+    get_worker_queue_names,
+    has_prefetch,
+    peek_next_job,
+    pop_prefetch,
+    save_prefetch,
+)
+from .rate_limiter import discord_request
+from .runtime_stats import record_runtime
+from .queue_snapshot import publish_queue_event
+from .quota_ledger import commit_quota, flush_quota_outbox, release_quota
+from .result_archive import (
+    build_manifest,
+    get_manifest_key,
+    get_results_prefix,
+    upload_manifest,
+)
+from .settings_store import load_user_settings
+from .tigris_utils import download_file_obj, upload_files
 from .user_utils import (
-    get_user_failed_prompts_path,
     get_user_log_key,
     get_user_images_dir,
 )
 
 
-def update_prompts_today(email, key, prompts_this_job):
-    """
-    Call the Apps Script endpoint to update PromptsToday for the user.
-    """
-    import os, requests
-    endpoint = os.getenv("LICENSE_VALIDATION_URL")
-    payload = {
-        "email": email,
-        "key": key,
-        "promptsThisJob": prompts_this_job
-    }
-    try:
-        r = requests.post(endpoint, json=payload, timeout=5)
-        r.raise_for_status()
-        data = r.json()
-        print("✅ PromptsToday updated:", data, flush=True)
-        return data
-    except Exception as e:
-        print("⚠️ Failed to update PromptsToday:", e, flush=True)
-        return None
-
-
 class MidjourneyRunner:
     """Context object for running a single Midjourney job.
 
@@ -64,7 +74,12 @@ class MidjourneyRunner:
         self.LOG_KEY = ""
         self.HEADERS = {}
         self.OUTPUT_DIR = ""
-        self.FAILED_PROMPTS_PATH = ""
+        # Parent job shared by all chunks of a submission (see app.job_chunks)
+        self.PARENT_ID = ""
+        # Image files this chunk already uploaded to storage
+        self._uploaded: set[str] = set()
+        # Discord user id of the token, looked up once per run
+        self._user_id = None
 
         self.CHANNEL_ID = ""
         self.GUILD_ID = ""
@@ -84,29 +99,70 @@ class MidjourneyRunner:
             except Exception as e:  # pragma: no cover - defensive
                 print(f"❌ Failed to write log: {e}", flush=True)
 
+    def record_usage(self, user_email: str, key: str, count: int):
+        """Commit a chunk's quota usage and try to reconcile it right away.
+
+        Usage is taken from the parent job's reservation; whatever is left
+        of it is released by the chunk that finalizes the job.
+        """
+        job = get_current_job()
+        job_id = get_parent_id(job) if job else uuid.uuid4().hex
+        quota_day = job.meta.get("quota_day") if job else None
+        try:
+            commit_quota(self.redis_conn, user_email, key, job_id, count, quota_day)
+            if not job or is_finalizer(self.redis_conn, job):
+                release_quota(self.redis_conn, user_email, job_id, quota_day)
+        except Exception as e:  # pragma: no cover - defensive
+            self.log(f"⚠️ Failed to record prompt usage: {e}")
+            return
+        try:
+            flush_quota_outbox(self.redis_conn)
+        except Exception as e:  # pragma: no cover - defensive
+            print(f"⚠️ Quota reconciliation deferred: {e}", flush=True)
+
     def check_cancel(self):
         job = get_current_job()
-        if job and (job.is_canceled or job.meta.get("cancel_requested")):
+        if job and (
+            job.is_canceled
+            or job.meta.get("cancel_requested")
+            or is_cancel_requested(self.redis_conn, job.id)
+        ):
             print("❌ Job was canceled – exiting early", flush=True)
+            # Nothing else gets written for this job; let the web clean up
+            if self.OUTPUT_DIR and os.path.isdir(self.OUTPUT_DIR):
+                for fname in os.listdir(self.OUTPUT_DIR):
+                    try:
+                        os.remove(os.path.join(self.OUTPUT_DIR, fname))
+                    except OSError:
+                        pass
+            acknowledge_cancel(self.redis_conn, job.id)
+            # Other lanes of the job stop at their next chunk
+            cancel_parent(self.redis_conn, get_parent_id(job))
             raise CancelJobError("Job canceled")
 
-    def get_user_id(self):
-        res = requests.get(
-            "https://discord.com/api/v9/users/@me", headers=self.HEADERS
+    def discord(self, method: str, url: str, route: str, **kwargs):
+        """Discord API call paced by the account's shared rate limits."""
+        return discord_request(
+            self.redis_conn, method, url, route, headers=self.HEADERS, **kwargs
         )
-        return res.json().get("id") if res.status_code == 200 else None
+
+    def get_user_id(self):
+        if self._user_id is None:
+            res = self.discord("GET", "https://discord.com/api/v9/users/@me", "users")
+            self._user_id = res.json().get("id") if res.status_code == 200 else None
+        return self._user_id
 
     def get_messages(self, limit: int = 100):
         url = (
             f"https://discord.com/api/v9/channels/{self.CHANNEL_ID}/messages?limit={limit}"
         )
-        return requests.get(url, headers=self.HEADERS).json()
+        return self.discord("GET", url, "messages").json()
 
     def delete_message(self, msg_id):
         url = (
             f"https://discord.com/api/v9/channels/{self.CHANNEL_ID}/messages/{msg_id}"
         )
-        requests.delete(url, headers=self.HEADERS)
+        self.discord("DELETE", url, "deletes")
 
     def clear_discord_channel(self):
         self.log("\n🧹 Clearing the memory from the previous run...")
@@ -142,8 +198,8 @@ class MidjourneyRunner:
                 "options": [{"type": 3, "name": "prompt", "value": prompt}],
             },
         }
-        res = requests.post(
-            "https://discord.com/api/v9/interactions", headers=self.HEADERS, json=payload
+        res = self.discord(
+            "POST", "https://discord.com/api/v9/interactions", "interactions", json=payload
         )
         if res.status_code == 204:
             self.log(f"✅ Prompt sent: {prompt[:60]}...")
@@ -164,8 +220,8 @@ class MidjourneyRunner:
             "session_id": "a" + str(int(time.time() * 1000)),
             "data": {"component_type": 2, "custom_id": custom_id},
         }
-        requests.post(
-            "https://discord.com/api/v9/interactions", headers=self.HEADERS, json=payload
+        self.discord(
+            "POST", "https://discord.com/api/v9/interactions", "interactions", json=payload
         )
 
     def download_image(self, url, index):
@@ -283,106 +339,172 @@ class MidjourneyRunner:
         ]
 
         if failed:
-            existing = []
-            if os.path.exists(self.FAILED_PROMPTS_PATH):
-                try:
-                    with open(self.FAILED_PROMPTS_PATH, "r") as f:
-                        existing = json.load(f)
-                except Exception:  # pragma: no cover - defensive
-                    self.log("⚠️ Failed to load failed prompts")
-            existing.extend(failed)
-
-            failed_prompts_dir = os.path.dirname(self.FAILED_PROMPTS_PATH)
-            os.makedirs(failed_prompts_dir, exist_ok=True)
-
-            with open(self.FAILED_PROMPTS_PATH, "w") as f:
-                json.dump(existing, f, indent=2)
+            # Kept in Redis: the job's chunks may run on different machines
+            add_failed_prompts(self.redis_conn, self.PARENT_ID, failed)
             self.log(
                 f"{len(failed)} failed prompts have been saved to the failed prompts file."
             )
         else:
             self.log("✅ All images saved successfully.")
 
-    def _create_images_zip(self, output_dir: str, zip_path: str):
-        """Create a ZIP archive of all images in ``output_dir``."""
-        try:
-            with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
-                for fname in os.listdir(output_dir):
-                    fpath = os.path.join(output_dir, fname)
-                    if os.path.isfile(fpath):
-                        zf.write(fpath, arcname=fname)
-        except Exception as e:  # pragma: no cover - defensive
-            self.log(f"⚠️ Failed to create ZIP: {e}")
+    def _upload_results(self, user_email: str, extra: dict[str, str] | None = None) -> dict[str, bool]:
+        """Upload images saved since the last call and refresh the manifest.
+
+        Each image becomes its own object so downloads can be assembled
+        (and filtered) on the fly; see ``app.result_archive``.  The manifest
+        covers the images of every chunk of the job.  ``extra`` maps further
+        keys to local files uploaded in the same concurrent batch.  Returns
+        key -> success for everything attempted, including the manifest.
+        """
+        prefix = get_results_prefix(user_email)
+        items = [
+            (os.path.join(self.OUTPUT_DIR, fname), prefix + fname)
+            for fname in sorted(os.listdir(self.OUTPUT_DIR))
+            if fname not in self._uploaded and os.path.isfile(os.path.join(self.OUTPUT_DIR, fname))
+        ]
+        items.extend((path, key) for key, path in (extra or {}).items())
+
+        results = upload_files(items)
+        uploaded = []
+        for key, ok in results.items():
+            if not key.startswith(prefix):
+                continue
+            if ok:
+                uploaded.append(key[len(prefix):])
+            else:
+                self.log(f"❌ Failed to upload {key[len(prefix):]}.")
+        self._uploaded.update(uploaded)
+        add_job_images(self.redis_conn, self.PARENT_ID, uploaded)
+
+        manifest = build_manifest(
+            user_email,
+            get_job_images(self.redis_conn, self.PARENT_ID),
+            get_failed_prompts(self.redis_conn, self.PARENT_ID),
+        )
+        manifest_key = get_manifest_key(user_email)
+        results[manifest_key] = upload_manifest(user_email, manifest)
+        if not results[manifest_key]:
+            self.log("❌ Failed to upload results manifest.")
+        return results
+
+    def _load_prompts(self, prompts_file: str) -> list | None:
+        """Read the prompts from a presigned URL or a storage key."""
+        if prompts_file.startswith(("http://", "https://")):
+            response = requests.get(prompts_file)
+            if response.status_code != 200:
+                self.log(
+                    f"❌ Failed to download prompts file: {response.status_code}"
+                )
+                return None
+            data = BytesIO(response.content)
+        else:
+            data = download_file_obj(prompts_file)
+            if data is None:
+                self.log("❌ Failed to download prompts file from storage.")
+                return None
+        return pd.read_excel(data)["prompt"].dropna().tolist()
+
+    def _finalize(self, user_email: str, job):
+        """Hand the job-wide files over to a finalize worker.
+
+        The workbook and failed prompts file are built from the manifest on
+        ``FINALIZE_QUEUE`` so this Discord worker can take the next job;
+        without that queue (or if it cannot be reached) they are built here.
+        """
+        tier = job.origin if job else None
+        if FINALIZE_QUEUE:
             try:
-                if os.path.exists(zip_path):
-                    os.remove(zip_path)
-            except Exception:
-                pass
+                enqueue_finalize(
+                    self.redis_conn, user_email, self.PARENT_ID, self.button_label, tier,
+                    total_prompts=job.meta.get("total_prompts", 0) if job else 0,
+                )
+                self.log("📦 All images saved; the workbook and failed prompts file are being prepared.")
+                return
+            except Exception as e:  # pragma: no cover - defensive
+                self.log(f"⚠️ Could not queue finalization, finishing here: {e}")
+        finalize_job(user_email, self.PARENT_ID, self.button_label, tier, redis_conn=self.redis_conn)
+
+    def _start_prefetch(self, job) -> Thread | None:
+        if not PREFETCH_NEXT_JOB or not job:
+            return None
+        thread = Thread(target=self._prefetch_next_job, args=(job,), daemon=True)
+        thread.start()
+        return thread
 
-    def _create_images_workbook(self, output_dir: str, workbook_path: str):
-        """Create an Excel workbook with images inserted into cells.
+    def _prefetch_next_job(self, job):
+        """Prepare the job at the head of this worker's queues (best effort).
 
-        Uses XlsxWriter to insert each image so it resides inside the cell.
-        Row heights and column widths are adjusted to fit the images.
+        Warms the settings cache, loads the prompts and checks the token;
+        with ``PREFETCH_CLEAR_CHANNEL`` the job's channel is cleared too.
         """
-        wb = None
         try:
-            wb = xlsxwriter.Workbook(workbook_path)
-            ws = wb.add_worksheet("Images")
-            ws.write_row(0, 0, ["index", "filename", "image", "title"])
-
-            row = 1
-            max_width = 0
-
-            def _numeric_sort_key(n: str):
-                head = n.split("_", 1)[0]
-                return (0, int(head)) if head.isdigit() else (1, n)
-
-            for fname in sorted(os.listdir(output_dir), key=_numeric_sort_key):
-                fpath = os.path.join(output_dir, fname)
-                if os.path.isfile(fpath):
-                    index = fname.split("_", 1)[0]
-                    ws.write(row, 0, int(index) if index.isdigit() else index)
-                    ws.write(row, 1, fname)
-                    ws.insert_image(row, 2, fpath, {"object_position": 3})
-                    with Image.open(fpath) as im:
-                        width, height = im.size
-                    ws.set_row(row, height * 0.75)
-                    max_width = max(max_width, width * 0.14)
-                    ws.write(row, 3, "")
-                    row += 1
-
-            ws.set_column(2, 2, max_width)
-        except (MemoryError, TimeoutError, Exception) as e:
-            self.log(f"⚠️ Workbook generation failed: {e}")
-            raise
-        finally:
-            if wb:
-                try:
-                    wb.close()
-                except Exception as e:  # pragma: no cover - defensive
-                    self.log(f"⚠️ Failed to close workbook: {e}")
+            next_job = peek_next_job(self.redis_conn, get_worker_queue_names(job))
+            if (
+                not next_job
+                or next_job.func_name != RUN_MODE_FUNC
+                or has_prefetch(self.redis_conn, next_job.id)
+            ):
+                return
+            mode, email, prompts_file, _ = next_job.args
+            config, _ = load_user_settings(
+                self.redis_conn, email, min_version=next_job.meta.get("settings_version", 0)
+            )
+            if not config:
+                return
+            warm = MidjourneyRunner(mode)
+            warm.HEADERS = {
+                "Authorization": config["USER TOKEN"],
+                "Content-Type": "application/json",
+            }
+            warm.CHANNEL_ID = next_job.meta.get("channel_id") or config["CHANNEL ID"]
+            warm.MIDJOURNEY_APP_ID = config["MIDJOURNEY APP ID"]
+            data = {"prompts_file": prompts_file, "user_id": warm.get_user_id()}
+            prompts = warm._load_prompts(prompts_file)
+            if prompts is not None:
+                data["prompts"] = prompts
+            if (
+                PREFETCH_CLEAR_CHANNEL
+                and data["user_id"]
+                and acquire_channel_lock(self.redis_conn, warm.CHANNEL_ID)
+            ):
+                warm.clear_discord_channel()
+                data["channel_id"] = warm.CHANNEL_ID
+            save_prefetch(self.redis_conn, next_job.id, data)
+            print(f"🔥 Prepared next job {next_job.id}", flush=True)
+        except Exception as e:  # pragma: no cover - defensive
+            print(f"⚠️ Prefetch of the next job failed: {e}", flush=True)
 
     # ------------------------------------------------------------------
     # Main entry point
     # ------------------------------------------------------------------
     # def run(self, user_email: str, prompts_file: str):
-    def run(self, user_email: str, prompts_file: str, key: str):    
+    def run(self, user_email: str, prompts_file: str, key: str) -> bool:
+        """Run the current chunk of a job; ``False`` if it could not start.
+
+        Only the chunk that completes the job (the last one to finish, in
+        any lane) hands it over to finalization (see ``_finalize``); the
+        others just hand over to the next chunk of their lane.
+        """
+        job = get_current_job()
+        lane = job.meta.get("lane", 0) if job else 0
         self.OUTPUT_DIR = get_user_images_dir(user_email)
-        self.FAILED_PROMPTS_PATH = get_user_failed_prompts_path(user_email)
+        if lane:
+            # Lanes of one job may share a machine
+            self.OUTPUT_DIR += f"_lane{lane}"
         self.LOG_KEY = get_user_log_key(user_email)
 
         self.log(f"🟢 Midjourney{self.button_label} mode started running ...")
         self.check_cancel()
 
-        settings_stream = download_file_obj(f"Users/{user_email}/settings.json")
-        if not settings_stream:
+        self.PARENT_ID = get_parent_id(job) if job else uuid.uuid4().hex
+        min_version = job.meta.get("settings_version", 0) if job else 0
+        config, _ = load_user_settings(self.redis_conn, user_email, min_version=min_version)
+        if not config:
             self.log("❌ Could not load settings file from storage. Exiting job.")
-            return
-        config = json.load(settings_stream)
+            return False
 
         USER_TOKEN = config["USER TOKEN"]
-        self.CHANNEL_ID = config["CHANNEL ID"]
+        self.CHANNEL_ID = (job.meta.get("channel_id") if job else None) or config["CHANNEL ID"]
         self.GUILD_ID = config["GUILD ID"]
         self.MIDJOURNEY_APP_ID = config["MIDJOURNEY APP ID"]
         self.MIDJOURNEY_COMMAND_ID = config["MIDJOURNEY COMMAND ID"]
@@ -393,102 +515,104 @@ class MidjourneyRunner:
             "Content-Type": "application/json",
         }
 
-        response = requests.get(prompts_file)
-        if response.status_code != 200:
-            self.log(
-                f"❌ Failed to download prompts file: {response.status_code}"
-            )
-            return
-        prompts = pd.read_excel(BytesIO(response.content))["prompt"].dropna().tolist()
+        # Prepared by the worker that ran the previous job, if any
+        prefetched = (pop_prefetch(self.redis_conn, job.id) if job else None) or {}
+        if prefetched.get("prompts_file") == prompts_file and "prompts" in prefetched:
+            prompts = prefetched["prompts"]
+        else:
+            prompts = self._load_prompts(prompts_file)
+        if prompts is None:
+            return False
+        self._user_id = prefetched.get("user_id")
+        pre_cleared = prefetched.get("channel_id") == self.CHANNEL_ID
+
+        chunk_start = job.meta.get("chunk_start", 0) if job else 0
+        chunk_end = job.meta.get("chunk_end") if job else None
+        if chunk_end is None:
+            chunk_end = len(prompts)
+        chunk = prompts[chunk_start:chunk_end]
 
         os.makedirs(self.OUTPUT_DIR, exist_ok=True)
 
         start = time.time()
-        for i in range(0, len(prompts), 10):
-            batch = prompts[i : i + 10]
+        prefetch_thread = None
+        for i in range(0, len(chunk), 10):
+            batch = chunk[i : i + 10]
+            batch_start = time.time()
             self.log(
-                f"\n🚀 Processing Batch {i//10 + 1} - {len(batch)} prompts..."
+                f"\n🚀 Processing Batch {(chunk_start + i)//10 + 1} - {len(batch)} prompts..."
             )
             self.check_cancel()
-            time.sleep(2)
-            try:
-                self.clear_discord_channel()
-            except Exception as e:  # pragma: no cover - defensive
-                self.log("⚠️ Clear failed:", e)
-            time.sleep(1)
+            if i + 10 >= len(chunk):
+                # Last batch: get the worker's next job ready meanwhile
+                prefetch_thread = self._start_prefetch(job)
+            if i or not pre_cleared:
+                time.sleep(2)
+                try:
+                    self.clear_discord_channel()
+                except Exception as e:  # pragma: no cover - defensive
+                    self.log("⚠️ Clear failed:", e)
+                time.sleep(1)
             self.log("\n↓↓↓ Starting to send prompts:")
-            self.process_batch(batch, i + 1)
+            self.process_batch(batch, chunk_start + i + 1)
             try:
                 self.clear_discord_channel()
             except Exception as e:  # pragma: no cover - defensive
                 self.log("⚠️ Clear after batch failed:", e)
+            self._upload_results(user_email)
 
             job = get_current_job()
+            record_runtime(
+                self.redis_conn, "prompt", (time.time() - batch_start) / len(batch),
+                mode=self.button_label, tier=job.origin if job else None,
+                account=user_email, count=len(batch),
+            )
             if job:
-                completed = min(i + len(batch), len(prompts))
-                job.meta["completed_prompts"] = completed
+                completed = min(i + len(batch), len(chunk))
+                job.meta["completed_prompts"] = add_parent_progress(
+                    self.redis_conn, self.PARENT_ID, len(batch)
+                )
                 job.meta["total_prompts"] = len(prompts)
                 job.save_meta()
+                try:
+                    record_job_work(
+                        self.redis_conn, job.origin, job.id,
+                        job.meta.get("mode"), len(chunk), completed,
+                        account=user_email,
+                    )
+                    publish_queue_event(self.redis_conn, "progress", job.origin, job.id)
+                except Exception as e:  # pragma: no cover - defensive
+                    print(f"⚠️ Failed to record queue progress: {e}", flush=True)
                 # self.log(
                 #     f"🔄 Progress updated: {completed} / {len(prompts)} prompts completed"
                 # )
 
         total = time.time() - start
+        if prefetch_thread:
+            prefetch_thread.join(PREFETCH_JOIN_TIMEOUT)
 
-        zip_path = os.path.join(os.path.dirname(self.OUTPUT_DIR), "images.zip")
-        workbook_path = os.path.join(os.path.dirname(self.OUTPUT_DIR), "images.xlsx")
-
-        with ThreadPoolExecutor(max_workers=2) as ex:
-            zip_future = ex.submit(self._create_images_zip, self.OUTPUT_DIR, zip_path)
-            workbook_future = ex.submit(
-                self._create_images_workbook, self.OUTPUT_DIR, workbook_path
-            )
-            zip_future.result()
+        # Everything is uploaded; the next chunk or the finalizer may run on
+        # another machine
+        for fname in os.listdir(self.OUTPUT_DIR):
             try:
-                workbook_future.result()
-            except Exception as e:
-                self.log(f"⚠️ Failed to create images.xlsx: {e}")
-
-        if os.path.exists(zip_path):
-            if upload_file_path(zip_path, f"Users/{user_email}/images.zip"):
-                self.log(
-                    "✅ Execution completed. Images saved in a ZIP folder under downloads."
-                )
-            else:
-                self.log("❌ Failed to upload ZIP archive.")
-
-        if os.path.exists(self.FAILED_PROMPTS_PATH):
-            if upload_file_path(
-                self.FAILED_PROMPTS_PATH, f"Users/{user_email}/failed_prompts.json"
-            ):
-                self.log(" Failed prompts Excel file has also been downloaded.")
-                try:
-                    os.remove(self.FAILED_PROMPTS_PATH)
-                except Exception as e:  # pragma: no cover - defensive
-                    self.log(f"⚠️ Failed to delete local failed_prompts.json: {e}")
-            else:
-                self.log("❌ Failed to upload failed_prompts.json.")
-
-        if os.path.exists(workbook_path):
-            if upload_file_path(workbook_path, f"Users/{user_email}/images.xlsx"):
-                self.log("✅ Images workbook uploaded.")
-            else:
-                self.log("❌ Failed to upload images.xlsx.")
-
-        try:
-            for fname in os.listdir(self.OUTPUT_DIR):
                 os.remove(os.path.join(self.OUTPUT_DIR, fname))
-            if os.path.exists(zip_path):
-                os.remove(zip_path)
-            if os.path.exists(workbook_path):
-                os.remove(workbook_path)
-        except Exception as e:  # pragma: no cover - defensive
-            self.log(f"⚠️ Cleanup error: {e}")
+            except OSError:
+                pass
+
+        if job and not complete_chunk(self.redis_conn, job):
+            self.log(
+                f"\n⏸️ Prompts {chunk_start + 1}-{chunk_end} of {len(prompts)} done in "
+                f"{int(total // 60)} min {int(total % 60)} sec; the rest of the job is still queued."
+            )
+            self.record_usage(user_email, key, len(chunk))
+            return True
 
+        self._finalize(user_email, job)
         self.log(
             f"\n⏱️ The run took {int(total // 60)} min {int(total % 60)} sec to complete."
         )
-        update_prompts_today(user_email, key, len(prompts))
+        self.record_usage(user_email, key, len(chunk))
+        return True
 
 
 class MidjourneyRunnerAll(MidjourneyRunner):
@@ -626,20 +750,8 @@ class MidjourneyRunnerAll(MidjourneyRunner):
         ]
 
         if failed:
-            existing = []
-            if os.path.exists(self.FAILED_PROMPTS_PATH):
-                try:
-                    with open(self.FAILED_PROMPTS_PATH, "r") as f:
-                        existing = json.load(f)
-                except Exception:  # pragma: no cover - defensive
-                    self.log("⚠️ Failed to load failed prompts")
-            existing.extend(failed)
-
-            failed_prompts_dir = os.path.dirname(self.FAILED_PROMPTS_PATH)
-            os.makedirs(failed_prompts_dir, exist_ok=True)
-
-            with open(self.FAILED_PROMPTS_PATH, "w") as f:
-                json.dump(existing, f, indent=2)
+            # Kept in Redis: the job's chunks may run on different machines
+            add_failed_prompts(self.redis_conn, self.PARENT_ID, failed)
             self.log(
                 f"{len(failed)} failed prompts have been saved to the failed prompts file."
             )
@@ -0,0 +1,331 @@
+"""Cached queue snapshot shared by the web endpoints.
+
+A single leader (holding a Redis lease) rebuilds the snapshot, either from a
+thread inside one of the web workers or as a standalone process::
+
+    python -m app.queue_snapshot
+
+It refreshes as soon as a queue event (enqueue, start, finish, cancel) is
+published and backs off while all queues are idle.
+"""
+
+import json
+import os
+import time
+import uuid
+
+from redis import Redis
+from rq import Queue
+from rq.job import Job
+from rq.utils import as_text, utcparse
+from rq.worker_registration import WORKERS_BY_QUEUE_KEY
+
+from app.eta_engine import (
+    get_queue_work_key,
+    get_typical_job_runtime,
+    parse_queue_work,
+    remaining_seconds,
+    simulate_queue,
+)
+
+QUEUE_NAMES = ["default", "Tier1", "Tier2", "Tier3"]
+
+# Queued jobs beyond this many per queue are left out of the snapshot
+QUEUE_SNAPSHOT_MAX_JOBS = int(os.getenv("QUEUE_SNAPSHOT_MAX_JOBS", "500"))
+
+# Keys for cached queue information: a small header hash per queue, a hash
+# of job id -> position/ETA per queue and a global version counter
+QUEUE_SNAPSHOT_HEADER_KEY = "queue_snapshot:{}"
+QUEUE_SNAPSHOT_JOBS_KEY = "queue_snapshot:{}:jobs"
+QUEUE_SNAPSHOT_VERSION_KEY = "queue_snapshot:version"
+QUEUE_UPDATE_CHANNEL = "queue_updates"
+# Job lifecycle notifications (enqueued/started/finished/canceled)
+QUEUE_EVENTS_CHANNEL = "queue_events"
+# Jobs that reported "finished" (job id -> time); RQ keeps such a job in the
+# started registry until its callbacks ran, so the snapshot skips it meanwhile
+QUEUE_FINISHED_JOBS_KEY = "queue_snapshot:finished"
+FINISHED_JOB_GRACE = 60  # seconds
+
+SNAPSHOT_LEADER_KEY = "queue_snapshot:leader"
+SNAPSHOT_LEASE_TTL = int(os.getenv("QUEUE_SNAPSHOT_LEASE_TTL", "15"))  # seconds
+SNAPSHOT_INTERVAL = int(os.getenv("QUEUE_SNAPSHOT_INTERVAL", "5"))  # seconds
+SNAPSHOT_IDLE_MAX_INTERVAL = int(os.getenv("QUEUE_SNAPSHOT_IDLE_MAX_INTERVAL", "60"))
+
+# Take or renew the lease; returns 1 while we are the leader
+_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+
+def publish_queue_event(redis_conn, event: str, queue_name: str, job_id: str | None = None) -> None:
+    """Notify the snapshot refresher that a queue changed (best effort)."""
+    try:
+        pipe = redis_conn.pipeline(transaction=False)
+        if event == "finished" and job_id:
+            now = time.time()
+            pipe.zadd(QUEUE_FINISHED_JOBS_KEY, {job_id: now})
+            pipe.zremrangebyscore(QUEUE_FINISHED_JOBS_KEY, "-inf", now - FINISHED_JOB_GRACE)
+            pipe.expire(QUEUE_FINISHED_JOBS_KEY, FINISHED_JOB_GRACE)
+        pipe.publish(
+            QUEUE_EVENTS_CHANNEL,
+            json.dumps({"event": event, "queue": queue_name, "job_id": job_id}),
+        )
+        pipe.execute()
+    except Exception as exc:
+        print(f"queue event publish failed: {exc}")
+
+
+def build_queue_snapshot(redis_conn) -> dict[str, dict]:
+    """Return worker counts and per-job position/ETA for every queue.
+
+    Uses two pipelined round trips regardless of queue length: one for the
+    registered workers, queue lengths, queued job ids, running job ids and
+    outstanding work (see ``app.eta_engine``) of all queues, and one to
+    check which workers are still alive and read ``started_at`` of running
+    jobs the work hash does not know about.  Only the first
+    ``QUEUE_SNAPSHOT_MAX_JOBS`` queued jobs of each queue are listed;
+    ``count`` holds the full queue length and ``tail_eta`` the start ETA of
+    a job enqueued now.  ``stale`` lists work entries of jobs that left the
+    queue without being cleaned up.  Jobs that already reported "finished"
+    are not counted as running while RQ still lists them.
+    """
+    queues = [Queue(name=name, connection=redis_conn) for name in QUEUE_NAMES]
+    now = time.time()
+
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.zrangebyscore(QUEUE_FINISHED_JOBS_KEY, now - FINISHED_JOB_GRACE, "+inf")
+    for queue in queues:
+        pipe.smembers(WORKERS_BY_QUEUE_KEY % queue.name)
+        pipe.llen(queue.key)
+        pipe.lrange(queue.key, 0, QUEUE_SNAPSHOT_MAX_JOBS - 1)
+        pipe.zrange(queue.started_job_registry.key, 0, -1)
+        pipe.hgetall(get_queue_work_key(queue.name))
+    finished, *results = pipe.execute()
+    finished = {as_text(jid) for jid in finished or ()}
+
+    layout: dict[str, tuple[set[str], int, list[str], list[str], dict[str, dict]]] = {}
+    for i, queue in enumerate(queues):
+        workers, count, queued_ids, running_entries, work = results[i * 5 : i * 5 + 5]
+        registry = queue.started_job_registry
+        running_ids = [
+            jid for jid in dict.fromkeys(
+                registry.parse_job_id(as_text(entry)) for entry in running_entries
+            )
+            if jid not in finished
+        ]
+        layout[queue.name] = (
+            {as_text(w) for w in workers or ()},
+            int(count or 0),
+            [as_text(jid) for jid in queued_ids],
+            running_ids,
+            parse_queue_work(work),
+        )
+
+    # Registrations outlive crashed or suspended workers; keep live ones only
+    worker_keys = sorted(set().union(*(info[0] for info in layout.values())))
+    untracked = [jid for info in layout.values() for jid in info[3] if jid not in info[4]]
+    pipe = redis_conn.pipeline(transaction=False)
+    for key in worker_keys:
+        pipe.exists(key)
+    for jid in untracked:
+        pipe.hget(Job.key_for(jid), "started_at")
+    results = pipe.execute() if worker_keys or untracked else []
+
+    alive = {key for key, exists in zip(worker_keys, results) if exists}
+    started_at: dict[str, float] = {}
+    for jid, raw in zip(untracked, results[len(worker_keys):]):
+        if raw:
+            try:
+                started_at[jid] = utcparse(as_text(raw)).timestamp()
+            except ValueError:
+                pass
+
+    snapshot: dict[str, dict] = {}
+    for name, (workers, count, queued_ids, running_ids, work) in layout.items():
+        typical = get_typical_job_runtime(redis_conn, tier=name)
+        running = []
+        for jid in running_ids:
+            if jid in work:
+                seconds = remaining_seconds(work[jid], running=True, now=now)
+            elif jid in started_at:
+                seconds = max(typical - (now - started_at[jid]), 0)
+            else:
+                seconds = typical
+            running.append((jid, seconds))
+        queued = [(jid, remaining_seconds(work.get(jid), typical=typical)) for jid in queued_ids]
+
+        worker_count = len(workers & alive)
+        job_info, tail_eta = simulate_queue(
+            worker_count, running, queued, untracked=count - len(queued_ids), typical=typical
+        )
+
+        # Only a fully listed queue tells us which work entries are orphaned
+        stale = []
+        if count <= len(queued_ids):
+            stale = [jid for jid in work if jid not in job_info]
+
+        snapshot[name] = {
+            "workers": worker_count,
+            "count": count,
+            "tail_eta": tail_eta,
+            "jobs": job_info,
+            "stale": stale,
+        }
+    return snapshot
+
+
+def store_queue_snapshot(redis_conn, snapshot: dict[str, dict]) -> int:
+    """Write the snapshot as per-queue hashes in one transaction.
+
+    Returns the new snapshot version.
+    """
+    updated_at = time.time()
+    pipe = redis_conn.pipeline(transaction=True)
+    for name, info in snapshot.items():
+        jobs_key = QUEUE_SNAPSHOT_JOBS_KEY.format(name)
+        pipe.delete(jobs_key)
+        if info["jobs"]:
+            pipe.hset(jobs_key, mapping={jid: json.dumps(data) for jid, data in info["jobs"].items()})
+        pipe.hset(QUEUE_SNAPSHOT_HEADER_KEY.format(name), mapping={
+            "workers": info["workers"],
+            "count": info["count"],
+            "running": sum(1 for data in info["jobs"].values() if data["position"] == 0),
+            "tail_eta": info.get("tail_eta", 0),
+            "updated_at": updated_at,
+        })
+        if info.get("stale"):
+            pipe.hdel(get_queue_work_key(name), *info["stale"])
+    pipe.incr(QUEUE_SNAPSHOT_VERSION_KEY)
+    return int(pipe.execute()[-1])
+
+
+def refresh_queue_snapshot(redis_conn) -> bool:
+    """Rebuild and store the snapshot, then notify SSE clients.
+
+    The notification carries the new version so listeners can tell
+    snapshot updates apart from other messages.  Returns ``True`` while any
+    queue still has running or queued jobs.
+    """
+    snapshot = build_queue_snapshot(redis_conn)
+    version = store_queue_snapshot(redis_conn, snapshot)
+    redis_conn.publish(QUEUE_UPDATE_CHANNEL, str(version))
+    return any(info["jobs"] or info["count"] for info in snapshot.values())
+
+
+def get_snapshot_version(redis_conn) -> int:
+    return int(redis_conn.get(QUEUE_SNAPSHOT_VERSION_KEY) or 0)
+
+
+def get_queue_job_info(redis_conn, queue_name: str, job_id: str | None) -> tuple[dict, dict | None]:
+    """Return ``(header, job_info)`` for a queue in a single round trip.
+
+    ``header`` has ``workers``, ``count`` (queued jobs), ``running``,
+    ``tail_eta`` (seconds until a newly queued job starts) and
+    ``updated_at``; it is empty before the first snapshot.  ``job_info`` is
+    the job's ``position``/``eta_seconds`` or ``None`` when the job is not
+    in the snapshot.
+    """
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.hgetall(QUEUE_SNAPSHOT_HEADER_KEY.format(queue_name))
+    if job_id:
+        pipe.hget(QUEUE_SNAPSHOT_JOBS_KEY.format(queue_name), job_id)
+    results = pipe.execute()
+
+    header: dict = {}
+    for field, value in (results[0] or {}).items():
+        field = as_text(field)
+        header[field] = float(value) if field in ("tail_eta", "updated_at") else int(value)
+
+    job_info = None
+    if job_id and results[1]:
+        try:
+            job_info = json.loads(results[1])
+        except Exception:
+            pass
+    return header, job_info
+
+
+def _wait_for_event(pubsub, timeout: float) -> bool:
+    """Block until a queue event arrives or ``timeout`` elapses.
+
+    Any further events already waiting are drained so a burst of updates
+    triggers a single refresh.
+    """
+    deadline = time.time() + timeout
+    got_event = False
+    while True:
+        remaining = 0 if got_event else deadline - time.time()
+        if remaining < 0:
+            return got_event
+        message = pubsub.get_message(timeout=remaining)
+        if message is None:
+            if got_event or time.time() >= deadline:
+                return got_event
+            continue
+        if message.get("type") == "message":
+            got_event = True
+
+
+def run_snapshot_refresher(redis_conn) -> None:
+    """Keep the snapshot fresh while holding the leader lease.
+
+    Followers only retry the lease every third of its TTL, so Redis load
+    from snapshotting stays constant no matter how many web workers run
+    this loop.  The leader refreshes on every queue event, every
+    ``SNAPSHOT_INTERVAL`` seconds while jobs exist, and doubles the
+    interval up to ``SNAPSHOT_IDLE_MAX_INTERVAL`` while all queues are
+    empty.
+    """
+    token = uuid.uuid4().hex
+    lease_ms = SNAPSHOT_LEASE_TTL * 1000
+    renew_every = SNAPSHOT_LEASE_TTL / 3
+    interval = SNAPSHOT_INTERVAL
+    next_refresh = 0.0
+    pubsub = None
+
+    while True:
+        try:
+            lease = redis_conn.register_script(_LEASE_SCRIPT)
+            if not lease(keys=[SNAPSHOT_LEADER_KEY], args=[token, lease_ms]):
+                if pubsub is not None:
+                    pubsub.close()
+                    pubsub = None
+                next_refresh = 0.0
+                time.sleep(renew_every)
+                continue
+
+            if pubsub is None:
+                pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(QUEUE_EVENTS_CHANNEL)
+
+            if time.time() >= next_refresh:
+                busy = refresh_queue_snapshot(redis_conn)
+                interval = SNAPSHOT_INTERVAL if busy else min(interval * 2, SNAPSHOT_IDLE_MAX_INTERVAL)
+                next_refresh = time.time() + interval
+
+            # Wake up for the next refresh, an event, or to renew the lease
+            wait = max(min(next_refresh - time.time(), renew_every), 0)
+            if _wait_for_event(pubsub, wait):
+                interval = SNAPSHOT_INTERVAL
+                next_refresh = 0.0
+        except Exception as exc:
+            # Do not crash the loop if something goes wrong; just log.
+            print(f"queue snapshot refresh failed: {exc}")
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+                pubsub = None
+            time.sleep(SNAPSHOT_INTERVAL)
+
+
+if __name__ == "__main__":  # pragma: no cover - manual run
+    run_snapshot_refresher(Redis.from_url(os.getenv("REDIS_URL", "redis://redis:6379/0")))
@@ -0,0 +1,279 @@
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import requests
+
+# Daily quotas reset at midnight in this timezone (matches the license service)
+QUOTA_TZ = ZoneInfo(os.getenv("QUOTA_TZ", "America/Chicago"))
+# Keep each day's ledger around a little longer than the day itself
+QUOTA_LEDGER_TTL = 2 * 24 * 3600
+
+# Durable queue of usage reports still to be sent to the license service
+QUOTA_OUTBOX_KEY = "quota_outbox"
+# Reports being sent, scored by the time they were claimed
+QUOTA_OUTBOX_PROCESSING_KEY = "quota_outbox:claimed"
+QUOTA_FLUSH_LOCK_KEY = "quota_outbox:lock"
+QUOTA_FLUSH_LOCK_TTL = 60  # seconds, renewed before every request
+QUOTA_FLUSH_BATCH = int(os.getenv("QUOTA_FLUSH_BATCH", "100"))
+QUOTA_POST_TIMEOUT = 10  # seconds
+# Claimed reports are only taken back once their flusher must have given up
+QUOTA_CLAIM_LEASE = QUOTA_FLUSH_BATCH * QUOTA_POST_TIMEOUT + QUOTA_FLUSH_LOCK_TTL
+# How often the background flusher retries undelivered reports
+QUOTA_FLUSH_INTERVAL = int(os.getenv("QUOTA_FLUSH_INTERVAL", "60"))  # seconds
+
+# Reserve ``count`` prompts for a job if the daily quota allows it.
+# ``used`` never drops below the usage reported by the license service.
+_RESERVE_SCRIPT = """
+local used = tonumber(redis.call('HGET', KEYS[1], 'used') or '0')
+local remote = tonumber(ARGV[4])
+if remote > used then
+    used = remote
+    redis.call('HSET', KEYS[1], 'used', used)
+end
+local reserved = tonumber(redis.call('HGET', KEYS[1], 'reserved') or '0')
+local field = 'res:' .. ARGV[1]
+if redis.call('HEXISTS', KEYS[1], field) == 1 then
+    return {1, used, reserved}
+end
+local count = tonumber(ARGV[2])
+if used + reserved + count > tonumber(ARGV[3]) then
+    return {0, used, reserved}
+end
+redis.call('HINCRBY', KEYS[1], 'reserved', count)
+redis.call('HSET', KEYS[1], field, count)
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return {1, used, reserved + count}
+"""
+
+# Turn up to ``count`` reserved prompts into usage and queue a report
+_COMMIT_SCRIPT = """
+local field = 'res:' .. ARGV[1]
+local held = tonumber(redis.call('HGET', KEYS[1], field) or '0')
+local count = tonumber(ARGV[2])
+local take = math.min(held, count)
+if held > 0 then
+    if held - take > 0 then
+        redis.call('HSET', KEYS[1], field, held - take)
+    else
+        redis.call('HDEL', KEYS[1], field)
+    end
+    redis.call('HINCRBY', KEYS[1], 'reserved', -take)
+end
+redis.call('HINCRBY', KEYS[1], 'used', count)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('RPUSH', KEYS[2], ARGV[3])
+return count
+"""
+
+# Drop whatever is still reserved for a job
+_RELEASE_SCRIPT = """
+local field = 'res:' .. ARGV[1]
+local held = tonumber(redis.call('HGET', KEYS[1], field) or '0')
+if held > 0 then
+    redis.call('HINCRBY', KEYS[1], 'reserved', -held)
+end
+redis.call('HDEL', KEYS[1], field)
+return held
+"""
+
+# Move a batch from the outbox to the claimed set atomically, stamped with ARGV[2]
+_CLAIM_BATCH_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items > 0 then
+    redis.call('LTRIM', KEYS[1], #items, -1)
+    for _, item in ipairs(items) do
+        redis.call('ZADD', KEYS[2], ARGV[2], item)
+    end
+end
+return items
+"""
+
+# Put reports claimed before ARGV[1] back into the outbox
+_RECOVER_SCRIPT = """
+local items = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for _, item in ipairs(items) do
+    redis.call('ZREM', KEYS[2], item)
+    redis.call('RPUSH', KEYS[1], item)
+end
+return #items
+"""
+
+# Extend the flush lock only while we still hold it
+_RENEW_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def get_quota_day(now: float | None = None) -> str:
+    """Return the current quota day (``YYYY-MM-DD``) in ``QUOTA_TZ``."""
+    ts = time.time() if now is None else now
+    return datetime.fromtimestamp(ts, QUOTA_TZ).strftime("%Y-%m-%d")
+
+
+def get_quota_ledger_key(email: str, day: str) -> str:
+    return f"quota:{email}:{day}"
+
+
+def reserve_quota(
+    redis_conn, email: str, job_id: str, count: int, daily_quota: int, remote_used: int = 0
+) -> tuple[bool, int, str]:
+    """Atomically reserve ``count`` prompts of today's quota for ``job_id``.
+
+    Returns ``(ok, used, day)`` where ``used`` counts both committed and
+    reserved prompts and ``day`` must be passed back when committing or
+    releasing the reservation.
+    """
+    day = get_quota_day()
+    reserve = redis_conn.register_script(_RESERVE_SCRIPT)
+    ok, used, reserved = reserve(
+        keys=[get_quota_ledger_key(email, day)],
+        args=[job_id, int(count), int(daily_quota), int(remote_used), QUOTA_LEDGER_TTL],
+    )
+    return bool(ok), int(used) + int(reserved), day
+
+
+def commit_quota(redis_conn, email: str, key: str, job_id: str, count: int, day: str | None = None) -> None:
+    """Record ``count`` prompts as used and queue a report to the license service."""
+    day = day or get_quota_day()
+    entry = json.dumps({
+        "id": uuid.uuid4().hex,
+        "email": email,
+        "key": key,
+        "count": int(count),
+        "job_id": job_id,
+        "day": day,
+        "attempts": 0,
+    })
+    commit = redis_conn.register_script(_COMMIT_SCRIPT)
+    commit(
+        keys=[get_quota_ledger_key(email, day), QUOTA_OUTBOX_KEY],
+        args=[job_id, int(count), entry, QUOTA_LEDGER_TTL],
+    )
+
+
+def release_quota(redis_conn, email: str, job_id: str, day: str | None = None) -> int:
+    """Release anything still reserved for ``job_id``; safe to call repeatedly."""
+    day = day or get_quota_day()
+    release = redis_conn.register_script(_RELEASE_SCRIPT)
+    return int(release(keys=[get_quota_ledger_key(email, day)], args=[job_id]) or 0)
+
+
+def get_quota_used(redis_conn, email: str) -> int:
+    """Return today's committed usage from the ledger."""
+    try:
+        used = redis_conn.hget(get_quota_ledger_key(email, get_quota_day()), "used")
+    except Exception:
+        return 0
+    return int(used or 0)
+
+
+def release_quota_on_failure(job, connection, type, value, traceback):
+    """RQ ``on_failure`` callback returning a failed job's reservation.
+
+    Chunks of a job share the reservation of their parent.
+    """
+    email = job.meta.get("user_email")
+    if email:
+        parent_id = job.meta.get("parent_id") or job.id
+        release_quota(connection, email, parent_id, job.meta.get("quota_day"))
+
+
+def _post_usage(email: str, key: str, count: int, report_ids: list[str]) -> bool:
+    """Call the Apps Script endpoint to add ``count`` to PromptsToday.
+
+    ``report_ids`` identify the summed reports so the service can ignore a
+    resend of a report it already counted.
+    """
+    endpoint = os.getenv("LICENSE_VALIDATION_URL")
+    payload = {"email": email, "key": key, "promptsThisJob": count, "reportIds": report_ids}
+    try:
+        r = requests.post(endpoint, json=payload, timeout=QUOTA_POST_TIMEOUT)
+        r.raise_for_status()
+        print("✅ PromptsToday updated:", r.json(), flush=True)
+        return True
+    except Exception as e:
+        print("⚠️ Failed to update PromptsToday:", e, flush=True)
+        return False
+
+
+def flush_quota_outbox(redis_conn, batch_size: int = QUOTA_FLUSH_BATCH) -> int:
+    """Send queued usage reports to the license service.
+
+    Reports are claimed in batches and summed per user so each user gets a
+    single request.  Failed reports go back to the outbox to be retried by
+    the next flush.  Only one flusher runs at a time: the lock is renewed
+    before every request and a flusher that lost it stops.  Reports a
+    crashed flusher left claimed are recovered once ``QUOTA_CLAIM_LEASE``
+    has passed, so a slow but live flusher never has its reports resent.
+    Returns the number of reports delivered.
+    """
+    token = uuid.uuid4().hex
+    if not redis_conn.set(QUOTA_FLUSH_LOCK_KEY, token, nx=True, ex=QUOTA_FLUSH_LOCK_TTL):
+        return 0
+
+    delivered = 0
+    try:
+        started = time.time()
+        keys = [QUOTA_OUTBOX_KEY, QUOTA_OUTBOX_PROCESSING_KEY]
+        recover = redis_conn.register_script(_RECOVER_SCRIPT)
+        recover(keys=keys, args=[started - QUOTA_CLAIM_LEASE])
+
+        claim = redis_conn.register_script(_CLAIM_BATCH_SCRIPT)
+        raw_items = claim(keys=keys, args=[batch_size, started])
+        groups: dict[tuple[str, str], list] = {}
+        for raw in raw_items:
+            try:
+                entry = json.loads(raw)
+            except Exception:
+                print(f"⚠️ Dropping malformed quota report: {raw!r}", flush=True)
+                redis_conn.zrem(QUOTA_OUTBOX_PROCESSING_KEY, raw)
+                continue
+            groups.setdefault((entry["email"], entry["key"]), []).append((raw, entry))
+
+        renew = redis_conn.register_script(_RENEW_LOCK_SCRIPT)
+        for (email, key), entries in groups.items():
+            # Whatever is left stays claimed until the lease runs out
+            if time.time() - started > QUOTA_CLAIM_LEASE - QUOTA_FLUSH_LOCK_TTL:
+                break
+            if not renew(keys=[QUOTA_FLUSH_LOCK_KEY], args=[token, QUOTA_FLUSH_LOCK_TTL]):
+                print("⚠️ Lost the quota flush lock; stopping", flush=True)
+                break
+            total = sum(e["count"] for _, e in entries)
+            ids = [e["id"] for _, e in entries if e.get("id")]
+            ok = _post_usage(email, key, total, ids) if total else True
+            pipe = redis_conn.pipeline()
+            for raw, entry in entries:
+                pipe.zrem(QUOTA_OUTBOX_PROCESSING_KEY, raw)
+                if not ok:
+                    entry["attempts"] = entry.get("attempts", 0) + 1
+                    pipe.rpush(QUOTA_OUTBOX_KEY, json.dumps(entry))
+            pipe.execute()
+            if ok:
+                delivered += len(entries)
+    finally:
+        if redis_conn.get(QUOTA_FLUSH_LOCK_KEY) in (token, token.encode()):
+            redis_conn.delete(QUOTA_FLUSH_LOCK_KEY)
+    return delivered
+
+
+def run_quota_flusher(redis_conn, interval: float = QUOTA_FLUSH_INTERVAL) -> None:
+    """Flush the outbox every ``interval`` seconds, forever.
+
+    Jobs flush right after committing usage; this loop delivers whatever
+    they could not (e.g. while the license service was down) even when no
+    further jobs run.  The flush lock keeps concurrent loops harmless.
+    """
+    while True:
+        try:
+            if redis_conn.llen(QUOTA_OUTBOX_KEY) or redis_conn.zcard(QUOTA_OUTBOX_PROCESSING_KEY):
+                flush_quota_outbox(redis_conn)
+        except Exception as e:
+            print(f"⚠️ Quota outbox flush failed: {e}", flush=True)
+        time.sleep(interval)
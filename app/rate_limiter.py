@@ -0,0 +1,163 @@
+"""Redis token buckets that pace Discord API calls across workers.
+
+Every Discord call of a runner goes through ``discord_request``.  Calls
+are grouped by account (a hash of the user token, never the token itself)
+and route class, and each group draws from one token bucket kept in Redis,
+so all lanes, chunks and machines working for an account share the same
+budget.  A 429 answer blocks the bucket for Discord's ``retry_after`` (every
+route class of the account for a global limit) and the call is retried.
+"""
+
+import hashlib
+import os
+import time
+
+import requests
+
+# "route:rate/burst" entries; rate in requests per second
+DEFAULT_DISCORD_RATE_LIMITS = "interactions:0.5/2,messages:1/5,deletes:1/5,users:0.2/2"
+DISCORD_MAX_RETRIES = int(os.getenv("DISCORD_MAX_RETRIES", "3"))
+DISCORD_REQUEST_TIMEOUT = 30  # seconds
+# Longest single wait for a token before trying again
+MAX_RATE_WAIT = 5.0  # seconds
+BUCKET_TTL = 3600  # seconds
+
+# Take a token if one is available; otherwise return the ms to wait for it.
+# Time comes from the Redis server so machines with skewed clocks agree.
+_TAKE_TOKEN_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local rate = tonumber(ARGV[1]) / 1000
+local burst = tonumber(ARGV[2])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'blocked_until')
+local blocked = tonumber(state[3]) or 0
+if blocked > now then
+    return blocked - now
+end
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(now - ts, 0) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return wait
+"""
+
+# Block a bucket until now + ARGV[1] ms (never shortening a longer block)
+_BLOCK_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local until_ms = now + tonumber(ARGV[1])
+local blocked = tonumber(redis.call('HGET', KEYS[1], 'blocked_until')) or 0
+if until_ms > blocked then
+    redis.call('HSET', KEYS[1], 'blocked_until', until_ms)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return until_ms
+"""
+
+
+def parse_rate_limits(raw: str | None) -> dict[str, tuple[float, float]]:
+    limits: dict[str, tuple[float, float]] = {}
+    for item in (raw or "").split(","):
+        route, _, spec = item.strip().partition(":")
+        rate, _, burst = spec.partition("/")
+        try:
+            rate, burst = float(rate), float(burst or 1)
+        except ValueError:
+            continue
+        if route and rate > 0:
+            limits[route] = (rate, max(burst, 1.0))
+    return limits
+
+
+DISCORD_RATE_LIMITS = parse_rate_limits(DEFAULT_DISCORD_RATE_LIMITS) | parse_rate_limits(
+    os.getenv("DISCORD_RATE_LIMITS")
+)
+
+
+def get_account_hash(token: str) -> str:
+    return hashlib.sha256((token or "").encode()).hexdigest()[:16]
+
+
+def get_bucket_key(account: str, route: str) -> str:
+    return f"discord_rate:{account}:{route}"
+
+
+def take_token(redis_conn, account: str, route: str) -> float:
+    """Take a token from the bucket; returns the seconds to wait if there is none."""
+    rate, burst = DISCORD_RATE_LIMITS.get(route, DISCORD_RATE_LIMITS["users"])
+    script = redis_conn.register_script(_TAKE_TOKEN_SCRIPT)
+    wait_ms = script(keys=[get_bucket_key(account, route)], args=[rate, burst, BUCKET_TTL])
+    return int(wait_ms or 0) / 1000
+
+
+def acquire(redis_conn, account: str, route: str) -> None:
+    """Block until the account may make a call of ``route``.
+
+    Redis errors let the call through: pacing is a safeguard, not a
+    reason to fail a job.
+    """
+    while True:
+        try:
+            wait = take_token(redis_conn, account, route)
+        except Exception as e:
+            print(f"⚠️ Rate limiter unavailable: {e}", flush=True)
+            return
+        if wait <= 0:
+            return
+        time.sleep(min(wait, MAX_RATE_WAIT))
+
+
+def block(redis_conn, account: str, routes, seconds: float) -> None:
+    """Hold back every call of ``routes`` for ``seconds`` (after a 429)."""
+    script = redis_conn.register_script(_BLOCK_SCRIPT)
+    for route in routes:
+        try:
+            script(keys=[get_bucket_key(account, route)], args=[int(seconds * 1000), BUCKET_TTL])
+        except Exception as e:
+            print(f"⚠️ Rate limiter unavailable: {e}", flush=True)
+
+
+def get_retry_after(response) -> tuple[float, bool]:
+    """Return ``(seconds, is_global)`` from a 429 response."""
+    try:
+        body = response.json()
+    except ValueError:
+        body = {}
+    if not isinstance(body, dict):
+        body = {}
+    retry_after = body.get("retry_after") or response.headers.get("Retry-After") or 1
+    is_global = bool(body.get("global")) or response.headers.get("X-RateLimit-Global") == "true"
+    try:
+        return max(float(retry_after), 0.0), is_global
+    except (TypeError, ValueError):
+        return 1.0, is_global
+
+
+def discord_request(redis_conn, method: str, url: str, route: str, headers: dict, **kwargs):
+    """Send a Discord API request paced by the account's ``route`` bucket.
+
+    429 answers block the bucket for ``retry_after`` and are retried up to
+    ``DISCORD_MAX_RETRIES`` times; the last response is returned either way.
+    """
+    account = get_account_hash(headers.get("Authorization", ""))
+    kwargs.setdefault("timeout", DISCORD_REQUEST_TIMEOUT)
+    for attempt in range(DISCORD_MAX_RETRIES + 1):
+        acquire(redis_conn, account, route)
+        response = requests.request(method, url, headers=headers, **kwargs)
+        if response.status_code != 429 or attempt == DISCORD_MAX_RETRIES:
+            return response
+        retry_after, is_global = get_retry_after(response)
+        print(
+            f"⚠️ Discord rate limited {route} for {retry_after:.1f}s"
+            f"{' (global)' if is_global else ''}",
+            flush=True,
+        )
+        block(redis_conn, account, DISCORD_RATE_LIMITS if is_global else (route,), retry_after)
+    return response
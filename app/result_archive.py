@@ -0,0 +1,153 @@
+"""Per-image result storage and ZIP archives streamed from it.
+
+Workers upload every saved image as its own object under
+``Users/<email>/images/`` together with a ``manifest.json`` describing
+them.  Downloads assemble a ZIP on the fly from those objects, so no
+archive is ever built, uploaded or buffered: each image is copied into the
+stream chunk by chunk as it arrives from storage.  While a stream runs it
+holds a download lease (see ``app.job_cleanup``) that keeps cleanup from
+deleting the objects it still has to read.
+"""
+
+import io
+import json
+import os
+import time
+import zipfile
+
+from app.tigris_utils import (
+    DOWNLOAD_CHUNK_SIZE,
+    download_file_obj,
+    get_object_stream,
+    upload_file_obj,
+)
+
+
+def get_results_prefix(email: str) -> str:
+    return f"Users/{email}/images/"
+
+
+def get_manifest_key(email: str) -> str:
+    return f"Users/{email}/manifest.json"
+
+
+def build_manifest(email: str, filenames: list[str], failed: list[dict] | None = None) -> dict:
+    """Describe a job's stored images.
+
+    Image files are named ``<index>_<variant><ext>``; ``failed`` is the
+    runner's failed prompts list.
+    """
+    prefix = get_results_prefix(email)
+    images = []
+    for fname in filenames:
+        stem = os.path.splitext(fname)[0]
+        head, _, variant = stem.partition("_")
+        images.append({
+            "file": fname,
+            "key": prefix + fname,
+            "index": int(head) if head.isdigit() else None,
+            "variant": variant or None,
+        })
+    images.sort(key=lambda e: (e["index"] is None, e["index"] or 0, e["file"]))
+    failed_indexes = sorted({f["index"] for f in failed or [] if isinstance(f.get("index"), int)})
+    return {"created_at": time.time(), "images": images, "failed": failed_indexes}
+
+
+def select_images(
+    manifest: dict,
+    variants: set[str] | None = None,
+    start: int | None = None,
+    end: int | None = None,
+    failed_only: bool = False,
+) -> list[dict]:
+    """Return the manifest images matching the download filters.
+
+    ``start``/``end`` are inclusive prompt indexes.  ``failed_only`` keeps
+    prompts that had at least one failure (e.g. missing variants in "All"
+    mode).
+    """
+    failed = set(manifest.get("failed", []))
+    selected = []
+    for entry in manifest.get("images", []):
+        index = entry.get("index")
+        if variants and entry.get("variant") not in variants:
+            continue
+        if start is not None and (index is None or index < start):
+            continue
+        if end is not None and (index is None or index > end):
+            continue
+        if failed_only and index not in failed:
+            continue
+        selected.append(entry)
+    return selected
+
+
+class _StreamBuffer(io.RawIOBase):
+    """Write-only, unseekable sink that ``zipfile`` writes into."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(entries: list[dict], open_stream=get_object_stream):
+    """Yield a ZIP archive of ``entries`` without knowing sizes up front.
+
+    Images are stored uncompressed (they already are compressed) and
+    written with data descriptors, so memory use is bounded by one storage
+    chunk.  A missing object raises ``FileNotFoundError`` and aborts the
+    stream, so the client sees a failed download instead of an archive
+    that silently lacks images.
+    """
+    sink = _StreamBuffer()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        for entry in entries:
+            obj = open_stream(entry["key"])
+            if not obj or "Body" not in obj:
+                print(f"❌ Result object {entry['key']} is missing; aborting the ZIP", flush=True)
+                raise FileNotFoundError(entry["key"])
+            info = zipfile.ZipInfo(entry["file"], date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            body = obj["Body"]
+            try:
+                with archive.open(info, mode="w") as dest:
+                    for chunk in body.iter_chunks(DOWNLOAD_CHUNK_SIZE):
+                        dest.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+            finally:
+                body.close()
+            data = sink.drain()
+            if data:
+                yield data
+    data = sink.drain()
+    if data:
+        yield data
+
+
+def load_manifest(email: str) -> dict | None:
+    """Return the stored manifest for ``email``'s last job, if any."""
+    stream = download_file_obj(get_manifest_key(email))
+    if not stream:
+        return None
+    try:
+        manifest = json.load(stream)
+    except Exception:
+        return None
+    return manifest if isinstance(manifest, dict) else None
+
+
+def upload_manifest(email: str, manifest: dict) -> bool:
+    return upload_file_obj(io.BytesIO(json.dumps(manifest).encode()), get_manifest_key(email))
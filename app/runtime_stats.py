@@ -0,0 +1,159 @@
+"""Rolling runtime histograms recorded by the workers.
+
+Durations are counted into log-spaced buckets (~10% wide) in one Redis
+hash per scope and hour.  Each sample is recorded for its mode, its tier
+and its account as well as across all modes, so a lookup can use the most
+specific scope that has enough recent data.  Only the last
+``RUNTIME_STATS_WINDOW_HOURS`` hours are read, which lets estimates follow
+Midjourney's fast/relax swings instead of fixed constants.
+"""
+
+import math
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+
+RUNTIME_HIST_KEY = "runtime_hist:{}:{}"
+RUNTIME_STATS_WINDOW_HOURS = int(os.getenv("RUNTIME_STATS_WINDOW_HOURS", "6"))
+# Fewer samples than this in a scope and the next broader scope is used
+RUNTIME_STATS_MIN_SAMPLES = int(os.getenv("RUNTIME_STATS_MIN_SAMPLES", "20"))
+# Percentile used for ETAs and duration estimates
+RUNTIME_ETA_PERCENTILE = float(os.getenv("RUNTIME_ETA_PERCENTILE", "50"))
+# Percentile lookups are cached per process for this long (seconds)
+RUNTIME_STATS_CACHE_TTL = int(os.getenv("RUNTIME_STATS_CACHE_TTL", "60"))
+# Lookups are keyed by account, so only this many are kept (least recently used go first)
+RUNTIME_STATS_CACHE_SIZE = int(os.getenv("RUNTIME_STATS_CACHE_SIZE", "1024"))
+
+_BUCKET_BASE = 1.1
+
+_cache: OrderedDict[tuple, tuple[float, float | None]] = OrderedDict()
+_cache_lock = Lock()
+
+
+def _bucket(seconds: float) -> int:
+    return max(int(math.log(max(seconds, 1.0)) / math.log(_BUCKET_BASE)), 0)
+
+
+def _bucket_value(index: int) -> float:
+    """Return the geometric midpoint of a bucket."""
+    return _BUCKET_BASE ** (index + 0.5)
+
+
+def _scopes(
+    phase: str, mode: str | None, tier: str | None, account: str | None, record: bool = False
+) -> list[str]:
+    """Return the scopes of a sample or lookup, most specific first.
+
+    Samples are also recorded under ``*`` (all modes) but a lookup for a
+    given mode never falls back to other modes.
+    """
+    base = f"{phase}:{mode or '*'}"
+    scopes = []
+    if account:
+        scopes.append(f"{base}:acct:{account}")
+    if tier:
+        scopes.append(f"{base}:tier:{tier}")
+    scopes.append(base)
+    if mode and record:
+        if tier:
+            scopes.append(f"{phase}:*:tier:{tier}")
+        scopes.append(f"{phase}:*")
+    return scopes
+
+
+def record_runtime(
+    redis_conn,
+    phase: str,
+    seconds: float,
+    mode: str | None = None,
+    tier: str | None = None,
+    account: str | None = None,
+    count: int = 1,
+) -> None:
+    """Record ``count`` samples of ``seconds`` for ``phase`` (best effort)."""
+    if seconds is None or seconds < 0 or count <= 0:
+        return
+    hour = int(time.time() // 3600)
+    ttl = (RUNTIME_STATS_WINDOW_HOURS + 1) * 3600
+    bucket = _bucket(seconds)
+    try:
+        pipe = redis_conn.pipeline(transaction=False)
+        for scope in _scopes(phase, mode, tier, account, record=True):
+            key = RUNTIME_HIST_KEY.format(scope, hour)
+            pipe.hincrby(key, bucket, count)
+            pipe.expire(key, ttl)
+        pipe.execute()
+    except Exception as e:
+        print(f"Failed to record runtime for '{phase}': {e}", flush=True)
+
+
+def _percentile(histogram: dict[int, int], pct: float) -> float | None:
+    total = sum(histogram.values())
+    if total < RUNTIME_STATS_MIN_SAMPLES:
+        return None
+    rank = total * pct / 100
+    seen = 0
+    for index in sorted(histogram):
+        seen += histogram[index]
+        if seen >= rank:
+            return _bucket_value(index)
+    return _bucket_value(max(histogram))
+
+
+def _read_percentile(redis_conn, scopes: list[str], pct: float) -> float | None:
+    hour = int(time.time() // 3600)
+    hours = range(hour - RUNTIME_STATS_WINDOW_HOURS + 1, hour + 1)
+    pipe = redis_conn.pipeline(transaction=False)
+    for scope in scopes:
+        for h in hours:
+            pipe.hgetall(RUNTIME_HIST_KEY.format(scope, h))
+    results = iter(pipe.execute())
+
+    for scope in scopes:
+        histogram: dict[int, int] = {}
+        for _ in hours:
+            for index, n in (next(results) or {}).items():
+                index = int(index)
+                histogram[index] = histogram.get(index, 0) + int(n)
+        value = _percentile(histogram, pct)
+        if value is not None:
+            return value
+    return None
+
+
+def get_runtime_percentile(
+    redis_conn,
+    phase: str,
+    default: float,
+    mode: str | None = None,
+    tier: str | None = None,
+    account: str | None = None,
+    pct: float = RUNTIME_ETA_PERCENTILE,
+) -> float:
+    """Return the ``pct`` percentile of recent ``phase`` durations.
+
+    The most specific scope (account, then tier, then the whole mode;
+    ``mode=None`` reads across all modes) with at least ``RUNTIME_STATS_MIN_SAMPLES`` samples wins;
+    ``default`` is returned when none has enough data or Redis fails.
+    """
+    cache_key = (phase, mode, tier, account, pct)
+    now = time.time()
+    with _cache_lock:
+        cached = _cache.get(cache_key)
+        if cached:
+            _cache.move_to_end(cache_key)
+    if cached and cached[0] > now:
+        value = cached[1]
+    else:
+        try:
+            value = _read_percentile(redis_conn, _scopes(phase, mode, tier, account), pct)
+        except Exception as e:
+            print(f"Failed to read runtime stats for '{phase}': {e}", flush=True)
+            value = None
+        with _cache_lock:
+            _cache[cache_key] = (now + RUNTIME_STATS_CACHE_TTL, value)
+            _cache.move_to_end(cache_key)
+            while len(_cache) > RUNTIME_STATS_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return default if value is None else value
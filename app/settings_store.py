@@ -0,0 +1,141 @@
+import json
+import os
+from io import BytesIO
+
+from .tigris_utils import download_file_obj, upload_file_obj
+
+# How long a user's settings stay cached in Redis (seconds)
+SETTINGS_CACHE_TTL = int(os.getenv("SETTINGS_CACHE_TTL", "86400"))
+
+# Fields that must be populated before a job can run
+REQUIRED_SETTINGS = [
+    "USER TOKEN", "CHANNEL ID", "GUILD ID",
+    "MIDJOURNEY APP ID", "MIDJOURNEY COMMAND ID", "COMMAND VERSION",
+]
+
+# Store a new version: bump the persistent counter and cache the payload
+_SAVE_SCRIPT = """
+local v = redis.call('INCR', KEYS[2])
+redis.call('HSET', KEYS[1], 'data', ARGV[1], 'version', v)
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return v
+"""
+
+# Fill the cache after a miss.  ARGV[3] is the version counter read before
+# the download; if a save bumped it since, the downloaded copy may be older
+# than that save and the cache is left alone (returns -1).  A cached copy at
+# least as new is kept unless ARGV[4] says it is unreadable.
+_FILL_SCRIPT = """
+local v = tonumber(redis.call('GET', KEYS[2]) or '0')
+if v ~= tonumber(ARGV[3]) then
+    return -1
+end
+if ARGV[4] ~= '1' and redis.call('HEXISTS', KEYS[1], 'data') == 1 then
+    local cached = tonumber(redis.call('HGET', KEYS[1], 'version') or '0')
+    if cached >= v then
+        return cached
+    end
+end
+redis.call('HSET', KEYS[1], 'data', ARGV[1], 'version', v)
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return v
+"""
+
+
+def get_settings_object_key(email):
+    return f"Users/{email}/settings.json"
+
+
+def get_settings_cache_key(email):
+    return f"user_settings:{email}"
+
+
+def get_settings_version_key(email):
+    return f"user_settings_version:{email}"
+
+
+def missing_required_settings(settings: dict | None) -> list[str]:
+    """Return the required fields that are empty in ``settings``."""
+    settings = settings or {}
+    return [k for k in REQUIRED_SETTINGS if not settings.get(k)]
+
+
+def load_user_settings(redis_conn, email: str, min_version: int = 0) -> tuple[dict | None, int]:
+    """Return ``(settings, version)`` for a user, served from Redis when possible.
+
+    On a cache miss, or when the cached copy is older than ``min_version``,
+    the settings are read from object storage and the cache is refilled.
+    The version counter is read before the download; saves upload before
+    bumping it, so the downloaded copy is at least that version.  The fill
+    only happens while the counter is unchanged, so a save racing the
+    download never has its version cached with the older payload.
+    ``settings`` is ``None`` when nothing is stored for the user.
+    """
+    cache_key = get_settings_cache_key(email)
+    version_key = get_settings_version_key(email)
+    try:
+        data, version = redis_conn.hmget(cache_key, "data", "version")
+    except Exception as e:
+        print(f"⚠️ Settings cache read failed: {e}")
+        data, version = None, None
+
+    version = int(version or 0)
+    unreadable = False
+    if data is not None and version >= min_version:
+        try:
+            return json.loads(data), version
+        except Exception:
+            unreadable = True
+
+    try:
+        expected = int(redis_conn.get(version_key) or 0)
+    except Exception as e:
+        print(f"⚠️ Settings version read failed: {e}")
+        expected = None
+
+    stream = download_file_obj(get_settings_object_key(email))
+    if not stream:
+        return None, version
+    settings = json.load(stream)
+    if expected is None:
+        return settings, version
+
+    try:
+        fill = redis_conn.register_script(_FILL_SCRIPT)
+        filled = int(
+            fill(
+                keys=[cache_key, version_key],
+                args=[json.dumps(settings), SETTINGS_CACHE_TTL, expected, "1" if unreadable else "0"],
+            )
+        )
+    except Exception as e:
+        print(f"⚠️ Settings cache fill failed: {e}")
+        filled = -1
+    return settings, max(filled, expected)
+
+
+def save_user_settings(redis_conn, email: str, settings: dict) -> int | None:
+    """Write settings through to object storage, then update the cache.
+
+    Returns the new version number, or ``None`` if the upload failed.
+    """
+    payload = json.dumps(settings)
+    if not upload_file_obj(BytesIO(payload.encode("utf-8")), get_settings_object_key(email)):
+        return None
+
+    try:
+        save = redis_conn.register_script(_SAVE_SCRIPT)
+        return int(
+            save(
+                keys=[get_settings_cache_key(email), get_settings_version_key(email)],
+                args=[payload, SETTINGS_CACHE_TTL],
+            )
+        )
+    except Exception as e:
+        print(f"⚠️ Settings cache update failed: {e}")
+        # Storage has the new copy; drop the cache so readers refetch it
+        try:
+            redis_conn.delete(get_settings_cache_key(email))
+        except Exception:
+            pass
+        return 0
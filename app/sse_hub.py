@@ -0,0 +1,158 @@
+"""Per-process fan-out of Redis notifications to Server-Sent Events clients.
+
+Each web process holds a single subscription to the update channel no
+matter how many browser tabs are connected.  Clients that watch the same
+key share one payload computation per update, only changed payloads are
+sent, and every stream gets heartbeats so dead connections are noticed.
+Everything uses ``threading``/``queue`` primitives, which gunicorn's gevent
+worker patches into greenlet-friendly versions.
+"""
+
+import os
+import queue
+import time
+from threading import Lock, Thread
+
+from rq.utils import as_text
+
+SSE_HEARTBEAT_INTERVAL = int(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))  # seconds
+# Streams that had nothing to send for this long are closed; EventSource
+# reconnects on its own if the tab is still open
+SSE_IDLE_TIMEOUT = int(os.getenv("SSE_IDLE_TIMEOUT", "1800"))  # seconds
+# Clients that fall this many payloads behind are dropped
+SSE_MAX_PENDING = int(os.getenv("SSE_MAX_PENDING", "10"))
+SSE_RECONNECT_DELAY = 2  # seconds
+
+
+class SSEClient:
+    """One open ``EventSource`` connection and its pending payloads."""
+
+    def __init__(self, key):
+        self.key = key
+        self.messages: queue.Queue = queue.Queue(maxsize=SSE_MAX_PENDING)
+        self.last_payload: str | None = None
+
+    def send(self, payload: str) -> bool:
+        """Queue ``payload`` unless it was the last one sent; ``False`` if the client is full."""
+        if payload == self.last_payload:
+            return True
+        try:
+            self.messages.put_nowait(payload)
+        except queue.Full:
+            return False
+        self.last_payload = payload
+        return True
+
+    def close(self) -> None:
+        # Make room for the sentinel so a blocked stream always wakes up
+        while True:
+            try:
+                self.messages.get_nowait()
+            except queue.Empty:
+                break
+        try:
+            self.messages.put_nowait(None)
+        except queue.Full:
+            pass
+
+
+class SSEHub:
+    """Broadcast updates from a Redis channel to the SSE clients of this process.
+
+    ``build_payload(key)`` returns the ``data`` for every client registered
+    under ``key``.  Channel messages that are plain integers are snapshot
+    versions; versions already handled are skipped, anything else always
+    triggers a rebuild.
+    """
+
+    def __init__(self, redis_conn, channel: str, build_payload):
+        self.redis_conn = redis_conn
+        self.channel = channel
+        self.build_payload = build_payload
+        self._clients: dict[object, set[SSEClient]] = {}
+        self._lock = Lock()
+        self._listener: Thread | None = None
+        self._last_version = 0
+
+    def _ensure_listener(self) -> None:
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = Thread(target=self._listen, daemon=True)
+                self._listener.start()
+
+    def _listen(self) -> None:
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.redis_conn.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self.dispatch(message.get("data"))
+            except Exception as e:
+                print(f"SSE hub subscription failed: {e}", flush=True)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+            time.sleep(SSE_RECONNECT_DELAY)
+
+    def dispatch(self, data) -> None:
+        """Rebuild each watched key once and push changed payloads."""
+        data = as_text(data or b"")
+        if data.isdigit():
+            if int(data) <= self._last_version:
+                return
+            self._last_version = int(data)
+
+        with self._lock:
+            groups = {key: list(clients) for key, clients in self._clients.items()}
+        for key, clients in groups.items():
+            try:
+                payload = self.build_payload(key)
+            except Exception as e:
+                print(f"SSE payload for {key!r} failed: {e}", flush=True)
+                continue
+            for client in clients:
+                if not client.send(payload):
+                    # Too far behind; drop it and let the browser reconnect
+                    self._unregister(client)
+                    client.close()
+
+    def _register(self, client: SSEClient) -> None:
+        with self._lock:
+            self._clients.setdefault(client.key, set()).add(client)
+
+    def _unregister(self, client: SSEClient) -> None:
+        with self._lock:
+            clients = self._clients.get(client.key)
+            if clients is not None:
+                clients.discard(client)
+                if not clients:
+                    del self._clients[client.key]
+
+    def stream(self, key):
+        """Yield SSE frames for ``key``: the current payload, then changes."""
+        self._ensure_listener()
+        client = SSEClient(key)
+        self._register(client)
+        try:
+            client.send(self.build_payload(key))
+            last_sent = time.time()
+            while True:
+                try:
+                    payload = client.messages.get(timeout=SSE_HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    if time.time() - last_sent > SSE_IDLE_TIMEOUT:
+                        return
+                    # Comment frame; fails fast once the browser is gone
+                    yield ": keepalive\n\n"
+                    continue
+                if payload is None:
+                    return
+                last_sent = time.time()
+                yield f"data: {payload}\n\n"
+        finally:
+            self._unregister(client)
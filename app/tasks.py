@@ -9,6 +9,13 @@ from app.MidjourneyAll import main as run_all
 
 # Optional: for debugging or status tracking later
 from rq import get_current_job
+import time
+
+from app.eta_engine import forget_job_work, record_job_work
+from app.job_chunks import cancel_parent, clear_job_id, enqueue_next_chunk, get_parent_id
+from app.quota_ledger import release_quota
+from app.queue_snapshot import publish_queue_event
+from app.runtime_stats import record_runtime
 
 mode_map = {
     "U1": run_u1,
@@ -22,4 +29,40 @@ def run_mode(mode, user_email, prompts_file, key):
     print(f"🚀 Running mode: {mode} for user: {user_email}")
     if mode not in mode_map:
         raise ValueError(f"❌ Invalid mode: {mode}")
-    return mode_map[mode](user_email, prompts_file, key)
+    job = get_current_job()
+    if job:
+        meta = job.meta
+        chunk_prompts = meta.get("chunk_end", meta.get("total_prompts", 0)) - meta.get("chunk_start", 0)
+        record_job_work(
+            job.connection, job.origin, job.id, mode, chunk_prompts, account=user_email,
+        )
+        publish_queue_event(job.connection, "started", job.origin, job.id)
+    start = time.time()
+    try:
+        result = mode_map[mode](user_email, prompts_file, key)
+        if job:
+            record_runtime(
+                job.connection, "job", time.time() - start,
+                mode=mode, tier=job.origin, account=user_email,
+            )
+            if result is False:
+                # The job could not start; later chunks and the other lanes
+                # would fail the same way
+                parent_id = get_parent_id(job)
+                cancel_parent(job.connection, parent_id)
+                release_quota(job.connection, user_email, parent_id, job.meta.get("quota_day"))
+                clear_job_id(job.connection, user_email, parent_id)
+            else:
+                # The lane goes back to the tail of the queue, behind the other users
+                next_job = enqueue_next_chunk(job)
+                if next_job:
+                    record_job_work(
+                        job.connection, job.origin, next_job.id, mode,
+                        next_job.meta["chunk_end"] - next_job.meta["chunk_start"], account=user_email,
+                    )
+                    publish_queue_event(job.connection, "enqueued", job.origin, next_job.id)
+        return result
+    finally:
+        if job:
+            forget_job_work(job.connection, job.origin, job.id)
+            publish_queue_event(job.connection, "finished", job.origin, job.id)
@@ -1,6 +1,10 @@
 import boto3
 import os
-from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import BotoCoreError, ClientError
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
 # Load from env variables (set in Fly.io secrets)
@@ -10,53 +14,96 @@ AWS_ENDPOINT_URL = os.getenv("AWS_ENDPOINT_URL_S3")
 BUCKET_NAME = os.getenv("BUCKET_NAME")
 REGION = os.getenv("AWS_REGION", "auto")
 
-# Create reusable S3 client
+# Size of the pieces streamed to clients when proxying downloads
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Parallel uploads per bulk call; the connection pool is sized to match
+S3_UPLOAD_CONCURRENCY = int(os.getenv("S3_UPLOAD_CONCURRENCY", "8"))
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", str(4 * S3_UPLOAD_CONCURRENCY)))
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", "5"))
+# Failures of a single transfer: service errors, network errors (not
+# ClientErrors) and local file errors; reported as False, never raised
+TRANSFER_ERRORS = (ClientError, BotoCoreError, S3UploadFailedError, OSError)
+# delete_objects accepts at most this many keys per request
+DELETE_BATCH_SIZE = 1000
+
+# Multipart kicks in for large archives/workbooks; parts upload in parallel
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=4,
+    use_threads=True,
+)
+
+# Create reusable S3 client (thread-safe; shared by all threads)
 s3 = boto3.client(
     "s3",
     region_name=REGION,
     endpoint_url=AWS_ENDPOINT_URL,
     aws_access_key_id=AWS_ACCESS_KEY_ID,
     aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+    config=Config(
+        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+        retries={"mode": "adaptive", "max_attempts": S3_MAX_ATTEMPTS},
+        connect_timeout=5,
+        read_timeout=60,
+    ),
 )
 
 def upload_file_obj(obj: BytesIO, key: str) -> bool:
     """Upload in-memory file (BytesIO) to Tigris with given key."""
     try:
-        s3.upload_fileobj(obj, BUCKET_NAME, key)
+        s3.upload_fileobj(obj, BUCKET_NAME, key, Config=TRANSFER_CONFIG)
         return True
-    except ClientError as e:
+    except TRANSFER_ERRORS as e:
         print("❌ Upload error:", e)
         return False
 
 def upload_file_path(file_path: str, key: str) -> bool:
     """Upload file from disk to Tigris."""
     try:
-        s3.upload_file(file_path, BUCKET_NAME, key)
+        s3.upload_file(file_path, BUCKET_NAME, key, Config=TRANSFER_CONFIG)
         return True
-    except ClientError as e:
+    except TRANSFER_ERRORS as e:
         print("❌ Upload error:", e)
         return False
 
+def upload_files(items: list[tuple[str, str]], max_workers: int = S3_UPLOAD_CONCURRENCY) -> dict[str, bool]:
+    """Upload ``(file_path, key)`` pairs concurrently; returns key -> success."""
+    if not items:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(min(max_workers, len(items)), 1)) as pool:
+        results = pool.map(lambda item: upload_file_path(*item), items)
+        return {key: ok for (_, key), ok in zip(items, results)}
+
 def download_file_obj(key: str) -> BytesIO:
     """Download file from Tigris to memory (BytesIO)."""
     obj = BytesIO()
     try:
-        s3.download_fileobj(BUCKET_NAME, key, obj)
+        s3.download_fileobj(BUCKET_NAME, key, obj, Config=TRANSFER_CONFIG)
         obj.seek(0)
         return obj
-    except ClientError as e:
+    except TRANSFER_ERRORS as e:
         print("❌ Download error:", e)
         return None
 
 def download_file_to_path(key: str, file_path: str) -> bool:
     """Download file from Tigris and save to local path."""
     try:
-        s3.download_file(BUCKET_NAME, key, file_path)
+        s3.download_file(BUCKET_NAME, key, file_path, Config=TRANSFER_CONFIG)
         return True
-    except ClientError as e:
+    except TRANSFER_ERRORS as e:
         print("❌ Download error:", e)
         return False
 
+def download_files(items: list[tuple[str, str]], max_workers: int = S3_UPLOAD_CONCURRENCY) -> dict[str, bool]:
+    """Download ``(key, file_path)`` pairs concurrently; returns key -> success."""
+    if not items:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(min(max_workers, len(items)), 1)) as pool:
+        results = pool.map(lambda item: download_file_to_path(*item), items)
+        return {key: ok for (key, _), ok in zip(items, results)}
+
 def delete_file(key: str) -> bool:
     """Delete file from Tigris bucket."""
     try:
@@ -66,12 +113,101 @@ def delete_file(key: str) -> bool:
         print("❌ Delete error:", e)
         return False
 
-def generate_presigned_url(key: str, expiration=3600) -> str:
-    """Generate a temporary public URL for download (default: 1h)."""
+def delete_keys(keys: list[str]) -> bool:
+    """Delete many keys with ``delete_objects`` (1000 per request)."""
+    ok = True
+    for i in range(0, len(keys), DELETE_BATCH_SIZE):
+        batch = keys[i : i + DELETE_BATCH_SIZE]
+        try:
+            resp = s3.delete_objects(
+                Bucket=BUCKET_NAME,
+                Delete={"Objects": [{"Key": k} for k in batch], "Quiet": True},
+            )
+        except ClientError as e:
+            print("❌ Delete error:", e)
+            ok = False
+            continue
+        for err in resp.get("Errors", []):
+            print(f"❌ Delete error for {err.get('Key')}: {err.get('Message')}")
+            ok = False
+    return ok
+
+def delete_prefix(prefix: str, exclude: tuple[str, ...] = (), modified_before: float | None = None) -> bool:
+    """Delete every key under ``prefix`` except those in ``exclude``.
+
+    With ``modified_before`` (a UNIX timestamp) newer objects are kept.
+    """
+    keys = [
+        obj["Key"]
+        for obj in list_objects(prefix)
+        if obj["Key"] not in exclude
+        and (modified_before is None or obj["LastModified"].timestamp() < modified_before)
+    ]
+    return delete_keys(keys)
+
+def list_objects(prefix: str) -> list[dict]:
+    """Return the listing entries (``Key``, ``LastModified``, ...) under ``prefix``.
+
+    Follows pagination.
+    """
+    objects = []
+    try:
+        paginator = s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=prefix):
+            objects.extend(page.get("Contents", []))
+    except ClientError as e:
+        print("❌ List error:", e)
+    return objects
+
+def list_keys(prefix: str) -> list[str]:
+    """Return every key under ``prefix`` (follows pagination)."""
+    return [obj["Key"] for obj in list_objects(prefix)]
+
+def object_exists(key: str) -> bool:
+    """Return ``True`` if ``key`` exists in the bucket."""
+    try:
+        s3.head_object(Bucket=BUCKET_NAME, Key=key)
+        return True
+    except ClientError:
+        return False
+
+def get_object_stream(key: str, byte_range: str | None = None, if_none_match: str | None = None) -> dict | None:
+    """Open a streaming GET for ``key`` without reading the body.
+
+    Returns the ``get_object`` response (``Body`` is a streaming body),
+    ``{"NotModified": True}`` when ``if_none_match`` matches the ETag,
+    ``{"InvalidRange": True}`` for unsatisfiable ranges and ``None`` when
+    the object is missing.
+    """
+    params = {"Bucket": BUCKET_NAME, "Key": key}
+    if byte_range:
+        params["Range"] = byte_range
+    if if_none_match:
+        params["IfNoneMatch"] = if_none_match
+    try:
+        return s3.get_object(**params)
+    except ClientError as e:
+        code = str(e.response.get("Error", {}).get("Code"))
+        if code in ("304", "NotModified"):
+            return {"NotModified": True}
+        if code in ("416", "InvalidRange"):
+            return {"InvalidRange": True}
+        print("❌ Download error:", e)
+        return None
+
+def generate_presigned_url(key: str, expiration=3600, download_name: str | None = None) -> str:
+    """Generate a temporary public URL for download (default: 1h).
+
+    With ``download_name`` the response is served as an attachment with
+    that file name.
+    """
+    params = {"Bucket": BUCKET_NAME, "Key": key}
+    if download_name:
+        params["ResponseContentDisposition"] = f'attachment; filename="{download_name}"'
     try:
         return s3.generate_presigned_url(
             "get_object",
-            Params={"Bucket": BUCKET_NAME, "Key": key},
+            Params=params,
             ExpiresIn=expiration,
         )
     except ClientError as e:
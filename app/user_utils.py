@@ -37,12 +37,6 @@ def init_user_if_missing(email):
     os.makedirs(get_user_images_dir(email), exist_ok=True)
     os.makedirs(get_user_logs_dir(email), exist_ok=True)
     
-    # Create empty settings file if not exists
-    settings_path = get_user_settings_path(email)
-    if not os.path.exists(settings_path):
-        with open(settings_path, "w") as f:
-            json.dump({}, f)
-
     # Create empty failed prompts log if not exists
     failed_path = get_user_failed_prompts_path(email)
     if not os.path.exists(failed_path):
@@ -0,0 +1,60 @@
+"""RQ worker that serves several tier queues with weighted priority.
+
+A shared pool of machines runs this worker on every tier queue::
+
+    rq worker -w app.weighted_worker.WeightedQueueWorker Tier3 Tier2 Tier1 default
+
+After each job the queues are reshuffled so that a queue comes first with
+a probability that grows with its weight.  Higher tiers are served first
+most of the time, but every queue regularly gets the first pick, so lower
+tiers never starve while a higher one is busy.
+"""
+
+import os
+import random
+
+from rq import Worker
+
+# "queue:weight" pairs; queues that are not listed weigh 1
+DEFAULT_QUEUE_WEIGHTS = "Tier3:6,Tier2:3,Tier1:2,default:1"
+
+
+def parse_queue_weights(raw: str | None) -> dict[str, float]:
+    weights: dict[str, float] = {}
+    for item in (raw or "").split(","):
+        name, _, weight = item.strip().partition(":")
+        if not name:
+            continue
+        try:
+            weights[name] = max(float(weight), 0.0)
+        except ValueError:
+            continue
+    return weights
+
+
+QUEUE_WEIGHTS = parse_queue_weights(os.getenv("QUEUE_WEIGHTS", DEFAULT_QUEUE_WEIGHTS))
+
+
+def weighted_order(names: list[str], weights: dict[str, float], rng=random) -> list[str]:
+    """Return ``names`` in a random order biased by ``weights``.
+
+    Each name draws ``u ** (1 / weight)`` and the largest draws go first
+    (weighted sampling without replacement), so a queue leads with
+    probability proportional to its weight.  Zero-weight queues come last.
+    """
+    def draw(name: str) -> float:
+        weight = weights.get(name, 1.0)
+        return rng.random() ** (1.0 / weight) if weight > 0 else -1.0
+
+    return sorted(names, key=draw, reverse=True)
+
+
+class WeightedQueueWorker(Worker):
+    """Worker whose queue order is reshuffled by ``QUEUE_WEIGHTS`` after every job."""
+
+    queue_weights = QUEUE_WEIGHTS
+
+    def reorder_queues(self, reference_queue):
+        by_name = {queue.name: queue for queue in self._ordered_queues}
+        order = weighted_order(list(by_name), self.queue_weights)
+        self._ordered_queues = [by_name[name] for name in order]
@@ -2,25 +2,58 @@
 """Monitor Redis queues and manage existing Fly.io machines via HTTP API.
 
 This script watches RQ queues and ensures a pool of pre-created Fly.io
-Machines are started when work arrives.
+Machines are started when work arrives.  Each tier runs enough machines to
+drain its outstanding work (remaining prompts x learned per-prompt runtime,
+as recorded by the web app and workers in ``queue_work:<queue>``) within
+the tier's target wait.  Machines whose RQ workers have been idle for
+longer than a grace period are suspended (or stopped) again once the tier
+has more machines running than it needs; a machine with a busy worker is
+never touched.
+
+The web app publishes an ``enqueued`` event on the ``queue_events`` channel
+for every submitted job; the tier is reconciled as soon as it arrives, so
+a machine starts booting right after the user clicks run.  Polling every
+``POLL_INTERVAL_SEC`` remains as the fallback reconciliation loop.
+
+Besides per-tier machines, a shared pool can serve several tier queues
+with ``app.weighted_worker.WeightedQueueWorker``; it is scaled on the
+combined work of its queues.  A queue should be served either by its tier
+machines or by the pool, not both.
 
 Env:
     FLY_API_TOKEN          Fly API token for Machines API (required).
     REDIS_URL              Redis connection URL.
-    POLL_INTERVAL_SEC      Seconds between queue checks (default: 30).
-    MAX_RUNNING_PER_TIER   Maximum running machines per tier (default: 1).
+    POLL_INTERVAL_SEC      Seconds between full reconciliations (default: 30).
+    MAX_RUNNING_PER_TIER   Default maximum running machines per tier (default: 1).
+    TARGET_WAIT_SEC        Default time to drain a tier's queue (default: 900).
+    TYPICAL_JOB_RUNTIME_SEC  Seconds assumed for jobs without work info (default: 300).
+    STATE_CACHE_TTL_SEC    Seconds machine states are reused (default: 5).
+    FLY_FETCH_CONCURRENCY  Parallel Machines API requests (default: 8).
+    IDLE_GRACE_SEC         Idle time before a machine may be stopped (default: 300).
+    SCALE_DOWN_ACTION      "suspend" or "stop" (default: suspend).
 
 Tier envs (repeat for tiers 1-3):
     TIER{N}_APP            Fly app name (default: midjau-worker-tier{N}).
     TIER{N}_MACHINE_IDS    Comma-separated machine IDs for the tier.
     TIER{N}_QUEUE_NAME     RQ queue name (default: Tier{N}).
+    TIER{N}_MAX_RUNNING    Maximum running machines (default: MAX_RUNNING_PER_TIER).
+    TIER{N}_TARGET_WAIT_SEC  Target wait (default: TARGET_WAIT_SEC).
+
+Shared pool envs:
+    POOL_APP               Fly app name (default: midjau-worker-pool).
+    POOL_MACHINE_IDS       Comma-separated machine IDs; the pool is off without them.
+    POOL_QUEUES            Queues served by the pool (default: Tier3,Tier2,Tier1,default).
+    POOL_MAX_RUNNING       Maximum running machines (default: MAX_RUNNING_PER_TIER).
+    POOL_TARGET_WAIT_SEC   Target wait (default: TARGET_WAIT_SEC).
 """
 
 from __future__ import annotations
 
 import json
+import math
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Tuple
 
 import requests
@@ -28,6 +61,8 @@ from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from redis import Redis
 from rq import Queue
+from rq.utils import as_text
+from rq.worker_registration import WORKERS_BY_QUEUE_KEY
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 if not REDIS_URL:
@@ -35,8 +70,30 @@ if not REDIS_URL:
 
 POLL_INTERVAL = int(os.getenv("POLL_INTERVAL_SEC", "30"))
 MAX_RUNNING = int(os.getenv("MAX_RUNNING_PER_TIER", "1"))
+TARGET_WAIT = float(os.getenv("TARGET_WAIT_SEC", "900"))
+TYPICAL_JOB_RUNTIME = float(os.getenv("TYPICAL_JOB_RUNTIME_SEC", "300"))
+
+# Written by the web app and workers (app/eta_engine.py): job id ->
+# {"per_prompt", "remaining", "updated_at"}
+QUEUE_WORK_KEY = "queue_work:{}"
+DEFAULT_PROMPT_RUNTIME = 60
+
+# Published by the web app and workers (app/queue_snapshot.py) as JSON
+# {"event", "queue", "job_id"}
+QUEUE_EVENTS_CHANNEL = "queue_events"
+WAKE_EVENTS = {"enqueued"}
+
+# A machine must look idle on every tick for this long before it is stopped
+IDLE_GRACE = float(os.getenv("IDLE_GRACE_SEC", "300"))
+SCALE_DOWN_ACTION = os.getenv("SCALE_DOWN_ACTION", "suspend")
+if SCALE_DOWN_ACTION not in ("suspend", "stop"):
+    raise RuntimeError("SCALE_DOWN_ACTION must be 'suspend' or 'stop'.")
 
 API = os.getenv("FLY_API_HOSTNAME", "https://api.machines.dev")
+API_TIMEOUT = 10  # seconds per Machines API request
+
+STATE_CACHE_TTL = float(os.getenv("STATE_CACHE_TTL_SEC", "5"))
+FETCH_CONCURRENCY = int(os.getenv("FLY_FETCH_CONCURRENCY", "8"))
 
 FLY_API_TOKEN = os.getenv("FLY_API_TOKEN")
 if not FLY_API_TOKEN:
@@ -46,15 +103,28 @@ if not FLY_API_TOKEN:
 session = requests.Session()
 session.headers.update({"Authorization": f"Bearer {FLY_API_TOKEN}"})
 retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
-session.mount("https://", HTTPAdapter(max_retries=retries))
-session.mount("http://", HTTPAdapter(max_retries=retries))
+session.mount("https://", HTTPAdapter(max_retries=retries, pool_maxsize=FETCH_CONCURRENCY))
+session.mount("http://", HTTPAdapter(max_retries=retries, pool_maxsize=FETCH_CONCURRENCY))
+
+fetch_pool = ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY)
+
+# app -> (fetched_at, {machine_id: state}); start/stop responses update it
+_state_cache: Dict[str, Tuple[float, Dict[str, str]]] = {}
+
+# machine id -> first tick it was seen running without a busy worker
+_idle_since: Dict[str, float] = {}
+
+
+def split_env(name: str, default: str = "") -> list[str]:
+    return [item.strip() for item in os.getenv(name, default).split(",") if item.strip()]
 
 
 def load_tiers() -> list[dict]:
+    """Return the machine groups to manage: one per tier, the shared pool and finalize workers."""
     tiers = []
     for i in range(1, 4):
         app = os.getenv(f"TIER{i}_APP", f"midjau-worker-tier{i}")
-        machine_ids = [m.strip() for m in os.getenv(f"TIER{i}_MACHINE_IDS", "").split(",") if m.strip()]
+        machine_ids = split_env(f"TIER{i}_MACHINE_IDS")
         queue_name = os.getenv(f"TIER{i}_QUEUE_NAME", f"Tier{i}")
         if not machine_ids:
             continue
@@ -62,7 +132,33 @@ def load_tiers() -> list[dict]:
             "name": f"Tier{i}",
             "app": app,
             "machines": machine_ids,
-            "queue": queue_name,
+            "queues": [queue_name],
+            "max_running": int(os.getenv(f"TIER{i}_MAX_RUNNING", str(MAX_RUNNING))),
+            "target_wait": float(os.getenv(f"TIER{i}_TARGET_WAIT_SEC", str(TARGET_WAIT))),
+            "next_index": 0,
+        })
+
+    pool_machines = split_env("POOL_MACHINE_IDS")
+    if pool_machines:
+        tiers.append({
+            "name": "Pool",
+            "app": os.getenv("POOL_APP", "midjau-worker-pool"),
+            "machines": pool_machines,
+            "queues": split_env("POOL_QUEUES", "Tier3,Tier2,Tier1,default"),
+            "max_running": int(os.getenv("POOL_MAX_RUNNING", str(MAX_RUNNING))),
+            "target_wait": float(os.getenv("POOL_TARGET_WAIT_SEC", str(TARGET_WAIT))),
+            "next_index": 0,
+        })
+
+    finalize_machines = split_env("FINALIZE_MACHINE_IDS")
+    if finalize_machines:
+        tiers.append({
+            "name": "Finalize",
+            "app": os.getenv("FINALIZE_APP", "midjau-worker-finalize"),
+            "machines": finalize_machines,
+            "queues": [os.getenv("FINALIZE_QUEUE_NAME", "finalize")],
+            "max_running": int(os.getenv("FINALIZE_MAX_RUNNING", str(MAX_RUNNING))),
+            "target_wait": TARGET_WAIT,
             "next_index": 0,
         })
     return tiers
@@ -71,36 +167,256 @@ def load_tiers() -> list[dict]:
 TIERS = load_tiers()
 
 
-def list_state(app: str, machine_ids: list[str]) -> Dict[str, str]:
-    """Return mapping of machine_id -> state for the provided IDs using the Machines API."""
-    states: Dict[str, str] = {}
-    for mid in machine_ids:
-        try:
-            r = session.get(f"{API}/v1/apps/{app}/machines/{mid}", timeout=20)
-            if r.status_code == 404:
-                states[mid] = "missing"
-                continue
-            r.raise_for_status()
-            data = r.json()
-            states[mid] = (data.get("state") or "").lower()  # started/stopped/stopping/starting/suspended
-        except Exception as exc:
-            print(f"⚠️ failed to fetch state for {app}/{mid}: {exc}")
-            states[mid] = "unknown"
-    return states
+def fetch_machine_state(app: str, machine_id: str) -> str:
+    """Return the state of a single machine (fallback when listing fails)."""
+    try:
+        r = session.get(f"{API}/v1/apps/{app}/machines/{machine_id}", timeout=API_TIMEOUT)
+        if r.status_code == 404:
+            return "missing"
+        r.raise_for_status()
+        return (r.json().get("state") or "").lower()  # started/stopped/stopping/starting/suspended
+    except Exception as exc:
+        print(f"⚠️ failed to fetch state for {app}/{machine_id}: {exc}")
+        return "unknown"
+
+
+def fetch_app_states(app: str, machine_ids: list[str]) -> Dict[str, str]:
+    """Fetch the states of ``machine_ids`` with one list call for the app.
+
+    Falls back to concurrent per-machine requests if listing fails.
+    """
+    try:
+        r = session.get(f"{API}/v1/apps/{app}/machines", timeout=API_TIMEOUT)
+        r.raise_for_status()
+        listed = {m.get("id"): (m.get("state") or "").lower() for m in r.json() or []}
+        return {mid: listed.get(mid, "missing") for mid in machine_ids}
+    except Exception as exc:
+        print(f"⚠️ failed to list machines for {app}: {exc}")
+    states = fetch_pool.map(lambda mid: fetch_machine_state(app, mid), machine_ids)
+    return dict(zip(machine_ids, states))
+
+
+def set_cached_state(app: str, machine_id: str, state: str) -> None:
+    cached = _state_cache.get(app)
+    if cached:
+        cached[1][machine_id] = state
+
+
+def list_states(tiers: list[dict]) -> Dict[str, Dict[str, str]]:
+    """Return app -> {machine_id: state} for every tier, in parallel.
+
+    States younger than ``STATE_CACHE_TTL`` are reused.
+    """
+    now = time.time()
+    wanted: Dict[str, list[str]] = {}
+    for tier in tiers:
+        wanted.setdefault(tier["app"], [])
+        wanted[tier["app"]].extend(m for m in tier["machines"] if m not in wanted[tier["app"]])
+
+    stale = [
+        app for app, mids in wanted.items()
+        if app not in _state_cache
+        or now - _state_cache[app][0] > STATE_CACHE_TTL
+        or any(mid not in _state_cache[app][1] for mid in mids)
+    ]
+    # One pool thread per app; per-machine fallbacks use the shared pool too
+    with ThreadPoolExecutor(max_workers=max(len(stale), 1)) as app_pool:
+        for app, states in zip(stale, app_pool.map(lambda a: fetch_app_states(a, wanted[a]), stale)):
+            _state_cache[app] = (time.time(), states)
+    return {app: dict(_state_cache[app][1]) for app in wanted}
 
 
 def start_machine(app: str, machine_id: str, state: str | None) -> None:
     """Start a machine via Machines API. /start is idempotent for stopped/suspended."""
     try:
-        r = session.post(f"{API}/v1/apps/{app}/machines/{machine_id}/start", timeout=30)
+        r = session.post(f"{API}/v1/apps/{app}/machines/{machine_id}/start", timeout=API_TIMEOUT)
         if r.status_code in (200, 202, 204, 409, 423):
             print(f"Starting machine {machine_id} in {app} -> {r.status_code}")
+            set_cached_state(app, machine_id, "starting")
             return
         r.raise_for_status()
     except Exception as exc:
         print(f"❌ start failed for {app}/{machine_id}: {exc}")
 
 
+def parse_work(raw: dict | None) -> Dict[str, dict]:
+    work: Dict[str, dict] = {}
+    for job_id, value in (raw or {}).items():
+        try:
+            entry = json.loads(value)
+        except Exception:
+            continue
+        if isinstance(entry, dict):
+            work[as_text(job_id)] = entry
+    return work
+
+
+def outstanding_work(
+    work: Dict[str, dict],
+    running_ids: set[str],
+    queued_count: int,
+    now: float | None = None,
+    typical: float = TYPICAL_JOB_RUNTIME,
+) -> Tuple[float, int]:
+    """Return ``(seconds, jobs)`` of work still to do in a queue.
+
+    Tracked jobs count ``remaining x per_prompt`` (minus the time a running
+    job has spent since its last progress update); queued jobs without an
+    entry count ``typical`` seconds each.
+    """
+    now = time.time() if now is None else now
+    seconds = 0.0
+    tracked_queued = 0
+    for job_id, entry in work.items():
+        try:
+            left = float(entry.get("remaining", 0)) * float(entry.get("per_prompt", DEFAULT_PROMPT_RUNTIME))
+            if job_id in running_ids:
+                left -= max(now - float(entry.get("updated_at", now)), 0)
+            else:
+                tracked_queued += 1
+        except (TypeError, ValueError):
+            continue
+        seconds += max(left, 0)
+    untracked = max(queued_count - tracked_queued, 0)
+    seconds += untracked * typical
+    # Running jobs the work hash does not know about still hold a machine
+    jobs = queued_count + len(running_ids)
+    return seconds, jobs
+
+
+def desired_capacity(seconds: float, jobs: int, target_wait: float, max_running: int, machines: int) -> int:
+    """Machines needed to finish ``seconds`` of work within ``target_wait``.
+
+    A machine runs one job at a time, so never more than ``jobs``.
+    """
+    if jobs <= 0:
+        return 0
+    needed = max(math.ceil(seconds / max(target_wait, 1)), 1)
+    return min(needed, jobs, max_running, machines)
+
+
+def read_queue_work(redis_conn, tiers: list[dict]) -> Dict[str, Tuple[float, int]]:
+    """Return queue name -> ``outstanding_work`` for every tier in one round trip."""
+    names = list(dict.fromkeys(name for tier in tiers for name in tier["queues"]))
+    queues = [Queue(name=name, connection=redis_conn) for name in names]
+    pipe = redis_conn.pipeline(transaction=False)
+    for queue in queues:
+        pipe.llen(queue.key)
+        pipe.zrange(queue.started_job_registry.key, 0, -1)
+        pipe.hgetall(QUEUE_WORK_KEY.format(queue.name))
+    results = pipe.execute()
+
+    now = time.time()
+    work: Dict[str, Tuple[float, int]] = {}
+    for i, queue in enumerate(queues):
+        count, running_entries, raw = results[i * 3 : i * 3 + 3]
+        registry = queue.started_job_registry
+        running_ids = {registry.parse_job_id(as_text(entry)) for entry in running_entries or ()}
+        work[queue.name] = outstanding_work(parse_work(raw), running_ids, int(count or 0), now)
+    return work
+
+
+def stop_machine(app: str, machine_id: str) -> bool:
+    """Suspend or stop a machine (``SCALE_DOWN_ACTION``).
+
+    Suspending is the default: should a worker pick up a job in the instant
+    before the call, it resumes with the machine instead of being killed.
+    """
+    try:
+        r = session.post(f"{API}/v1/apps/{app}/machines/{machine_id}/{SCALE_DOWN_ACTION}", timeout=API_TIMEOUT)
+        if r.status_code in (200, 202, 204, 409, 423):
+            print(f"Scaling down machine {machine_id} in {app} ({SCALE_DOWN_ACTION}) -> {r.status_code}")
+            set_cached_state(app, machine_id, "stopping" if SCALE_DOWN_ACTION == "stop" else "suspending")
+            return True
+        r.raise_for_status()
+    except Exception as exc:
+        print(f"❌ {SCALE_DOWN_ACTION} failed for {app}/{machine_id}: {exc}")
+    return False
+
+
+def read_workers(redis_conn, queue_names: list[str]) -> Dict[str, list[dict]]:
+    """Return queue name -> live RQ workers (hostname and busy flag).
+
+    On Fly a machine's hostname is its machine id, which ties workers to
+    machines.  Worker heartbeats keep the worker hash alive, so
+    registrations whose hash expired (dead or frozen workers) are dropped.
+    """
+    pipe = redis_conn.pipeline(transaction=False)
+    for name in queue_names:
+        pipe.smembers(WORKERS_BY_QUEUE_KEY % name)
+    registered = [sorted(as_text(key) for key in keys or ()) for keys in pipe.execute()]
+
+    pipe = redis_conn.pipeline(transaction=False)
+    for keys in registered:
+        for key in keys:
+            pipe.hmget(key, "hostname", "state", "current_job")
+    results = iter(pipe.execute() if any(registered) else [])
+
+    workers: Dict[str, list[dict]] = {}
+    for name, keys in zip(queue_names, registered):
+        workers[name] = []
+        for key in keys:
+            hostname, state, current_job = next(results)
+            if hostname is None and state is None:
+                continue
+            workers[name].append({
+                "hostname": as_text(hostname) if hostname else None,
+                "busy": as_text(state or b"") == "busy" or bool(current_job),
+            })
+    return workers
+
+
+def busy_machines(
+    machine_ids: list[str], workers: list[dict], managed: set[str] | None = None
+) -> set[str] | None:
+    """Return the machines with a busy worker.
+
+    Busy workers on other ``managed`` machines (e.g. the shared pool
+    listening on a tier queue) are ignored.  ``None`` means a busy worker
+    could not be tied to any machine, in which case nothing in the tier can
+    safely be stopped.
+    """
+    busy: set[str] = set()
+    for worker in workers:
+        if not worker["busy"]:
+            continue
+        if worker["hostname"] in machine_ids:
+            busy.add(worker["hostname"])
+        elif worker["hostname"] not in (managed or ()):
+            return None
+    return busy
+
+
+def machines_to_stop(
+    running_ids: list[str],
+    busy: set[str] | None,
+    desired: int,
+    now: float | None = None,
+    grace: float = IDLE_GRACE,
+) -> list[str]:
+    """Update the idle tracking and return machines to scale down.
+
+    A machine qualifies once it has been idle on every tick for ``grace``
+    seconds, and only as many go as the tier runs above ``desired``; the
+    longest idle go first.
+    """
+    now = time.time() if now is None else now
+    for machine_id in running_ids:
+        if busy is None or machine_id in busy:
+            _idle_since.pop(machine_id, None)
+        else:
+            _idle_since.setdefault(machine_id, now)
+    if busy is None:
+        return []
+
+    surplus = len(running_ids) - max(desired, 0)
+    idle = sorted(
+        (mid for mid in running_ids if mid in _idle_since and now - _idle_since[mid] >= grace),
+        key=lambda mid: _idle_since[mid],
+    )
+    return idle[:max(surplus, 0)]
+
+
 def select_next_machine(tier: dict, states: Dict[str, str]) -> Tuple[str | None, str | None]:
     """Round-robin selection of the next machine to start."""
     machines = tier["machines"]
@@ -111,34 +427,110 @@ def select_next_machine(tier: dict, states: Dict[str, str]) -> Tuple[str | None,
         tier["next_index"] += 1
         machine_id = machines[idx]
         state = states.get(machine_id)
-        if state != "started":
+        if state not in ("started", "starting"):
             return machine_id, state
     return None, None
 
 
-def monitor() -> None:
-    redis_conn = Redis.from_url(REDIS_URL)
+def reconcile(redis_conn, tiers: list[dict]) -> None:
+    """Start or stop machines so each of ``tiers`` matches its workload."""
+    all_states = list_states(tiers)
+    managed = {mid for tier in TIERS for mid in tier["machines"]}
+    try:
+        all_work = read_queue_work(redis_conn, tiers)
+        all_workers = read_workers(redis_conn, list(all_work))
+    except Exception as exc:
+        print(f"⚠️ failed to read queue work: {exc}")
+        return
+    for tier in tiers:
+        seconds = sum(all_work[name][0] for name in tier["queues"])
+        jobs = sum(all_work[name][1] for name in tier["queues"])
+        app = tier["app"]
+
+        states = all_states[app]
+        running_ids = [mid for mid in tier["machines"] if states.get(mid) == "started"]
+        # Machines already booting count towards capacity
+        running_count = len(running_ids) + sum(states.get(mid) == "starting" for mid in tier["machines"])
+
+        desired = desired_capacity(
+            seconds, jobs, tier["target_wait"], tier["max_running"], len(tier["machines"])
+        )
+        to_start = desired - running_count
+        print(
+            f"[{tier['name']}] jobs={jobs} work={seconds:.0f}s running={running_count} "
+            f"desired={desired} to_start={to_start}"
+        )
+
+        for _ in range(max(0, to_start)):
+            machine_id, state = select_next_machine(tier, states)
+            if machine_id:
+                start_machine(app, machine_id, state)
+
+        workers = [worker for name in tier["queues"] for worker in all_workers[name]]
+        busy = busy_machines(tier["machines"], workers, managed)
+        for machine_id in machines_to_stop(running_ids, busy, desired):
+            if stop_machine(app, machine_id):
+                _idle_since.pop(machine_id, None)
+
+
+def wait_for_wake_events(pubsub, timeout: float) -> set[str]:
+    """Block until a wake event arrives or ``timeout`` elapses.
 
+    Returns the queues with new work; events already waiting are drained so
+    a burst of submissions triggers a single reconciliation.
+    """
+    deadline = time.time() + timeout
+    queues: set[str] = set()
     while True:
-        for tier in TIERS:
-            queue = Queue(name=tier["queue"], connection=redis_conn)
-            q_len = queue.count
-            app = tier["app"]
+        remaining = 0 if queues else deadline - time.time()
+        if remaining < 0:
+            return queues
+        message = pubsub.get_message(timeout=remaining)
+        if message is None:
+            if queues or time.time() >= deadline:
+                return queues
+            continue
+        if message.get("type") != "message":
+            continue
+        try:
+            event = json.loads(message["data"])
+        except Exception:
+            continue
+        if isinstance(event, dict) and event.get("event") in WAKE_EVENTS and event.get("queue"):
+            queues.add(event["queue"])
 
-            states = list_state(app, tier["machines"])
-            running_ids = [mid for mid in tier["machines"] if states.get(mid) == "started"]
-            running_count = len(running_ids)
 
-            desired = min(len(tier["machines"]), MAX_RUNNING, q_len)
-            to_start = desired - running_count
-            print(f"[{tier['name']}] q_len={q_len} running={running_count} desired={desired} to_start={to_start}")
+def monitor() -> None:
+    redis_conn = Redis.from_url(REDIS_URL)
+    pubsub = None
+    next_poll = 0.0
 
-            for _ in range(max(0, to_start)):
-                machine_id, state = select_next_machine(tier, states)
-                if machine_id:
-                    start_machine(app, machine_id, state)
+    while True:
+        if time.time() >= next_poll:
+            reconcile(redis_conn, TIERS)
+            next_poll = time.time() + POLL_INTERVAL
+
+        wait = max(next_poll - time.time(), 0)
+        try:
+            if pubsub is None:
+                pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(QUEUE_EVENTS_CHANNEL)
+            queues = wait_for_wake_events(pubsub, wait)
+        except Exception as exc:
+            # Fall back to polling until the subscription can be restored
+            print(f"⚠️ queue event subscription failed: {exc}")
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+                pubsub = None
+            time.sleep(min(wait, 5))
+            continue
 
-        time.sleep(POLL_INTERVAL)
+        woken = [tier for tier in TIERS if queues.intersection(tier["queues"])]
+        if woken:
+            reconcile(redis_conn, woken)
 
 
 if __name__ == "__main__":  # pragma: no cover - manual run
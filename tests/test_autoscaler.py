@@ -0,0 +1,135 @@
+import importlib.util
+import json
+from pathlib import Path
+
+import pytest
+
+SCRIPT = Path(__file__).resolve().parents[1] / "scripts" / "queue_monitor_existing.py"
+
+
+@pytest.fixture
+def autoscaler(monkeypatch):
+    monkeypatch.setenv("FLY_API_TOKEN", "test-token")
+    spec = importlib.util.spec_from_file_location("queue_monitor_existing", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_outstanding_work_weighs_job_sizes(autoscaler):
+    work = autoscaler.parse_work({
+        b"big": json.dumps({"per_prompt": 40, "remaining": 500, "updated_at": 0}),
+        b"small": json.dumps({"per_prompt": 40, "remaining": 5, "updated_at": 0}),
+        b"running": json.dumps({"per_prompt": 40, "remaining": 10, "updated_at": 900}),
+        b"broken": b"{",
+    })
+
+    seconds, jobs = autoscaler.outstanding_work(work, {"running"}, queued_count=3, now=1000, typical=300)
+
+    # 500*40 + 5*40 + (400 - 100 elapsed) + one untracked queued job
+    assert seconds == 20000 + 200 + 300 + 300
+    assert jobs == 4
+
+
+def test_desired_capacity_follows_target_wait(autoscaler):
+    assert autoscaler.desired_capacity(0, 0, 900, 5, 5) == 0
+    assert autoscaler.desired_capacity(100, 1, 900, 5, 5) == 1
+    assert autoscaler.desired_capacity(3000, 6, 900, 5, 5) == 4
+    assert autoscaler.desired_capacity(3000, 2, 900, 5, 5) == 2
+    assert autoscaler.desired_capacity(30000, 9, 900, 3, 5) == 3
+    assert autoscaler.desired_capacity(30000, 9, 900, 5, 2) == 2
+
+
+class DummyPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        def _queue(*args):
+            self.calls.append((name, args))
+        return _queue
+
+    def execute(self):
+        return [getattr(self.redis, name)(*args) for name, args in self.calls]
+
+
+class DummyRedis:
+    def __init__(self, sets, hashes):
+        self.sets = sets
+        self.hashes = hashes
+
+    def pipeline(self, transaction=True):
+        return DummyPipeline(self)
+
+    def smembers(self, key):
+        return self.sets.get(key, set())
+
+    def hmget(self, key, *fields):
+        return [self.hashes.get(key, {}).get(f) for f in fields]
+
+
+def test_read_workers_maps_busy_state(autoscaler):
+    redis = DummyRedis(
+        {"rq:workers:Tier1": {b"rq:worker:a", b"rq:worker:b", b"rq:worker:gone"}},
+        {
+            "rq:worker:a": {"hostname": b"m1", "state": b"busy", "current_job": b"j1"},
+            "rq:worker:b": {"hostname": b"m2", "state": b"idle"},
+        },
+    )
+
+    workers = autoscaler.read_workers(redis, ["Tier1", "Tier2"])
+
+    assert workers["Tier2"] == []
+    assert sorted(workers["Tier1"], key=lambda w: w["hostname"]) == [
+        {"hostname": "m1", "busy": True},
+        {"hostname": "m2", "busy": False},
+    ]
+    assert autoscaler.busy_machines(["m1", "m2"], workers["Tier1"]) == {"m1"}
+    assert autoscaler.busy_machines(["m2"], workers["Tier1"]) is None
+
+
+def test_machines_to_stop_waits_for_grace_and_spares_busy(autoscaler):
+    running = ["m1", "m2", "m3"]
+
+    assert autoscaler.machines_to_stop(running, {"m1"}, desired=0, now=0, grace=300) == []
+    # m3 was busy for a moment, which resets its idle timer
+    assert autoscaler.machines_to_stop(running, {"m1", "m3"}, desired=0, now=200, grace=300) == []
+    assert autoscaler.machines_to_stop(running, {"m1"}, desired=0, now=350, grace=300) == ["m2"]
+    assert autoscaler.machines_to_stop(running, {"m1"}, desired=2, now=600, grace=300) == ["m2"]
+    assert autoscaler.machines_to_stop(running, {"m1"}, desired=3, now=600, grace=300) == []
+    # An unattributed busy worker blocks every stop
+    assert autoscaler.machines_to_stop(running, None, desired=0, now=900, grace=300) == []
+
+
+class DummyPubSub:
+    def __init__(self, messages):
+        self.messages = list(messages)
+
+    def get_message(self, timeout=0):
+        return self.messages.pop(0) if self.messages else None
+
+
+def test_wait_for_wake_events_drains_burst(autoscaler):
+    def event(name, queue):
+        return {"type": "message", "data": json.dumps({"event": name, "queue": queue, "job_id": "j"})}
+
+    pubsub = DummyPubSub([
+        event("progress", "Tier2"),
+        event("enqueued", "Tier1"),
+        {"type": "message", "data": b"not json"},
+        event("enqueued", "Tier3"),
+    ])
+
+    assert autoscaler.wait_for_wake_events(pubsub, 0.01) == {"Tier1", "Tier3"}
+    assert autoscaler.wait_for_wake_events(pubsub, 0.01) == set()
+
+
+def test_busy_machines_ignores_other_managed_machines(autoscaler):
+    workers = [
+        {"hostname": "pool1", "busy": True},
+        {"hostname": "m1", "busy": True},
+    ]
+
+    assert autoscaler.busy_machines(["m1", "m2"], workers, managed={"m1", "m2", "pool1"}) == {"m1"}
+    assert autoscaler.busy_machines(["m1", "m2"], workers, managed={"m1", "m2"}) is None
@@ -0,0 +1,62 @@
+import app.app as app_module
+
+
+class DummyBody:
+    def __init__(self, data):
+        self.data = data
+        self.closed = False
+
+    def iter_chunks(self, size):
+        for i in range(0, len(self.data), size):
+            yield self.data[i:i + size]
+
+    def close(self):
+        self.closed = True
+
+
+def test_download_redirects_to_presigned_url(monkeypatch):
+    monkeypatch.setattr(app_module, "DOWNLOAD_PROXY", False)
+    monkeypatch.setattr(app_module, "object_exists", lambda key: True)
+    monkeypatch.setattr(
+        app_module,
+        "generate_presigned_url",
+        lambda key, ttl, download_name=None: f"https://storage/{key}?name={download_name}",
+    )
+
+    with app_module.app.test_request_context():
+        response = app_module.send_stored_file("Users/a/images.zip", "images.zip", "application/zip")
+
+    assert response.status_code == 302
+    assert response.location == "https://storage/Users/a/images.zip?name=images.zip"
+
+
+def test_proxied_download_streams_ranges(monkeypatch):
+    body = DummyBody(b"x" * 10)
+    requested = {}
+
+    def fake_stream(key, byte_range, if_none_match):
+        requested.update(range=byte_range, etag=if_none_match)
+        return {"Body": body, "ContentLength": 10, "ETag": '"abc"', "ContentRange": "bytes 0-9/100"}
+
+    monkeypatch.setattr(app_module, "DOWNLOAD_PROXY", True)
+    monkeypatch.setattr(app_module, "DOWNLOAD_CHUNK_SIZE", 4)
+    monkeypatch.setattr(app_module, "get_object_stream", fake_stream)
+
+    with app_module.app.test_request_context(headers={"Range": "bytes=0-9"}):
+        response = app_module.send_stored_file("Users/a/images.zip", "images.zip", "application/zip")
+        chunks = list(response.response)
+
+    assert requested == {"range": "bytes=0-9", "etag": None}
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == "bytes 0-9/100"
+    assert response.headers["ETag"] == '"abc"'
+    assert chunks == [b"xxxx", b"xxxx", b"xx"]
+    assert body.closed
+
+
+def test_missing_object_is_not_found(monkeypatch):
+    monkeypatch.setattr(app_module, "DOWNLOAD_PROXY", False)
+    monkeypatch.setattr(app_module, "object_exists", lambda key: False)
+
+    with app_module.app.test_request_context():
+        assert app_module.send_stored_file("Users/a/images.zip", "images.zip", "application/zip") is None
@@ -5,7 +5,7 @@ from PIL import Image
 from openpyxl import load_workbook
 
 sys.path.append(str(Path(__file__).resolve().parents[1]))
-from app.midjourney_runner import MidjourneyRunner
+from app.job_finalizer import create_images_workbook
 
 
 def test_images_are_inserted_into_cells(tmp_path):
@@ -14,9 +14,8 @@ def test_images_are_inserted_into_cells(tmp_path):
     img_path = out_dir / "1_sample.png"
     Image.new("RGB", (60, 40), "red").save(img_path)
 
-    runner = MidjourneyRunner("Test")
     workbook_path = tmp_path / "images.xlsx"
-    runner._create_images_workbook(str(out_dir), str(workbook_path))
+    create_images_workbook(str(out_dir), str(workbook_path))
 
     wb = load_workbook(workbook_path)
     ws = wb.active
@@ -0,0 +1,181 @@
+import app.job_chunks as job_chunks
+
+
+class DummyPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        def _queue(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+        return _queue
+
+    def execute(self):
+        return [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+class DummyRedis:
+    def __init__(self):
+        self.hashes = {}
+
+    def pipeline(self, transaction=True):
+        return DummyPipeline(self)
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        h = self.hashes.setdefault(key, {})
+        if mapping:
+            h.update(mapping)
+        if field is not None:
+            h[field] = value
+
+    def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def hincrby(self, key, field, amount=1):
+        h = self.hashes.setdefault(key, {})
+        h[field] = int(h.get(field, 0)) + amount
+        return h[field]
+
+    def register_script(self, script):
+        # Only the finalizer script is used with this dummy
+        def run(keys, args):
+            done = self.hincrby(keys[0], "done")
+            if done == int(args[1]):
+                self.hset(keys[0], "finalizer", args[0])
+                return 1
+            return 0
+        return run
+
+    def expire(self, key, ttl):
+        pass
+
+    def delete(self, key):
+        self.hashes.pop(key, None)
+
+
+class DummyJob:
+    def __init__(self, job_id, meta, connection, origin="Tier1"):
+        self.id = job_id
+        self.meta = meta
+        self.connection = connection
+        self.origin = origin
+        self.canceled = False
+
+    def cancel(self):
+        self.canceled = True
+
+
+class DummyQueue:
+    def __init__(self, name, connection):
+        self.name = name
+        self.connection = connection
+        self.jobs = []
+
+    def enqueue(self, func, *args, job_id=None, meta=None, **kwargs):
+        job = DummyJob(job_id, meta, self.connection, self.name)
+        self.jobs.append((func, args, job))
+        return job
+
+
+def test_chunk_bounds():
+    assert job_chunks.chunk_bounds(30, 50) == [(0, 30)]
+    assert job_chunks.chunk_bounds(120, 50) == [(0, 50), (50, 100), (100, 120)]
+    assert job_chunks.chunk_bounds(120, 0) == [(0, 120)]
+
+
+def test_chunks_take_turns_until_the_last(monkeypatch):
+    redis = DummyRedis()
+    queue = DummyQueue("Tier1", redis)
+    monkeypatch.setattr(job_chunks, "Queue", lambda name, connection: queue)
+
+    (first,) = job_chunks.start_job(queue, "p1", "a@x", "U1", 120, "https://url", "key", 3, "2024-01-01")
+    assert first.id == "p1"
+    assert first.meta["chunk_count"] == 3
+    assert job_chunks.resolve_job_id(redis, "p1") == "p1"
+
+    second = job_chunks.enqueue_next_chunk(first)
+    assert second.id == "p1-c1"
+    assert (second.meta["chunk_start"], second.meta["chunk_end"]) == (50, 100)
+    assert second.meta["completed_prompts"] == 50
+    # Later chunks read the prompts from storage, not the expiring URL
+    assert queue.jobs[-1][1][2] == "Users/a@x/prompts.xlsx"
+    assert job_chunks.resolve_job_id(redis, "p1") == "p1-c1"
+
+    third = job_chunks.enqueue_next_chunk(second)
+    assert job_chunks.enqueue_next_chunk(third) is None
+
+
+def test_cancel_stops_the_next_chunk(monkeypatch):
+    redis = DummyRedis()
+    queue = DummyQueue("Tier1", redis)
+    monkeypatch.setattr(job_chunks, "Queue", lambda name, connection: queue)
+
+    (first,) = job_chunks.start_job(queue, "p2", "a@x", "All", 200, "https://url", "key")
+    job_chunks.cancel_parent(redis, "p2")
+
+    assert job_chunks.enqueue_next_chunk(first) is None
+    assert len(queue.jobs) == 1
+
+
+def test_get_job_channels():
+    settings = {"CHANNEL ID": "1", "EXTRA CHANNEL IDS": " 2, 3,,1 "}
+    assert job_chunks.get_job_channels(settings) == ["1", "2", "3"]
+    assert job_chunks.get_job_channels({"CHANNEL ID": "1"}) == ["1"]
+
+
+def test_lanes_fan_out_and_the_last_chunk_finalizes(monkeypatch):
+    redis = DummyRedis()
+    queue = DummyQueue("Tier1", redis)
+    monkeypatch.setattr(job_chunks, "Queue", lambda name, connection: queue)
+    monkeypatch.setattr(job_chunks, "MAX_JOB_LANES", 2)
+
+    lanes = job_chunks.start_job(
+        queue, "p3", "a@x", "U1", 160, "https://url", "key", channels=["c1", "c2", "c3"]
+    )
+    assert [job.id for job in lanes] == ["p3", "p3-c1"]
+    assert [job.meta["channel_id"] for job in lanes] == ["c1", "c2"]
+    assert job_chunks.current_chunk_ids(redis, "p3") == ["p3", "p3-c1"]
+    # The dashboard follows a running lane over a queued one
+    redis.hset("rq:job:p3", "status", b"queued")
+    redis.hset("rq:job:p3-c1", "status", b"started")
+    assert job_chunks.resolve_job_id(redis, "p3") == "p3-c1"
+    # Only the running lane shortens the remaining time
+    assert job_chunks.count_running_lanes(redis, "p3") == 1
+
+    # Each lane takes every other chunk on its own channel
+    third = job_chunks.enqueue_next_chunk(lanes[0])
+    assert (third.id, third.meta["channel_id"]) == ("p3-c2", "c1")
+    assert job_chunks.enqueue_next_chunk(lanes[1]).id == "p3-c3"
+    assert job_chunks.enqueue_next_chunk(third) is None
+
+    job_chunks.add_parent_progress(redis, "p3", 50)
+    job_chunks.add_parent_progress(redis, "p3", 50)
+    assert job_chunks.get_parent_progress(redis, "p3") == 100
+
+    # Only the chunk that completes the job finalizes it, whatever its lane
+    last = queue.jobs[-1][2]
+    for job in (lanes[0], lanes[1], last):
+        assert not job_chunks.complete_chunk(redis, job)
+    assert job_chunks.complete_chunk(redis, third)
+    assert job_chunks.is_finalizer(redis, third)
+    assert not job_chunks.is_finalizer(redis, last)
+
+
+def test_finalize_job_keeps_the_user_busy(monkeypatch):
+    redis = DummyRedis()
+    queue = DummyQueue("Tier1", redis)
+    cleared = []
+    monkeypatch.setattr(job_chunks, "clear_job_id", lambda r, email, parent_id: cleared.append(parent_id))
+
+    (first,) = job_chunks.start_job(queue, "p4", "a@x", "U1", 10, "https://url", "key")
+    assert job_chunks.complete_chunk(redis, first)
+    job_chunks.mark_finalizing(redis, "p4", "p4-final")
+
+    # The dashboard and submit check follow the finalize job
+    assert job_chunks.resolve_job_id(redis, "p4") == "p4-final"
+    job_chunks.finish_chunk_on_success(first, redis, True)
+    assert cleared == []
@@ -0,0 +1,136 @@
+import app.job_cleanup as job_cleanup
+
+
+class DummyPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        def _queue(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+        return _queue
+
+    def execute(self):
+        return [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+class DummyRedis:
+    def __init__(self):
+        self.store = {}
+        self.zsets = {}
+
+    def pipeline(self, transaction=True):
+        return DummyPipeline(self)
+
+    def set(self, key, value, ex=None):
+        self.store[key] = value
+
+    def exists(self, key):
+        return int(key in self.store)
+
+    def zadd(self, key, mapping):
+        self.zsets.setdefault(key, {}).update(mapping)
+
+    def zrem(self, key, member):
+        self.zsets.get(key, {}).pop(member, None)
+
+    def zcount(self, key, low, high):
+        return sum(1 for score in self.zsets.get(key, {}).values() if score >= low)
+
+    def expire(self, key, ttl):
+        pass
+
+
+def test_cleanup_waits_for_worker_ack(monkeypatch):
+    dummy = DummyRedis()
+    deleted = []
+
+    def fake_delete_prefix(prefix, exclude, modified_before):
+        assert dummy.exists(job_cleanup.get_cancel_ack_key("job-1"))
+        deleted.append((prefix, exclude, modified_before))
+        return True
+
+    monkeypatch.setattr(job_cleanup, "delete_prefix", fake_delete_prefix)
+    monkeypatch.setattr(job_cleanup, "CLEANUP_ACK_POLL", 0)
+
+    job_cleanup.request_cancel(dummy, "job-1")
+    assert job_cleanup.is_cancel_requested(dummy, "job-1")
+
+    # The worker acknowledges after a few polls; nothing is deleted before that
+    sleeps = []
+
+    def fake_sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) == 3:
+            job_cleanup.acknowledge_cancel(dummy, "job-1")
+
+    monkeypatch.setattr(job_cleanup.time, "sleep", fake_sleep)
+    job_cleanup.cleanup_user_files(dummy, "a@x", running_job_id="job-1", requested_at=1.0)
+
+    assert len(sleeps) == 3
+    prefix, exclude, cutoff = deleted[0]
+    assert prefix == "Users/a@x/"
+    assert exclude == ("Users/a@x/settings.json",)
+    # Everything the worker wrote before acknowledging is covered
+    assert cutoff > 1.0
+
+
+def test_cleanup_without_running_job_keeps_newer_files(monkeypatch):
+    deleted = []
+
+    def fake_delete_prefix(prefix, exclude, modified_before):
+        deleted.append(modified_before)
+        return True
+
+    monkeypatch.setattr(job_cleanup, "delete_prefix", fake_delete_prefix)
+
+    job_cleanup.cleanup_user_files(DummyRedis(), "a@x", requested_at=123.0)
+
+    assert deleted == [123.0]
+
+
+def test_download_lease_lasts_until_the_stream_ends():
+    dummy = DummyRedis()
+    token = job_cleanup.begin_download(dummy, "a@x")
+    stream = job_cleanup.hold_download_lease(dummy, "a@x", token, iter([b"a", b"b"]))
+
+    assert next(stream) == b"a"
+    assert job_cleanup.has_active_downloads(dummy, "a@x")
+    assert list(stream) == [b"b"]
+    assert not job_cleanup.has_active_downloads(dummy, "a@x")
+
+
+def test_cleanup_is_postponed_while_a_download_runs(monkeypatch):
+    dummy = DummyRedis()
+    deleted = []
+    retries = []
+
+    class FakeTimer:
+        def __init__(self, delay, func, args):
+            retries.append(lambda: func(*args))
+
+        def start(self):
+            pass
+
+    class InlinePool:
+        def submit(self, task):
+            task()
+
+    monkeypatch.setattr(job_cleanup, "Timer", FakeTimer)
+    monkeypatch.setattr(job_cleanup, "_cleanup_pool", InlinePool())
+    monkeypatch.setattr(
+        job_cleanup, "delete_prefix", lambda prefix, exclude, modified_before: deleted.append(prefix)
+    )
+
+    token = job_cleanup.begin_download(dummy, "a@x")
+    job_cleanup.schedule_cleanup(dummy, "a@x")
+    assert deleted == []
+    # Nothing is scheduled twice while the first cleanup waits
+    job_cleanup.schedule_cleanup(dummy, "a@x")
+    assert len(retries) == 1
+
+    job_cleanup.end_download(dummy, "a@x", token)
+    retries.pop()()
+    assert deleted == ["Users/a@x/"]
+    assert "a@x" not in job_cleanup._pending
@@ -0,0 +1,115 @@
+import os
+
+from PIL import Image
+
+import app.job_finalizer as job_finalizer
+
+
+class DummyRedis:
+    def __init__(self):
+        self.lists = {}
+
+    def rpush(self, key, *values):
+        self.lists.setdefault(key, []).extend(values)
+
+
+def test_finalize_builds_files_from_the_snapshot(monkeypatch):
+    images = [("Users/a@x/images/1_U1.png", "1_U1.png"), ("Users/a@x/images/2_U1.png", "2_U1.png")]
+    uploaded = {}
+    cleared = []
+
+    def fake_download_files(items):
+        for _, path in items:
+            Image.new("RGB", (4, 4)).save(path)
+        return {key: True for key, _ in items}
+
+    def fake_upload_files(items):
+        for path, key in items:
+            with open(path, "rb") as f:
+                uploaded[key] = f.read()
+        return {key: True for _, key in items}
+
+    monkeypatch.setattr(job_finalizer, "download_files", fake_download_files)
+    monkeypatch.setattr(job_finalizer, "upload_files", fake_upload_files)
+    monkeypatch.setattr(
+        job_finalizer, "get_failed_prompts",
+        lambda redis, parent_id: [{"index": 3, "prompt": "p", "cdn_url": None}],
+    )
+    monkeypatch.setattr(job_finalizer, "record_runtime", lambda *a, **kw: None)
+    monkeypatch.setattr(
+        job_finalizer, "clear_job_id", lambda redis, email, parent_id: cleared.append(parent_id)
+    )
+
+    redis = DummyRedis()
+    assert job_finalizer.finalize_job("a@x", "p1", "U1", "Tier1", images, redis_conn=redis)
+
+    assert set(uploaded) == {"Users/a@x/images.xlsx", "Users/a@x/failed_prompts.json"}
+    assert uploaded["Users/a@x/images.xlsx"].startswith(b"PK")
+    assert b'"index": 3' in uploaded["Users/a@x/failed_prompts.json"]
+    assert any("Execution completed" in msg for msg in redis.lists["user_log:a@x"])
+    # Only now may the user start another job
+    assert cleared == ["p1"]
+
+
+def test_finalize_completes_even_with_missing_images(monkeypatch):
+    images = [("Users/a@x/images/1_U1.png", "1_U1.png"), ("Users/a@x/images/2_U1.png", "2_U1.png")]
+    cleared = []
+
+    def fake_download_files(items):
+        path = items[0][1]
+        Image.new("RGB", (4, 4)).save(path)
+        return {items[0][0]: True, items[1][0]: False}
+
+    monkeypatch.setattr(job_finalizer, "download_files", fake_download_files)
+    monkeypatch.setattr(job_finalizer, "upload_files", lambda items: {key: True for _, key in items})
+    monkeypatch.setattr(job_finalizer, "get_failed_prompts", lambda redis, parent_id: [])
+    monkeypatch.setattr(job_finalizer, "record_runtime", lambda *a, **kw: None)
+    monkeypatch.setattr(
+        job_finalizer, "clear_job_id", lambda redis, email, parent_id: cleared.append(parent_id)
+    )
+
+    redis = DummyRedis()
+    job_finalizer.finalize_job("a@x", "p1", "U1", "Tier1", images, redis_conn=redis)
+
+    log = redis.lists["user_log:a@x"]
+    assert any(msg.startswith("⚠️ 1 images could not be fetched") for msg in log)
+    # The dashboard still finishes the run and starts the downloads
+    assert log[-1].startswith("✅ Execution completed.")
+    assert cleared == ["p1"]
+
+
+def test_finalize_images_prefer_the_job_over_the_user_manifest(monkeypatch):
+    manifest = {"images": [{"file": "9_U1.png", "key": "Users/a@x/images/9_U1.png"}]}
+    monkeypatch.setattr(job_finalizer, "load_manifest", lambda email: manifest)
+    monkeypatch.setattr(job_finalizer, "get_job_images", lambda redis, parent_id: ["5_U2.png"])
+
+    images = job_finalizer.get_finalize_images(None, "a@x", "p1")
+
+    assert images == [("Users/a@x/images/5_U2.png", "5_U2.png")]
+    assert os.path.basename(images[0][0]) == images[0][1]
+
+    # The manifest is only a fallback once the job's image set expired
+    monkeypatch.setattr(job_finalizer, "get_job_images", lambda redis, parent_id: [])
+    assert job_finalizer.get_finalize_images(None, "a@x", "p1") == [
+        ("Users/a@x/images/9_U1.png", "9_U1.png")
+    ]
+
+
+def test_failed_finalize_tells_the_user_and_frees_the_account(monkeypatch):
+    cleared = []
+    monkeypatch.setattr(
+        job_finalizer, "clear_job_id", lambda redis, email, parent_id: cleared.append(parent_id)
+    )
+
+    class Job:
+        id = "p1-final"
+        meta = {"user_email": "a@x", "parent_id": "p1"}
+
+    redis = DummyRedis()
+    job_finalizer.finalize_failed(Job(), redis, RuntimeError, RuntimeError("disk full"), None)
+
+    first, last = redis.lists["user_log:a@x"]
+    assert "disk full" in first
+    # The dashboard stops waiting on this line
+    assert last.startswith("✅ Execution completed.")
+    assert cleared == ["p1"]
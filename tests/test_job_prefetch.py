@@ -0,0 +1,74 @@
+import app.job_prefetch as job_prefetch
+
+
+class DummyPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        def _queue(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+        return _queue
+
+    def execute(self):
+        return [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+class DummyRedis:
+    def __init__(self):
+        self.store = {}
+        self.lists = {}
+
+    def pipeline(self, transaction=True):
+        return DummyPipeline(self)
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.store:
+            return None
+        self.store[key] = value
+        return True
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def exists(self, key):
+        return int(key in self.store)
+
+    def delete(self, key):
+        self.store.pop(key, None)
+
+    def lindex(self, key, index):
+        items = self.lists.get(key, [])
+        return items[index] if items else None
+
+
+def test_prefetch_is_used_once():
+    redis = DummyRedis()
+    job_prefetch.save_prefetch(redis, "j1", {"prompts": ["a", "b"], "user_id": "42"})
+
+    assert job_prefetch.has_prefetch(redis, "j1")
+    assert job_prefetch.pop_prefetch(redis, "j1") == {"prompts": ["a", "b"], "user_id": "42"}
+    assert job_prefetch.pop_prefetch(redis, "j1") is None
+
+
+def test_channel_lock_lets_one_worker_clear():
+    redis = DummyRedis()
+    assert job_prefetch.acquire_channel_lock(redis, "c1")
+    assert not job_prefetch.acquire_channel_lock(redis, "c1")
+
+
+def test_peek_next_job_takes_the_first_non_empty_queue(monkeypatch):
+    redis = DummyRedis()
+    redis.lists["rq:queue:Tier1"] = [b"j2", b"j3"]
+    fetched = []
+
+    def fake_fetch(job_id, connection):
+        fetched.append(job_id)
+        return job_id
+
+    monkeypatch.setattr(job_prefetch.Job, "fetch", fake_fetch)
+
+    assert job_prefetch.peek_next_job(redis, ["Tier3", "Tier1"]) == "j2"
+    assert fetched == ["j2"]
+    assert job_prefetch.peek_next_job(redis, ["Tier3"]) is None
@@ -1,6 +1,7 @@
 import json
 
 import app.app as app_module
+import app.license_cache as license_cache
 
 
 class DummyRedis:
@@ -13,6 +14,15 @@ class DummyRedis:
     def setex(self, key, ttl, value):
         self.store[key] = value
 
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.store:
+            return None
+        self.store[key] = value
+        return True
+
+    def mget(self, keys):
+        return [self.store.get(k) for k in keys]
+
     def delete(self, key):
         self.store.pop(key, None)
 
@@ -29,12 +39,8 @@ def test_cached_license_key_includes_email_and_key(monkeypatch):
     email = "user@example.com"
     license_key = "abc123"
 
-    # Seed old cache entry using the previous key format
-    dummy.setex(f"license_cache:{email}", 10, json.dumps({"success": True}))
-
     info = app_module.get_cached_license_info(email, license_key)
 
-    assert dummy.get(f"license_cache:{email}") is None
     cached = dummy.get(f"license_cache:{email}:{license_key}")
     assert cached is not None
     assert json.loads(cached) == info
@@ -68,3 +74,98 @@ def test_login_bypasses_cached_license(monkeypatch):
     cached = dummy.get(f"license_cache:{email}:{license_key}")
     assert json.loads(cached) == {"success": True}
 
+
+
+def test_failures_are_negatively_cached(monkeypatch):
+    dummy = DummyRedis()
+    monkeypatch.setattr(app_module, "redis_conn", dummy)
+
+    calls = []
+
+    def fake_check_license_and_quota(e, k):
+        calls.append((e, k))
+        return {"success": False, "reason": "Quota check failed"}
+
+    monkeypatch.setattr(app_module, "check_license_and_quota", fake_check_license_and_quota)
+
+    first = app_module.get_cached_license_info("user@example.com", "abc123")
+    second = app_module.get_cached_license_info("user@example.com", "abc123")
+
+    assert first == second == {"success": False, "reason": "Quota check failed"}
+    assert len(calls) == 1
+
+
+def test_stale_entry_is_served_while_refreshing(monkeypatch):
+    dummy = DummyRedis()
+    email = "user@example.com"
+    license_key = "abc123"
+    # Cached value without the freshness marker is stale
+    dummy.setex(
+        f"license_cache:{email}:{license_key}", 300, json.dumps({"success": True, "tier": "Tier1"})
+    )
+    monkeypatch.setattr(app_module, "redis_conn", dummy)
+
+    def fake_check_license_and_quota(e, k):
+        raise AssertionError("lookup should not block the caller")
+
+    monkeypatch.setattr(app_module, "check_license_and_quota", fake_check_license_and_quota)
+
+    refreshes = []
+    monkeypatch.setattr(
+        license_cache, "schedule_refresh", lambda conn, e, k, fetch: refreshes.append((e, k))
+    )
+
+    info = app_module.get_cached_license_info(email, license_key)
+
+    assert info == {"success": True, "tier": "Tier1"}
+    assert refreshes == [(email, license_key)]
+
+
+def test_waiter_uses_result_of_inflight_lookup(monkeypatch):
+    dummy = DummyRedis()
+    email = "user@example.com"
+    license_key = "abc123"
+    # Another process holds the lock; the cache still has an older answer
+    dummy.set(f"license_lock:{email}:{license_key}", "other")
+    dummy.setex(f"license_cache:{email}:{license_key}", 300, json.dumps({"success": True}))
+    dummy.setex(f"license_fresh:{email}:{license_key}", 30, "1")
+    monkeypatch.setattr(license_cache, "LICENSE_LOCK_POLL", 0)
+
+    polls = []
+
+    def fake_sleep(seconds):
+        polls.append(seconds)
+        if len(polls) == 3:
+            # The lock holder finds the license revoked
+            license_cache._store(
+                dummy, email, license_key, {"success": False, "reason": "Revoked"}, "other"
+            )
+
+    monkeypatch.setattr(license_cache.time, "sleep", fake_sleep)
+
+    def fake_fetch(e, k):
+        raise AssertionError("only the lock holder should call the service")
+
+    info = license_cache.get_license_info(dummy, email, license_key, fake_fetch, force_refresh=True)
+
+    # The cached answer from before the forced lookup is never returned
+    assert info == {"success": False, "reason": "Revoked"}
+    assert len(polls) == 3
+
+
+def test_waiter_looks_up_itself_when_the_holder_gave_up(monkeypatch):
+    dummy = DummyRedis()
+    email = "user@example.com"
+    license_key = "abc123"
+    dummy.set(f"license_lock:{email}:{license_key}", "other")
+    dummy.setex(f"license_cache:{email}:{license_key}", 300, json.dumps({"success": True}))
+    dummy.setex(f"license_fresh:{email}:{license_key}", 30, "1")
+    monkeypatch.setattr(license_cache, "LICENSE_LOCK_POLL", 0)
+    # The holder crashed and its lock expired
+    monkeypatch.setattr(license_cache.time, "sleep", lambda s: dummy.delete(f"license_lock:{email}:{license_key}"))
+
+    info = license_cache.get_license_info(
+        dummy, email, license_key, lambda e, k: {"success": True, "tier": "Tier2"}, force_refresh=True
+    )
+
+    assert info == {"success": True, "tier": "Tier2"}
@@ -0,0 +1,63 @@
+import app.app as app_module
+
+
+def _fail_remote(*args, **kwargs):
+    raise AssertionError("license service should not be called")
+
+
+def test_fresh_claim_is_verified_without_io(monkeypatch):
+    monkeypatch.setattr(app_module, "get_cached_license_info", _fail_remote)
+    monkeypatch.setattr(app_module, "redis_conn", None)
+
+    with app_module.app.test_request_context():
+        app_module.session["email"] = "user@example.com"
+        app_module.session["key"] = "abc123"
+        app_module.issue_license_claim(
+            "user@example.com", "abc123", {"success": True, "tier": "Tier2", "jobQuota": 50}
+        )
+
+        info = app_module.ensure_valid_license()
+
+    assert info["success"] is True
+    assert info["tier"] == "Tier2"
+    assert info["jobQuota"] == 50
+
+
+def test_claim_for_other_key_is_rejected(monkeypatch):
+    calls = []
+
+    def fake_cached_license_info(email, key, force_refresh=False):
+        calls.append((email, key, force_refresh))
+        return {"success": False}
+
+    monkeypatch.setattr(app_module, "get_cached_license_info", fake_cached_license_info)
+
+    with app_module.app.test_request_context():
+        app_module.session["email"] = "user@example.com"
+        app_module.session["key"] = "other-key"
+        app_module.issue_license_claim("user@example.com", "abc123", {"success": True})
+
+        assert app_module.ensure_valid_license() is None
+        assert "license_claim" not in app_module.session
+
+    assert calls == [("user@example.com", "other-key", False)]
+
+
+def test_force_refresh_skips_claim(monkeypatch):
+    calls = []
+
+    def fake_cached_license_info(email, key, force_refresh=False):
+        calls.append(force_refresh)
+        return {"success": True, "tier": "Tier3"}
+
+    monkeypatch.setattr(app_module, "get_cached_license_info", fake_cached_license_info)
+
+    with app_module.app.test_request_context():
+        app_module.session["email"] = "user@example.com"
+        app_module.session["key"] = "abc123"
+        app_module.issue_license_claim("user@example.com", "abc123", {"success": True, "tier": "Tier1"})
+
+        info = app_module.ensure_valid_license(force_refresh=True)
+
+    assert calls == [True]
+    assert info["tier"] == "Tier3"
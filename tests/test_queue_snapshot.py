@@ -0,0 +1,187 @@
+import pytest
+
+import app.eta_engine as eta_engine
+import app.queue_snapshot as queue_snapshot
+import app.runtime_stats as runtime_stats
+
+
+@pytest.fixture(autouse=True)
+def clear_runtime_cache():
+    runtime_stats._cache.clear()
+
+
+class DummyPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        def _queue(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+        return _queue
+
+    def execute(self):
+        self.redis.round_trips += 1
+        return [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+class DummyRedis:
+    def __init__(self):
+        self.sets = {}
+        self.lists = {}
+        self.zsets = {}
+        self.scores = {}
+        self.hashes = {}
+        self.published = []
+        self.keys = set()
+        self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        return DummyPipeline(self)
+
+    def smembers(self, key):
+        return self.sets.get(key, set())
+
+    def llen(self, key):
+        return len(self.lists.get(key, []))
+
+    def lrange(self, key, start, end):
+        items = self.lists.get(key, [])
+        return items[start:] if end == -1 else items[start:end + 1]
+
+    def zrange(self, key, start, end):
+        return self.zsets.get(key, [])
+
+    def zadd(self, key, mapping):
+        self.scores.setdefault(key, {}).update(mapping)
+
+    def zrangebyscore(self, key, low, high):
+        return [m for m, score in self.scores.get(key, {}).items() if score >= low]
+
+    def zremrangebyscore(self, key, low, high):
+        scores = self.scores.get(key, {})
+        for member in [m for m, score in scores.items() if score <= high]:
+            scores.pop(member)
+
+    def expire(self, key, ttl):
+        pass
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+
+    def exists(self, key):
+        return int(key in self.keys)
+
+    def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        mapping = dict(mapping or {})
+        if field is not None:
+            mapping[field] = value
+        self.hashes.setdefault(key, {}).update({k: str(v) for k, v in mapping.items()})
+
+    def hdel(self, key, *fields):
+        for field in fields:
+            self.hashes.get(key, {}).pop(field, None)
+
+    def delete(self, key):
+        self.hashes.pop(key, None)
+
+    def incr(self, key):
+        self.version = getattr(self, "version", 0) + 1
+        return self.version
+
+
+def test_snapshot_uses_constant_round_trips(monkeypatch):
+    monkeypatch.setattr(queue_snapshot, "QUEUE_SNAPSHOT_MAX_JOBS", 3)
+    # Runtime percentiles are cached per process, so they are not read here
+    monkeypatch.setattr(queue_snapshot, "get_typical_job_runtime", lambda redis, tier: 300)
+    dummy = DummyRedis()
+    dummy.sets["rq:workers:Tier1"] = {b"rq:worker:alive", b"rq:worker:dead"}
+    dummy.keys.add("rq:worker:alive")
+    dummy.lists["rq:queue:Tier1"] = [f"job-{i}".encode() for i in range(10)]
+    dummy.zsets["rq:wip:Tier1"] = [b"running:exec-1"]
+
+    snapshot = queue_snapshot.build_queue_snapshot(dummy)
+
+    assert dummy.round_trips == 2
+    tier1 = snapshot["Tier1"]
+    assert tier1["workers"] == 1
+    assert tier1["count"] == 10
+    assert tier1["jobs"]["running"] == {"position": 0, "eta_seconds": 0}
+    assert list(tier1["jobs"]) == ["running", "job-0", "job-1", "job-2"]
+    assert tier1["jobs"]["job-2"]["position"] == 3
+    assert snapshot["Tier2"] == {"workers": 0, "count": 0, "tail_eta": 0, "jobs": {}, "stale": []}
+
+
+def test_snapshot_uses_tracked_work(monkeypatch):
+    monkeypatch.setattr(eta_engine.time, "time", lambda: 900.0)
+    dummy = DummyRedis()
+    dummy.sets["rq:workers:Tier1"] = {b"rq:worker:alive"}
+    dummy.keys.add("rq:worker:alive")
+    dummy.lists["rq:queue:Tier1"] = [b"small", b"big"]
+    dummy.zsets["rq:wip:Tier1"] = [b"running:exec-1"]
+    # 10 prompts left, measured 100s ago
+    eta_engine.record_job_work(dummy, "Tier1", "running", "U1", 20, 10)
+    eta_engine.record_job_work(dummy, "Tier1", "small", "All", 2)
+    eta_engine.record_job_work(dummy, "Tier1", "big", "U1", 50)
+    eta_engine.record_job_work(dummy, "Tier1", "gone", "U1", 5)
+    monkeypatch.setattr(queue_snapshot.time, "time", lambda: 1000.0)
+
+    tier1 = queue_snapshot.build_queue_snapshot(dummy)["Tier1"]
+
+    assert tier1["jobs"]["small"]["eta_seconds"] == 420 - 100
+    assert tier1["jobs"]["big"]["eta_seconds"] == 320 + 116
+    assert tier1["tail_eta"] == 436 + 50 * 42
+    assert tier1["stale"] == ["gone"]
+
+    queue_snapshot.store_queue_snapshot(dummy, {"Tier1": tier1})
+    assert "gone" not in dummy.hashes["queue_work:Tier1"]
+
+
+def test_snapshot_skips_a_job_that_reported_finished(monkeypatch):
+    monkeypatch.setattr(queue_snapshot, "get_typical_job_runtime", lambda redis, tier: 300)
+    dummy = DummyRedis()
+    dummy.sets["rq:workers:Tier1"] = {b"rq:worker:alive"}
+    dummy.keys.add("rq:worker:alive")
+    dummy.lists["rq:queue:Tier1"] = [b"next"]
+    # RQ still lists the job until its callbacks ran
+    dummy.zsets["rq:wip:Tier1"] = [b"done:exec-1"]
+    queue_snapshot.publish_queue_event(dummy, "finished", "Tier1", "done")
+
+    tier1 = queue_snapshot.build_queue_snapshot(dummy)["Tier1"]
+
+    assert list(tier1["jobs"]) == ["next"]
+    assert tier1["jobs"]["next"] == {"position": 0, "eta_seconds": 0}
+    assert dummy.published
+
+
+def test_stored_snapshot_is_indexed_by_job():
+    dummy = DummyRedis()
+    snapshot = {
+        "Tier1": {
+            "workers": 2,
+            "count": 1,
+            "jobs": {
+                "running": {"position": 0, "eta_seconds": 0},
+                "queued": {"position": 1, "eta_seconds": 120},
+            },
+        },
+    }
+
+    assert queue_snapshot.store_queue_snapshot(dummy, snapshot) == 1
+    # A stale job from the previous snapshot is dropped
+    dummy.hashes["queue_snapshot:Tier1:jobs"]["old"] = "{}"
+    assert queue_snapshot.store_queue_snapshot(dummy, snapshot) == 2
+
+    header, info = queue_snapshot.get_queue_job_info(dummy, "Tier1", "queued")
+    assert header["workers"] == 2
+    assert header["count"] == 1
+    assert header["running"] == 1
+    assert info == {"position": 1, "eta_seconds": 120}
+    assert queue_snapshot.get_queue_job_info(dummy, "Tier1", "old")[1] is None
+    assert queue_snapshot.get_queue_job_info(dummy, "Tier2", "queued") == ({}, None)
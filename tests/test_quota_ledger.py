@@ -0,0 +1,276 @@
+import json
+
+import app.quota_ledger as quota_ledger
+
+
+class DummyPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        def _queue(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+        return _queue
+
+    def execute(self):
+        return [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+class DummyRedis:
+    """In-memory Redis whose ``register_script`` mirrors the ledger's Lua scripts."""
+
+    def __init__(self):
+        self.hashes = {}
+        self.lists = {}
+        self.zsets = {}
+        self.store = {}
+
+    def pipeline(self, transaction=True):
+        return DummyPipeline(self)
+
+    # -- strings ---------------------------------------------------------
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.store:
+            return None
+        self.store[key] = value
+        return True
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def delete(self, key):
+        self.store.pop(key, None)
+
+    # -- hashes ----------------------------------------------------------
+    def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    def _hnum(self, key, field):
+        return int(self.hashes.get(key, {}).get(field, 0))
+
+    def _hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = value
+
+    # -- lists -----------------------------------------------------------
+    def llen(self, key):
+        return len(self.lists.get(key, []))
+
+    def rpush(self, key, *values):
+        self.lists.setdefault(key, []).extend(values)
+
+    # -- sorted sets -----------------------------------------------------
+    def zrem(self, key, member):
+        self.zsets.get(key, {}).pop(member, None)
+
+    def zcard(self, key):
+        return len(self.zsets.get(key, {}))
+
+    # -- scripts ---------------------------------------------------------
+    def register_script(self, script):
+        return {
+            quota_ledger._RESERVE_SCRIPT: self._reserve,
+            quota_ledger._COMMIT_SCRIPT: self._commit,
+            quota_ledger._RELEASE_SCRIPT: self._release,
+            quota_ledger._CLAIM_BATCH_SCRIPT: self._claim,
+            quota_ledger._RECOVER_SCRIPT: self._recover,
+            quota_ledger._RENEW_LOCK_SCRIPT: self._renew,
+        }[script]
+
+    def _reserve(self, keys, args):
+        key = keys[0]
+        job_id, count, quota, remote = args[0], int(args[1]), int(args[2]), int(args[3])
+        used = max(self._hnum(key, "used"), remote)
+        self._hset(key, "used", used)
+        reserved = self._hnum(key, "reserved")
+        if f"res:{job_id}" in self.hashes[key]:
+            return [1, used, reserved]
+        if used + reserved + count > quota:
+            return [0, used, reserved]
+        self._hset(key, "reserved", reserved + count)
+        self._hset(key, f"res:{job_id}", count)
+        return [1, used, reserved + count]
+
+    def _commit(self, keys, args):
+        key, outbox = keys
+        field, count = f"res:{args[0]}", int(args[1])
+        held = self._hnum(key, field)
+        take = min(held, count)
+        if held > 0:
+            if held - take > 0:
+                self._hset(key, field, held - take)
+            else:
+                self.hashes[key].pop(field)
+            self._hset(key, "reserved", self._hnum(key, "reserved") - take)
+        self._hset(key, "used", self._hnum(key, "used") + count)
+        self.rpush(outbox, args[2])
+        return count
+
+    def _release(self, keys, args):
+        key, field = keys[0], f"res:{args[0]}"
+        held = self._hnum(key, field)
+        if held > 0:
+            self._hset(key, "reserved", self._hnum(key, "reserved") - held)
+        self.hashes.get(key, {}).pop(field, None)
+        return held
+
+    def _claim(self, keys, args):
+        outbox, claimed = keys
+        items = self.lists.get(outbox, [])[: int(args[0])]
+        self.lists[outbox] = self.lists.get(outbox, [])[len(items):]
+        self.zsets.setdefault(claimed, {}).update({item: args[1] for item in items})
+        return items
+
+    def _recover(self, keys, args):
+        outbox, claimed = keys
+        items = [m for m, score in self.zsets.get(claimed, {}).items() if score <= args[0]]
+        for item in items:
+            self.zrem(claimed, item)
+            self.rpush(outbox, item)
+        return len(items)
+
+    def _renew(self, keys, args):
+        return int(self.store.get(keys[0]) == args[0])
+
+
+def test_reserve_is_atomic_and_idempotent():
+    redis = DummyRedis()
+
+    ok, used, day = quota_ledger.reserve_quota(redis, "a@x", "j1", 60, 100)
+    assert (ok, used) == (True, 60)
+    # Re-reserving the same job does not hold the prompts twice
+    assert quota_ledger.reserve_quota(redis, "a@x", "j1", 60, 100)[:2] == (True, 60)
+    # A second job may not overshoot the quota
+    assert quota_ledger.reserve_quota(redis, "a@x", "j2", 50, 100)[:2] == (False, 60)
+
+    ledger = redis.hashes[quota_ledger.get_quota_ledger_key("a@x", day)]
+    assert ledger["reserved"] == 60
+
+
+def test_reserve_never_trusts_less_than_the_license_service():
+    redis = DummyRedis()
+
+    ok, used, _ = quota_ledger.reserve_quota(redis, "a@x", "j1", 30, 100, remote_used=80)
+
+    assert (ok, used) == (False, 80)
+
+
+def test_commit_turns_the_reservation_into_usage_and_queues_a_report():
+    redis = DummyRedis()
+    _, _, day = quota_ledger.reserve_quota(redis, "a@x", "j1", 60, 100)
+
+    quota_ledger.commit_quota(redis, "a@x", "key", "j1", 50, day)
+    assert quota_ledger.get_quota_used(redis, "a@x") == 50
+    # The unused part of the reservation is returned
+    assert quota_ledger.release_quota(redis, "a@x", "j1", day) == 10
+    assert quota_ledger.release_quota(redis, "a@x", "j1", day) == 0
+
+    ledger = redis.hashes[quota_ledger.get_quota_ledger_key("a@x", day)]
+    assert ledger["reserved"] == 0
+    (report,) = redis.lists[quota_ledger.QUOTA_OUTBOX_KEY]
+    assert json.loads(report)["count"] == 50
+
+
+def test_release_on_failure_uses_the_parent_reservation():
+    redis = DummyRedis()
+    _, _, day = quota_ledger.reserve_quota(redis, "a@x", "p1", 60, 100)
+
+    class Job:
+        id = "p1-c1"
+        meta = {"user_email": "a@x", "parent_id": "p1", "quota_day": day}
+
+    quota_ledger.release_quota_on_failure(Job(), redis, None, None, None)
+
+    assert redis.hashes[quota_ledger.get_quota_ledger_key("a@x", day)]["reserved"] == 0
+
+
+def test_flush_sends_one_request_per_user_and_requeues_failures(monkeypatch):
+    redis = DummyRedis()
+    for email, count in (("a@x", 10), ("a@x", 5), ("b@x", 7)):
+        quota_ledger.commit_quota(redis, email, "key", "j", count)
+    posted = []
+
+    def fake_post(email, key, count, report_ids):
+        posted.append((email, count, len(report_ids)))
+        return email == "a@x"
+
+    monkeypatch.setattr(quota_ledger, "_post_usage", fake_post)
+
+    assert quota_ledger.flush_quota_outbox(redis) == 2
+    # Each request names its reports so a resend is not counted twice
+    assert sorted(posted) == [("a@x", 15, 2), ("b@x", 7, 1)]
+    assert redis.zsets[quota_ledger.QUOTA_OUTBOX_PROCESSING_KEY] == {}
+    (retry,) = redis.lists[quota_ledger.QUOTA_OUTBOX_KEY]
+    assert json.loads(retry)["attempts"] == 1
+    # The lock is released for the next flush
+    assert quota_ledger.QUOTA_FLUSH_LOCK_KEY not in redis.store
+
+
+def test_flush_recovers_reports_left_by_a_crashed_flusher(monkeypatch):
+    redis = DummyRedis()
+    claimed = redis.zsets.setdefault(quota_ledger.QUOTA_OUTBOX_PROCESSING_KEY, {})
+    claimed[json.dumps({"id": "old", "email": "a@x", "key": "key", "count": 3})] = 0
+    # Claimed just now by a flusher that is still sending it
+    in_flight = json.dumps({"id": "new", "email": "b@x", "key": "key", "count": 4})
+    claimed[in_flight] = quota_ledger.time.time()
+    posted = []
+    monkeypatch.setattr(
+        quota_ledger, "_post_usage", lambda email, key, count, report_ids: posted.append(report_ids) or True
+    )
+
+    assert quota_ledger.flush_quota_outbox(redis) == 1
+    assert posted == [["old"]]
+    assert redis.lists[quota_ledger.QUOTA_OUTBOX_KEY] == []
+    assert list(claimed) == [in_flight]
+
+
+def test_flush_stops_once_it_lost_the_lock(monkeypatch):
+    redis = DummyRedis()
+    for email in ("a@x", "b@x"):
+        quota_ledger.commit_quota(redis, email, "key", "j", 5)
+    posted = []
+
+    def fake_post(email, key, count, report_ids):
+        posted.append(email)
+        # Another flusher took over while this request was slow
+        redis.store[quota_ledger.QUOTA_FLUSH_LOCK_KEY] = "other"
+        return True
+
+    monkeypatch.setattr(quota_ledger, "_post_usage", fake_post)
+
+    assert quota_ledger.flush_quota_outbox(redis) == 1
+    assert posted == ["a@x"]
+    # The unsent report stays claimed and the other flusher's lock is kept
+    assert redis.zcard(quota_ledger.QUOTA_OUTBOX_PROCESSING_KEY) == 1
+    assert redis.store[quota_ledger.QUOTA_FLUSH_LOCK_KEY] == "other"
+
+
+def test_flush_is_skipped_while_another_flusher_holds_the_lock():
+    redis = DummyRedis()
+    redis.set(quota_ledger.QUOTA_FLUSH_LOCK_KEY, "other")
+    redis.rpush(quota_ledger.QUOTA_OUTBOX_KEY, "{}")
+
+    assert quota_ledger.flush_quota_outbox(redis) == 0
+    assert redis.lists[quota_ledger.QUOTA_OUTBOX_KEY] == ["{}"]
+
+
+def test_background_flusher_retries_pending_reports(monkeypatch):
+    redis = DummyRedis()
+    redis.rpush(quota_ledger.QUOTA_OUTBOX_KEY, "{}")
+    flushed = []
+
+    class Stop(Exception):
+        pass
+
+    def fake_sleep(seconds):
+        raise Stop
+
+    monkeypatch.setattr(quota_ledger, "flush_quota_outbox", lambda r: flushed.append(r))
+    monkeypatch.setattr(quota_ledger.time, "sleep", fake_sleep)
+
+    try:
+        quota_ledger.run_quota_flusher(redis, interval=1)
+    except Stop:
+        pass
+
+    assert flushed == [redis]
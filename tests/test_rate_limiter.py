@@ -0,0 +1,62 @@
+import app.rate_limiter as rate_limiter
+
+
+class DummyResponse:
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self._body = body
+        self.headers = headers or {}
+
+    def json(self):
+        if self._body is None:
+            raise ValueError("no body")
+        return self._body
+
+
+def test_parse_rate_limits():
+    limits = rate_limiter.parse_rate_limits("interactions:0.5/2, deletes:2,bad:x,off:0/1")
+    assert limits == {"interactions": (0.5, 2.0), "deletes": (2.0, 1.0)}
+
+
+def test_get_retry_after():
+    assert rate_limiter.get_retry_after(DummyResponse(429, {"retry_after": 2.5})) == (2.5, False)
+    assert rate_limiter.get_retry_after(
+        DummyResponse(429, {"retry_after": 1, "global": True})
+    ) == (1.0, True)
+    assert rate_limiter.get_retry_after(DummyResponse(429, headers={"Retry-After": "3"})) == (3.0, False)
+
+
+def test_429_blocks_the_bucket_and_retries(monkeypatch):
+    acquired, blocked = [], []
+    responses = [DummyResponse(429, {"retry_after": 2}), DummyResponse(204)]
+
+    monkeypatch.setattr(
+        rate_limiter, "acquire", lambda redis, account, route: acquired.append((account, route))
+    )
+    monkeypatch.setattr(
+        rate_limiter, "block",
+        lambda redis, account, routes, seconds: blocked.append((list(routes), seconds)),
+    )
+    monkeypatch.setattr(rate_limiter.requests, "request", lambda *a, **kw: responses.pop(0))
+
+    res = rate_limiter.discord_request(
+        None, "POST", "https://discord.com/api/v9/interactions", "interactions",
+        headers={"Authorization": "secret"},
+    )
+
+    assert res.status_code == 204
+    account = rate_limiter.get_account_hash("secret")
+    assert "secret" not in account
+    assert acquired == [(account, "interactions")] * 2
+    assert blocked == [(["interactions"], 2.0)]
+
+
+def test_acquire_waits_for_a_token(monkeypatch):
+    waits = [1.5, 0]
+    sleeps = []
+    monkeypatch.setattr(rate_limiter, "take_token", lambda redis, account, route: waits.pop(0))
+    monkeypatch.setattr(rate_limiter.time, "sleep", sleeps.append)
+
+    rate_limiter.acquire(None, "acct", "messages")
+
+    assert sleeps == [1.5]
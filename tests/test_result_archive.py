@@ -0,0 +1,52 @@
+import io
+import zipfile
+
+import pytest
+
+from app.result_archive import build_manifest, select_images, stream_zip
+
+
+class DummyBody:
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+
+    def iter_chunks(self, size):
+        while chunk := self.stream.read(size):
+            yield chunk
+
+    def close(self):
+        pass
+
+
+def test_manifest_filters():
+    files = ["1_U1.png", "1_U2.png", "2_U1.png", "3_U1.png", "3_U2.png"]
+    manifest = build_manifest("a@x", files, failed=[{"index": 3, "prompt": "p"}])
+
+    assert manifest["images"][0] == {"file": "1_U1.png", "key": "Users/a@x/images/1_U1.png", "index": 1, "variant": "U1"}
+    assert [e["file"] for e in select_images(manifest, variants={"U2"})] == ["1_U2.png", "3_U2.png"]
+    assert [e["file"] for e in select_images(manifest, start=2, end=3)] == ["2_U1.png", "3_U1.png", "3_U2.png"]
+    assert [e["file"] for e in select_images(manifest, failed_only=True)] == ["3_U1.png", "3_U2.png"]
+
+
+def test_zip_is_streamed_from_objects():
+    objects = {"k/1_U1.png": b"a" * 3000, "k/2_U1.png": b"b" * 10}
+    entries = [
+        {"file": "1_U1.png", "key": "k/1_U1.png"},
+        {"file": "2_U1.png", "key": "k/2_U1.png"},
+    ]
+
+    def open_stream(key):
+        return {"Body": DummyBody(objects[key])} if key in objects else None
+
+    chunks = list(stream_zip(entries, open_stream))
+    assert len(chunks) > 1
+
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+    assert archive.namelist() == ["1_U1.png", "2_U1.png"]
+    assert archive.read("1_U1.png") == objects["k/1_U1.png"]
+    assert archive.testzip() is None
+
+    # A missing image aborts the download instead of leaving it out
+    entries.insert(1, {"file": "missing.png", "key": "k/missing.png"})
+    with pytest.raises(FileNotFoundError):
+        list(stream_zip(entries, open_stream))
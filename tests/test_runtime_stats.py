@@ -0,0 +1,81 @@
+from collections import OrderedDict
+
+import app.eta_engine as eta_engine
+import app.runtime_stats as runtime_stats
+
+
+class DummyPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        def _queue(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+        return _queue
+
+    def execute(self):
+        self.redis.round_trips += 1
+        return [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+class DummyRedis:
+    def __init__(self):
+        self.hashes = {}
+        self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        return DummyPipeline(self)
+
+    def hincrby(self, key, field, amount):
+        fields = self.hashes.setdefault(key, {})
+        fields[str(field)] = fields.get(str(field), 0) + amount
+
+    def expire(self, key, ttl):
+        pass
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+
+def test_percentile_prefers_most_specific_scope(monkeypatch):
+    monkeypatch.setattr(runtime_stats, "_cache", OrderedDict())
+    monkeypatch.setattr(runtime_stats, "RUNTIME_STATS_MIN_SAMPLES", 10)
+    dummy = DummyRedis()
+    runtime_stats.record_runtime(dummy, "prompt", 90, mode="U1", tier="Tier1", account="a@x", count=10)
+    runtime_stats.record_runtime(dummy, "prompt", 30, mode="U1", tier="Tier2", account="b@x", count=30)
+
+    # Account a@x has enough samples of its own
+    own = runtime_stats.get_runtime_percentile(dummy, "prompt", 42, mode="U1", tier="Tier1", account="a@x")
+    assert 81 <= own <= 99
+    # A new account on Tier2 follows its tier
+    tier2 = runtime_stats.get_runtime_percentile(dummy, "prompt", 42, mode="U1", tier="Tier2", account="c@x")
+    assert 27 <= tier2 <= 33
+    # No data for the mode at all: the constant is used
+    assert runtime_stats.get_runtime_percentile(dummy, "prompt", 58, mode="All") == 58
+
+    # Lookups are cached per process
+    trips = dummy.round_trips
+    runtime_stats.get_runtime_percentile(dummy, "prompt", 42, mode="U1", tier="Tier1", account="a@x")
+    assert dummy.round_trips == trips
+
+
+def test_job_estimate_falls_back_to_mode_runtime(monkeypatch):
+    monkeypatch.setattr(runtime_stats, "_cache", OrderedDict())
+    dummy = DummyRedis()
+    assert eta_engine.estimate_job_seconds(dummy, "All", 10) == 580
+    assert eta_engine.get_typical_job_runtime(dummy, "Tier1") == eta_engine.TYPICAL_JOB_RUNTIME
+
+
+def test_cache_keeps_the_most_recently_used_lookups(monkeypatch):
+    monkeypatch.setattr(runtime_stats, "_cache", OrderedDict())
+    monkeypatch.setattr(runtime_stats, "RUNTIME_STATS_CACHE_SIZE", 2)
+    dummy = DummyRedis()
+
+    for account in ("a@x", "b@x"):
+        runtime_stats.get_runtime_percentile(dummy, "prompt", 42, mode="U1", account=account)
+    # a@x is used again, so b@x is the one evicted
+    runtime_stats.get_runtime_percentile(dummy, "prompt", 42, mode="U1", account="a@x")
+    runtime_stats.get_runtime_percentile(dummy, "prompt", 42, mode="U1", account="c@x")
+
+    assert [key[3] for key in runtime_stats._cache] == ["a@x", "c@x"]
@@ -0,0 +1,149 @@
+import json
+from io import BytesIO
+
+import app.settings_store as settings_store
+
+
+class DummyRedis:
+    """In-memory Redis whose ``register_script`` mirrors the settings Lua scripts."""
+
+    def __init__(self):
+        self.hashes = {}
+        self.store = {}
+
+    def hmget(self, key, *fields):
+        h = self.hashes.get(key, {})
+        return [h.get(f) for f in fields]
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def delete(self, key):
+        self.hashes.pop(key, None)
+
+    def register_script(self, script):
+        return {
+            settings_store._SAVE_SCRIPT: self._save,
+            settings_store._FILL_SCRIPT: self._fill,
+        }[script]
+
+    def _save(self, keys, args):
+        cache_key, version_key = keys
+        self.store[version_key] = self.store.get(version_key, 0) + 1
+        self.hashes[cache_key] = {"data": args[0], "version": self.store[version_key]}
+        return self.store[version_key]
+
+    def _fill(self, keys, args):
+        cache_key, version_key = keys
+        version = self.store.get(version_key, 0)
+        if version != int(args[2]):
+            return -1
+        cached = self.hashes.get(cache_key, {})
+        if args[3] != "1" and "data" in cached and cached["version"] >= version:
+            return cached["version"]
+        self.hashes[cache_key] = {"data": args[0], "version": version}
+        return version
+
+
+class BrokenRedis(DummyRedis):
+    def register_script(self, script):
+        def fail(keys, args):
+            raise ConnectionError("redis down")
+        return fail
+
+
+def fake_storage(monkeypatch, stored):
+    downloads = []
+
+    def fake_download(key):
+        downloads.append(key)
+        return BytesIO(json.dumps(stored[key]).encode()) if key in stored else None
+
+    def fake_upload(obj, key):
+        stored[key] = json.loads(obj.read())
+        return True
+
+    monkeypatch.setattr(settings_store, "download_file_obj", fake_download)
+    monkeypatch.setattr(settings_store, "upload_file_obj", fake_upload)
+    return downloads
+
+
+def test_cache_hit_skips_storage(monkeypatch):
+    stored = {}
+    downloads = fake_storage(monkeypatch, stored)
+    redis = DummyRedis()
+
+    assert settings_store.save_user_settings(redis, "a@x", {"CHANNEL ID": "1"}) == 1
+    assert settings_store.load_user_settings(redis, "a@x") == ({"CHANNEL ID": "1"}, 1)
+    assert downloads == []
+
+
+def test_miss_fills_the_cache_from_storage(monkeypatch):
+    stored = {"Users/a@x/settings.json": {"CHANNEL ID": "1"}}
+    downloads = fake_storage(monkeypatch, stored)
+    redis = DummyRedis()
+
+    assert settings_store.load_user_settings(redis, "a@x") == ({"CHANNEL ID": "1"}, 0)
+    settings_store.load_user_settings(redis, "a@x")
+    assert len(downloads) == 1
+
+
+def test_stale_version_is_refetched(monkeypatch):
+    stored = {}
+    downloads = fake_storage(monkeypatch, stored)
+    redis = DummyRedis()
+    assert settings_store.save_user_settings(redis, "a@x", {"CHANNEL ID": "1"}) == 1
+
+    # Another web process saved version 2 but this cache still holds version 1
+    stored["Users/a@x/settings.json"] = {"CHANNEL ID": "2"}
+    redis.store[settings_store.get_settings_version_key("a@x")] = 2
+
+    settings, version = settings_store.load_user_settings(redis, "a@x", min_version=2)
+
+    assert (settings, version) == ({"CHANNEL ID": "2"}, 2)
+    assert downloads == ["Users/a@x/settings.json"]
+    assert json.loads(redis.hashes[settings_store.get_settings_cache_key("a@x")]["data"]) == settings
+
+
+def test_save_during_a_refetch_is_not_cached_with_old_settings(monkeypatch):
+    stored = {}
+    fake_storage(monkeypatch, stored)
+    redis = DummyRedis()
+    settings_store.save_user_settings(redis, "a@x", {"CHANNEL ID": "1"})
+    redis.hashes.clear()
+    download = settings_store.download_file_obj
+
+    def slow_download(key):
+        stream = download(key)
+        # A save lands after the old copy was read
+        settings_store.save_user_settings(redis, "a@x", {"CHANNEL ID": "2"})
+        return stream
+
+    monkeypatch.setattr(settings_store, "download_file_obj", slow_download)
+
+    assert settings_store.load_user_settings(redis, "a@x") == ({"CHANNEL ID": "1"}, 1)
+    # The cache keeps the save's own payload under its version
+    cached = redis.hashes[settings_store.get_settings_cache_key("a@x")]
+    assert (json.loads(cached["data"]), cached["version"]) == ({"CHANNEL ID": "2"}, 2)
+
+
+def test_failed_upload_keeps_the_cached_settings(monkeypatch):
+    fake_storage(monkeypatch, {})
+    redis = DummyRedis()
+    settings_store.save_user_settings(redis, "a@x", {"CHANNEL ID": "1"})
+    monkeypatch.setattr(settings_store, "upload_file_obj", lambda obj, key: False)
+
+    assert settings_store.save_user_settings(redis, "a@x", {"CHANNEL ID": "2"}) is None
+    assert settings_store.load_user_settings(redis, "a@x") == ({"CHANNEL ID": "1"}, 1)
+
+
+def test_failed_cache_update_drops_the_cache(monkeypatch):
+    stored = {}
+    fake_storage(monkeypatch, stored)
+    redis = BrokenRedis()
+    redis.hashes[settings_store.get_settings_cache_key("a@x")] = {"data": "{}", "version": 1}
+
+    assert settings_store.save_user_settings(redis, "a@x", {"CHANNEL ID": "2"}) == 0
+    # Storage has the new copy and readers no longer see the old one
+    assert stored["Users/a@x/settings.json"] == {"CHANNEL ID": "2"}
+    assert settings_store.get_settings_cache_key("a@x") not in redis.hashes
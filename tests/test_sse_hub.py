@@ -0,0 +1,34 @@
+from app.sse_hub import SSEHub
+
+
+def test_dispatch_builds_once_per_key_and_skips_unchanged():
+    calls = []
+    state = {"eta": 5}
+
+    def build(key):
+        calls.append(key)
+        return f"{key}:{state['eta']}"
+
+    hub = SSEHub(None, "queue_updates", build)
+    hub._ensure_listener = lambda: None
+    first = hub.stream(("Tier1", "a@x", "job-1"))
+    second = hub.stream(("Tier1", "a@x", "job-1"))
+    assert next(first) == "data: ('Tier1', 'a@x', 'job-1'):5\n\n"
+    assert next(second) == "data: ('Tier1', 'a@x', 'job-1'):5\n\n"
+    calls.clear()
+
+    # Same snapshot version twice and an unchanged payload send nothing
+    hub.dispatch(b"3")
+    hub.dispatch(b"3")
+    assert calls == [("Tier1", "a@x", "job-1")]
+    assert all(c.messages.empty() for c in hub._clients[("Tier1", "a@x", "job-1")])
+
+    state["eta"] = 2
+    hub.dispatch(b"worker_status")
+    assert len(calls) == 2
+    assert next(first).endswith(":2\n\n")
+    assert next(second).endswith(":2\n\n")
+
+    first.close()
+    second.close()
+    assert hub._clients == {}
@@ -0,0 +1,67 @@
+from botocore.exceptions import EndpointConnectionError
+from boto3.exceptions import S3UploadFailedError
+
+import app.tigris_utils as tigris_utils
+
+
+class DummyS3:
+    def __init__(self, keys):
+        self.keys = set(keys)
+        self.delete_calls = []
+
+    def get_paginator(self, name):
+        s3 = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                keys = sorted(k for k in s3.keys if k.startswith(Prefix))
+                for i in range(0, len(keys), 2):
+                    yield {"Contents": [{"Key": k} for k in keys[i:i + 2]]}
+
+        return Paginator()
+
+    def delete_objects(self, Bucket, Delete):
+        batch = [o["Key"] for o in Delete["Objects"]]
+        self.delete_calls.append(batch)
+        self.keys.difference_update(batch)
+        return {}
+
+
+def test_delete_prefix_uses_batched_bulk_deletes(monkeypatch):
+    keys = [f"Users/a/images/{i}_U1.png" for i in range(5)] + ["Users/a/settings.json", "Users/b/x.png"]
+    dummy = DummyS3(keys)
+    monkeypatch.setattr(tigris_utils, "s3", dummy)
+    monkeypatch.setattr(tigris_utils, "DELETE_BATCH_SIZE", 2)
+
+    assert tigris_utils.delete_prefix("Users/a/", exclude=("Users/a/settings.json",))
+
+    assert dummy.keys == {"Users/a/settings.json", "Users/b/x.png"}
+    assert [len(batch) for batch in dummy.delete_calls] == [2, 2, 1]
+
+
+def test_upload_files_reports_each_key(monkeypatch):
+    monkeypatch.setattr(tigris_utils, "upload_file_path", lambda path, key: not path.endswith("bad"))
+
+    results = tigris_utils.upload_files([("a.png", "k/a.png"), ("bad", "k/bad"), ("c.png", "k/c.png")])
+
+    assert results == {"k/a.png": True, "k/bad": False, "k/c.png": True}
+
+
+class FailingS3:
+    def upload_file(self, file_path, bucket, key, Config=None):
+        if "bad" in key:
+            raise S3UploadFailedError("upload failed")
+
+    def download_file(self, bucket, key, file_path, Config=None):
+        if "bad" in key:
+            raise EndpointConnectionError(endpoint_url="https://storage")
+
+
+def test_transfer_errors_are_reported_per_key(monkeypatch):
+    monkeypatch.setattr(tigris_utils, "s3", FailingS3())
+
+    uploads = tigris_utils.upload_files([("a.png", "k/a.png"), ("b.png", "k/bad.png")])
+    downloads = tigris_utils.download_files([("k/a.png", "a.png"), ("k/bad.png", "b.png")])
+
+    assert uploads == {"k/a.png": True, "k/bad.png": False}
+    assert downloads == {"k/a.png": True, "k/bad.png": False}
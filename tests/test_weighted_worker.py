@@ -0,0 +1,24 @@
+import random
+from collections import Counter
+
+from app.weighted_worker import parse_queue_weights, weighted_order
+
+
+def test_parse_queue_weights_skips_bad_items():
+    assert parse_queue_weights("Tier3:6, Tier2:x,,default:0") == {"Tier3": 6.0, "default": 0.0}
+
+
+def test_weighted_order_favours_heavy_queues_without_starving():
+    rng = random.Random(1)
+    weights = {"Tier3": 6, "Tier2": 3, "Tier1": 1}
+    firsts = Counter(
+        weighted_order(["Tier1", "Tier2", "Tier3"], weights, rng)[0] for _ in range(10000)
+    )
+
+    assert firsts["Tier3"] > firsts["Tier2"] > firsts["Tier1"] > 500
+    assert abs(firsts["Tier3"] / 10000 - 0.6) < 0.03
+
+
+def test_weighted_order_puts_zero_weight_last():
+    order = weighted_order(["default", "Tier1"], {"default": 0}, random.Random(2))
+    assert order == ["Tier1", "default"]
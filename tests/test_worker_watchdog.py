@@ -0,0 +1,45 @@
+import json
+
+import app.app as app_module
+
+
+class DummyRedis:
+    def __init__(self):
+        self.store = {}
+        self.published = []
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def setex(self, key, ttl, value):
+        self.store[key] = value
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+
+
+def test_watchdog_reports_no_workers(monkeypatch):
+    dummy = DummyRedis()
+    monkeypatch.setattr(app_module, "redis_conn", dummy)
+    monkeypatch.setattr(app_module, "get_active_worker_count", lambda *a, **k: 0)
+
+    email = "user@example.com"
+    app_module.watch_worker_availability(email, "job-1", "Tier1", timeout=0, poll=0)
+
+    data = json.loads(dummy.get(app_module.get_worker_status_key(email)))
+    assert data == {"job_id": "job-1", "queue": "Tier1", "status": "no_workers"}
+    assert app_module.get_worker_status(email, "job-1") == "no_workers"
+    # Status for another job is ignored
+    assert app_module.get_worker_status(email, "job-2") is None
+    assert dummy.published
+
+
+def test_watchdog_reports_ready_when_worker_present(monkeypatch):
+    dummy = DummyRedis()
+    monkeypatch.setattr(app_module, "redis_conn", dummy)
+    monkeypatch.setattr(app_module, "get_active_worker_count", lambda *a, **k: 1)
+
+    email = "user@example.com"
+    app_module.watch_worker_availability(email, "job-1", "Tier1", timeout=10, poll=0)
+
+    assert app_module.get_worker_status(email, "job-1") == "ready"